@@ -8,4 +8,9 @@ from .get_model import get_model, get_model_config
 from .onedconcat import OneDConcat, OneDConcatModel
 from .twodpermuteconcat import TwoDPermuteConcat, TwoDPermuteConcatModel
 from .twodpermuteconcatmultiscale import MultiScale2DPermuteConcat
-from .arch_utils import calculate_1d_vec_channels
\ No newline at end of file
+from .arch_utils import (
+    calculate_1d_vec_channels,
+    checkpoint_stage,
+    checkpoint_stages,
+    to_channels_last_3d,
+)
@@ -1,6 +1,10 @@
 """arch utils"""
 from typing import Sequence
 
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint, checkpoint_sequential
+
 
 def calculate_1d_vec_channels(
     spatial_dims, image_size, encoder_strides: Sequence, encoder_last_channel
@@ -19,6 +23,39 @@ def calculate_1d_vec_channels(
     return int(decoded_cube_channels)
 
 
+def to_channels_last_3d(model: nn.Module) -> nn.Module:
+    """store 5D weights (3D convolutions) in channels_last_3d memory format.
+    2D encoders of the parallel-head models keep their 4D weights as they are,
+    `nn.Module.to(memory_format=...)` would fail on them."""
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if tensor.dim() == 5:
+            tensor.data = tensor.data.contiguous(memory_format=torch.channels_last_3d)
+    return model
+
+
+def _use_checkpointing(module: nn.Module) -> bool:
+    """recomputation only pays off when there is a backward pass"""
+    return module.training and torch.is_grad_enabled()
+
+
+def checkpoint_stages(stages: nn.Sequential, segments: int, x: torch.Tensor):
+    """run decoder stages with activation checkpointing: only the inputs of the
+    `segments` chunks are kept alive in the forward pass, the activations inside
+    each chunk are recomputed during backward. `segments=0` runs the stages as usual"""
+    if segments <= 0 or not _use_checkpointing(stages):
+        return stages(x)
+    return checkpoint_sequential(
+        stages, min(segments, len(stages)), x, use_reentrant=False
+    )
+
+
+def checkpoint_stage(stage: nn.Module, enabled: bool, x: torch.Tensor):
+    """run a single stage with activation checkpointing"""
+    if not enabled or not _use_checkpointing(stage):
+        return stage(x)
+    return checkpoint(stage, x, use_reentrant=False)
+
+
 if __name__ == "__main__":
     from monai.networks.layers.convutils import (calculate_out_shape,
                                                  same_padding)
@@ -16,12 +16,14 @@ from monai.networks.blocks.convolutions import Convolution
 from monai.networks.layers.convutils import calculate_out_shape, same_padding
 from monai.networks.nets.autoencoder import AutoEncoder
 from torch import nn
+from .arch_utils import checkpoint_stages
 from ..utils.registry import ARCHITECTURES
 
 @ARCHITECTURES.register('CustomAutoEncoder')
 class CustomAutoEncoder(AutoEncoder):
     """Simple encoder consisting of multiple layers of Convolutions
-    and a fully connected layer in the end to obtain a 1D embedding vector
+    and a fully connected layer in the end to obtain a 1D embedding vector.
+    `checkpoint_segments > 0` checkpoints the activations of the 3D decoder
     """
 
     def __init__(
@@ -43,6 +45,7 @@ class CustomAutoEncoder(AutoEncoder):
         norm: Union[Tuple, str] = "INSTANCE",
         dropout: Optional[Union[Tuple, str, float]] = None,
         bias: bool = True,
+        checkpoint_segments: int = 0,
     ) -> None:
         super().__init__(
             spatial_dims,
@@ -81,12 +84,13 @@ class CustomAutoEncoder(AutoEncoder):
             nn.Linear(latent_dim, np.prod((channels[-1], *self.enc_conv_out_shape)))
         )
 
+        self.checkpoint_segments = checkpoint_segments
         self._initialize_weights()
 
     def latent_vec_decode(self, latent_vec):
         x = self.bottleneck_fcn_decode(latent_vec)
         x = x.reshape(x.shape[0], -1, *self.enc_conv_out_shape)
-        pred_logits = self.decode(x)
+        pred_logits = checkpoint_stages(self.decode, self.checkpoint_segments, x)
         return pred_logits
 
     def forward(self, x):
@@ -19,10 +19,12 @@ from ..architectures import name2arch
 for model in [Unet,UNETR,SwinUNETR,AttentionUnet]:
     name2arch[model.__name__] = model
 
-def get_model(model_name, image_size, dropout=False) -> nn.Module:
+def get_model(model_name, image_size, dropout=False, checkpoint_segments=0) -> nn.Module:
     """return encoder-decoder model"""
     if model_name in name2arch:
-        return name2arch[model_name](**get_model_config(model_name,image_size,dropout))
+        return name2arch[model_name](
+            **get_model_config(model_name, image_size, dropout, checkpoint_segments)
+        )
 
     # if model_name in (OneDConcat.__name__, "OneDConcatModel"):
         # return OneDConcat(get_1dconcatmodel_config(image_size, dropout))
@@ -56,26 +58,44 @@ def get_model(model_name, image_size, dropout=False) -> nn.Module:
     raise ValueError(f"invalid model name {model_name}")
 
 
-def get_model_config(model_name, image_size, dropout=False):
-    """model parameters"""
+# models whose 3D decoder supports activation checkpointing
+CHECKPOINTABLE_MODELS = (
+    OneDConcat.__name__,
+    "OneDConcatModel",
+    TwoDPermuteConcat.__name__,
+    "TwoDPermuteConcatModel",
+    MultiScale2DPermuteConcat.__name__,
+    CustomAutoEncoder.__name__,
+    SwinUNETR.__name__,
+)
+
+
+def get_model_config(model_name, image_size, dropout=False, checkpoint_segments=0):
+    """model parameters
+    checkpoint_segments: recompute decoder activations during backward instead of
+    keeping them alive, trades compute for memory. 0 disables checkpointing."""
+    if checkpoint_segments and model_name not in CHECKPOINTABLE_MODELS:
+        raise ValueError(
+            f"activation checkpointing is supported for {CHECKPOINTABLE_MODELS}, got {model_name}"
+        )
     if model_name in (OneDConcat.__name__, "OneDConcatModel"):
-        return get_1dconcatmodel_config(image_size, dropout)
+        return get_1dconcatmodel_config(image_size, dropout, checkpoint_segments)
     elif model_name == AttentionUnet.__name__:
         return get_attunet_config(dropout)
     elif model_name == SwinUNETR.__name__:
-        return get_swinunetr_config(image_size, dropout)
+        return get_swinunetr_config(image_size, dropout, checkpoint_segments)
     elif model_name == UNETR.__name__:
         return get_unetr_config(image_size, dropout)
     elif model_name in (TwoDPermuteConcat.__name__, "TwoDPermuteConcatModel"):
-        return get_2dconcatmodel_config(image_size, dropout)
+        return get_2dconcatmodel_config(image_size, dropout, checkpoint_segments)
     elif model_name == Unet.__name__:
         return get_unet_config(dropout)
     elif model_name == MultiScale2DPermuteConcat.__name__:
-        return get_multiscale2dconcatmodel_config(image_size, dropout)
+        return get_multiscale2dconcatmodel_config(image_size, dropout, checkpoint_segments)
     elif model_name == AutoEncoder.__name__:
         return get_autoencoder_config(image_size, dropout)
     elif model_name == CustomAutoEncoder.__name__:
-        return get_autoencoder_config(image_size, dropout)
+        return get_autoencoder_config(image_size, dropout, checkpoint_segments)
     elif model_name == TLPredictor.__name__:
         return get_tlpredictor_config(image_size, dropout)
     else:
@@ -106,7 +126,7 @@ def get_tlpredictor_config(image_size, dropout):
     return model_config
 
 
-def get_autoencoder_config(image_size, dropout):
+def get_autoencoder_config(image_size, dropout, checkpoint_segments=0):
     model_config = {
         "image_size": image_size,
         "latent_dim": 64,
@@ -116,11 +136,12 @@ def get_autoencoder_config(image_size, dropout):
         "channels": (8, 16, 32, 64),
         "strides": (2, 2, 2, 2),
         "dropout": 0.1 if dropout else 0.0,
+        "checkpoint_segments": checkpoint_segments,
     }
     return model_config
 
 
-def get_swinunetr_config(image_size, dropout) -> Dict:
+def get_swinunetr_config(image_size, dropout, checkpoint_segments=0) -> Dict:
     """these parameters were found by searching through possible model sizes"""
     model_config = {
         "img_size": image_size,
@@ -134,7 +155,8 @@ def get_swinunetr_config(image_size, dropout) -> Dict:
         "attn_drop_rate": 0.0,
         "dropout_path_rate": 0.0,
         "normalize": True,
-        "use_checkpoint": False,
+        # swin transformer blocks are checkpointed as a whole, segments only toggle it
+        "use_checkpoint": checkpoint_segments > 0,
         "spatial_dims": 3,
         "downsample": "merging",
     }
@@ -159,11 +181,12 @@ def get_unet_config(dropout):
     return model_config
 
 
-def get_multiscale2dconcatmodel_config(image_size, dropout):
+def get_multiscale2dconcatmodel_config(image_size, dropout, checkpoint_segments=0):
     """fully conv: image size does not matter"""
     model_config = {
         "permute": True,
         "dropout": 0.1 if dropout else 0.0,
+        "checkpoint_segments": checkpoint_segments,
         "encoder": {
             "initial_channel": 16,
             "in_channels": [],  # this will be filled in by autoconfig
@@ -239,7 +262,7 @@ def get_multiscale2dconcatmodel_config(image_size, dropout):
     return {'config':model_config}
 
 
-def get_2dconcatmodel_config(image_size, dropout):
+def get_2dconcatmodel_config(image_size, dropout, checkpoint_segments=0):
     """Inferring the 3D Standing Spine Posture from 2D Radiographs
     https://arxiv.org/abs/2007.06612
     default baseline for 64^3 volume
@@ -270,6 +293,7 @@ def get_2dconcatmodel_config(image_size, dropout):
             'dropout':dropout,
             "dropout_rate": 0.1 if dropout else 0.0,
             "bias": True,
+            "checkpoint_segments": checkpoint_segments,
         }
     else:
         raise ValueError(f"Image size can be either 64 or 128,, got {image_size}")
@@ -292,7 +316,7 @@ def get_attunet_config(dropout):
     return model_config
 
 
-def get_1dconcatmodel_config(image_size, dropout):
+def get_1dconcatmodel_config(image_size, dropout, checkpoint_segments=0):
     """base model for 128^3 volume (2^7)"""
     bottleneck_size = 256
 
@@ -363,5 +387,6 @@ def get_1dconcatmodel_config(image_size, dropout):
     else:
         raise ValueError(f"Image size can be either 64 or 128, got {image_size}")
 
+    model_config["checkpoint_segments"] = checkpoint_segments
     assert model_config['decoder_in_channels'][0] == bottleneck_size, f"decoder first in-channel expected {bottleneck_size}, got {model_config['decoder_in_channels'][0]}"
     return model_config
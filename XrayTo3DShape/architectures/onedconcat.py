@@ -3,7 +3,7 @@ from typing import Dict, List
 import torch
 from monai.networks.blocks.convolutions import Convolution
 from torch import nn
-from .arch_utils import calculate_1d_vec_channels
+from .arch_utils import calculate_1d_vec_channels, checkpoint_stages
 from ..utils.registry import ARCHITECTURES
 
 
@@ -19,6 +19,7 @@ class OneDConcat(nn.Module):
         pa_encoder (nn.Module): Encodes the AP image
         lat_encoder (nn.Module): Encodes the LAT image
         decoder (nn.Module): decodes the fused cube into a full-fledged volume
+        checkpoint_segments (int): activation checkpointing segments of the decoder, 0 disables it
     """
 
     def __init__(
@@ -37,13 +38,15 @@ class OneDConcat(nn.Module):
         dropout,
         dropout_rate,
         bottleneck_size,
-        bias
+        bias,
+        checkpoint_segments=0,
     ) -> None:
         super().__init__()
         self.ap_encoder: nn.Module
         self.lat_encoder: nn.Module
         self.decoder: nn.Module
         self.bottlneck_size = bottleneck_size
+        self.checkpoint_segments = checkpoint_segments
         # verify config
         assert (
             len(input_image_size) == 2
@@ -186,7 +189,7 @@ class OneDConcat(nn.Module):
         fused_cube = embedding_vector.view(size=(-1, self.bottlneck_size, *(1, 1, 1)))
 
         # decoder
-        out_decoder = self.decoder(fused_cube)
+        out_decoder = checkpoint_stages(self.decoder, self.checkpoint_segments, fused_cube)
         return out_decoder
 
 
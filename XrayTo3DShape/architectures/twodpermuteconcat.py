@@ -3,6 +3,7 @@ from typing import Dict, List
 import torch
 from monai.networks.blocks.convolutions import Convolution
 from torch import nn
+from .arch_utils import checkpoint_stages
 from ..utils.registry import ARCHITECTURES
 
 
@@ -17,6 +18,7 @@ class TwoDPermuteConcat(nn.Module):
         pa_encoder (nn.Module): encodes AP view x-rays
         lat_encoder (nn.Module): encodes LAT view x-rays
         decoder (nn.Module): takes encoded and fused AP and LAT view and generates a 3D volume
+        checkpoint_segments (int): activation checkpointing segments of the decoder, 0 disables it
     """
 
     def __init__(
@@ -43,6 +45,7 @@ class TwoDPermuteConcat(nn.Module):
         dropout,
         dropout_rate,
         bias,
+        checkpoint_segments=0,
     ) -> None:
         super().__init__()
         # verify config
@@ -53,6 +56,7 @@ class TwoDPermuteConcat(nn.Module):
         self.ap_encoder: nn.Module
         self.lat_encoder: nn.Module
         self.decoder: nn.Module
+        self.checkpoint_segments = checkpoint_segments
 
         self.ap_encoder = nn.Sequential(
             *self._encoder_layer(
@@ -238,7 +242,7 @@ class TwoDPermuteConcat(nn.Module):
         fused_cube = torch.cat(
             (out_ap_expansion, out_lat_expansion), dim=1
         )  # add new dimension assuming PIR orientation
-        return self.decoder(fused_cube)
+        return checkpoint_stages(self.decoder, self.checkpoint_segments, fused_cube)
 
 
 TwoDPermuteConcatModel = TwoDPermuteConcat
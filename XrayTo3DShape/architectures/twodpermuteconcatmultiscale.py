@@ -8,6 +8,7 @@ from typing import Dict
 import torch
 from monai.networks.blocks.convolutions import Convolution
 from torch import nn
+from .arch_utils import checkpoint_stage
 from ..utils.registry import ARCHITECTURES
 
 class DenseNetBlock(nn.Module):
@@ -90,12 +91,14 @@ class MultiScaleEncoder2d(nn.Module):
 
 @ARCHITECTURES.register('MultiScale2DPermuteConcat')
 class MultiScale2DPermuteConcat(nn.Module):
-    """MultiScale2DPermuteConcat"""
+    """MultiScale2DPermuteConcat
+    `config['checkpoint_segments'] > 0` checkpoints the activations of every 3D fusion stage"""
 
     def __init__(self, config: Dict) -> None:
         super().__init__()
         self.config = config
         self.permute = config["permute"]
+        self.checkpoint_fusion = config.get("checkpoint_segments", 0) > 0
         self.ap_encoder: nn.Module
         self.lat_encoder: nn.Module
 
@@ -433,7 +436,9 @@ class MultiScale2DPermuteConcat(nn.Module):
                 fused_out = torch.cat(
                     (dec_ap.unsqueeze(dim=1), permuted_dec_lat.unsqueeze(dim=1)), dim=1
                 )
-                dec_3d_fusion_out.append(fuser(fused_out))
+                dec_3d_fusion_out.append(
+                    checkpoint_stage(fuser, self.checkpoint_fusion, fused_out)
+                )
 
             else:
                 fused_out = torch.cat(
@@ -444,7 +449,9 @@ class MultiScale2DPermuteConcat(nn.Module):
                     ),
                     dim=1,
                 )
-                dec_3d_fusion_out.append(fuser(fused_out))
+                dec_3d_fusion_out.append(
+                    checkpoint_stage(fuser, self.checkpoint_fusion, fused_out)
+                )
         if verbose:
             [print("After 2D Decoding ", out.shape) for out in dec_ap_fusion_out]
             [print("After 2D Decoding ", out.shape) for out in dec_lat_fusion_out]
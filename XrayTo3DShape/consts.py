@@ -66,8 +66,25 @@ model_experiment_dict = {
 }
 
 
+def get_transform_family_from_model_name(model_name) -> str:
+    """models that share the same data transformation pipeline belong to the same family
+    returns one of `kasten`, `nonkasten`, `denoising_autoencoder`
+    """
+    experiment_name = model_experiment_dict[model_name]
+    if experiment_name == ParallelHeadsExperiment.__name__:
+        return "nonkasten"
+    if experiment_name in (
+        VolumeAsInputExperiment.__name__,
+        TLPredictorExperiment.__name__,
+    ):
+        return "kasten"
+    if experiment_name == AutoencoderExperiment.__name__:
+        return "denoising_autoencoder"
+    raise ValueError(f"Invalid experiment name {experiment_name}")
+
+
 def get_transform_from_model_name(
-    model_name, image_size, resolution
+    model_name, image_size, resolution, lazy_kasten=False, label_format="float32"
 ) -> Dict[str, Compose]:
     """return data transformation pipeline for given
     model architecture and suggested target size and resolution
@@ -76,6 +93,10 @@ def get_transform_from_model_name(
         model_name (str): model architecture name
         image_size (int): target dimension of images
         resolution (float): (isotropic) voxel resolution
+        lazy_kasten (bool): yield 2D AP/LAT images for volume-as-input models,
+            the experiment expands them into volumes on the device
+        label_format (str): carry segmentation labels as `float32`, `uint8` or `packbits`.
+            the denoising autoencoder always uses float32 labels
 
     Raises:
         ValueError: If model name does not match
@@ -83,22 +104,20 @@ def get_transform_from_model_name(
     Returns:
         Dict[str, Compose]: Callable Transform
     """
-    experiment_name = model_experiment_dict[model_name]
-    if experiment_name == ParallelHeadsExperiment.__name__:
+    transform_family = get_transform_family_from_model_name(model_name)
+    if transform_family == "nonkasten":
         callable_transform = get_nonkasten_transforms(
-            size=image_size, resolution=resolution
+            size=image_size, resolution=resolution, label_format=label_format
         )
-    elif experiment_name in (
-        VolumeAsInputExperiment.__name__,
-        TLPredictorExperiment.__name__,
-    ):
+    elif transform_family == "kasten":
         callable_transform = get_kasten_transforms(
-            size=image_size, resolution=resolution
+            size=image_size,
+            resolution=resolution,
+            lazy=lazy_kasten,
+            label_format=label_format,
         )
-    elif experiment_name == AutoencoderExperiment.__name__:
+    else:
         callable_transform = get_denoising_autoencoder_transforms(
             size=image_size, resolution=resolution
         )
-    else:
-        raise ValueError(f"Invalid experiment name {experiment_name}")
     return callable_transform
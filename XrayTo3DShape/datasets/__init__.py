@@ -1,2 +1,5 @@
 from .base_dataset import (AtlasDeformationDataset, BaseDataset,
-                           DeformationDataset, get_dataset)
+                           DeformationDataset, PersistentBaseDataset,
+                           get_dataset)
+from .packed_dataset import (PackedDataset, decode_xray, decode_xray_batch,
+                             is_packed_shard, pack_dataset)
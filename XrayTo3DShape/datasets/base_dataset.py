@@ -1,12 +1,26 @@
 """
 Define torch Datasets for AP, LAT, Segmentation images
-TODO: subclass from monai.data.PersistentDataset for caching
 """
-from typing import Callable, Dict, Sequence
+import hashlib
+import json
+import os
+import re
+import tempfile
+import types
+import warnings
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, List, Optional, Sequence, Union
 
+import numpy as np
 import pandas as pd
+import torch
+from monai.data.meta_tensor import MetaTensor
 from monai.transforms.transform import apply_transform
-from torch.utils.data import Dataset
+from monai.utils import enums as monai_enums
+from torch.utils.data import Dataset, Subset
+
+from ..utils.io_utils import get_nifti_stem
 
 
 class BaseDataset(Dataset):
@@ -48,6 +62,119 @@ class BaseDataset(Dataset):
         return self._transform(index)
 
 
+def _describe_transform(obj: Any, depth: int = 0) -> str:
+    """class and attributes of a transform and everything it holds,
+    without memory addresses so that the description is stable across runs"""
+    if depth > 16:
+        return type(obj).__qualname__
+    if isinstance(obj, (str, int, float, bool, Enum)) or obj is None:
+        return repr(obj)
+    if isinstance(obj, dict):
+        items = sorted(
+            (str(key), _describe_transform(value, depth + 1)) for key, value in obj.items()
+        )
+        return "{" + ",".join(f"{key}:{value}" for key, value in items) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(_describe_transform(value, depth + 1) for value in obj) + "]"
+    if isinstance(obj, (set, frozenset)):
+        values = sorted(_describe_transform(value, depth + 1) for value in obj)
+        return "{" + ",".join(values) + "}"
+    if isinstance(obj, types.FunctionType):
+        # lambdas of the transforms capture e.g. the size in their closure
+        closure = [cell.cell_contents for cell in obj.__closure__ or ()]
+        return (
+            f"{obj.__module__}.{obj.__qualname__}"
+            f"{_describe_transform([closure, obj.__defaults__], depth + 1)}"
+        )
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        # classes and builtins
+        return f"{getattr(obj, '__module__', '')}.{obj.__qualname__}"
+    if hasattr(obj, "__dict__") and not isinstance(obj, (torch.Tensor, np.ndarray)):
+        return f"{type(obj).__qualname__}({_describe_transform(vars(obj), depth + 1)})"
+    return re.sub(r" at 0x[0-9a-fA-F]+", "", repr(obj))
+
+
+def _get_cache_safe_globals() -> List[Any]:
+    """types that the transformed items hold besides tensors and builtins:
+    monai meta tensors, the monai enums of their meta data and numpy arrays"""
+    numpy_types = [np.ndarray, np.dtype, np.ndarray((0,)).__reduce__()[0]]
+    if hasattr(np, "dtypes"):
+        numpy_types += [
+            getattr(np.dtypes, name) for name in dir(np.dtypes) if name.endswith("DType")
+        ]
+    monai_types = [
+        value
+        for value in vars(monai_enums).values()
+        if isinstance(value, type) and issubclass(value, Enum)
+    ]
+    return [MetaTensor, *monai_types, *numpy_types]
+
+
+class PersistentBaseDataset(BaseDataset):
+    """
+    BaseDataset that caches the fully transformed (ap, lat, seg) triplet on disk.
+    similar to ``monai.data.PersistentDataset``, but the cache key is computed from
+    the filepaths, their modification time, the transform parameters
+    (size, resolution, transform family) and the transforms themselves
+    so that changing any of them invalidates the cache.
+    Cache files are loaded with ``weights_only=True``, only tensors, monai meta data
+    and numpy arrays are unpickled.
+
+    The transforms must be deterministic: random augmentations (e.g. the noisy label
+    of the denoising autoencoder) would be frozen in the cache.
+    """
+
+    def __init__(
+        self,
+        data: Sequence,
+        transforms: Dict[str, Callable],
+        cache_dir: Union[str, Path],
+        transform_params: Optional[Dict] = None,
+    ) -> None:
+        super().__init__(data, transforms)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.transform_params = transform_params if transform_params else {}
+        self.transforms_hash = hashlib.md5(
+            _describe_transform(transforms).encode("utf-8")
+        ).hexdigest()
+
+    def get_cache_key(self, index: int) -> str:
+        """content hash of the filepaths, their mtime, the transform parameters and the transforms"""
+        data_i = self.data[index]
+        key = {
+            "paths": {k: str(v) for k, v in sorted(data_i.items())},
+            "mtime": {k: os.stat(v).st_mtime_ns for k, v in sorted(data_i.items())},
+            "params": self.transform_params,
+            "transforms": self.transforms_hash,
+        }
+        return hashlib.md5(
+            json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def _cachecheck(self, index: int):
+        """load the transformed item from cache, transform and save if it does not exist"""
+        cache_file = self.cache_dir / f"{self.get_cache_key(index)}.pt"
+        if cache_file.exists():
+            try:
+                with torch.serialization.safe_globals(_get_cache_safe_globals()):
+                    return torch.load(cache_file, weights_only=True)
+            except Exception as e:  # corrupt cache file, regenerate
+                warnings.warn(f"could not load cache {cache_file}, regenerating: {e}")
+        item = self._transform(index)
+        # write to a temporary file and rename so that concurrent workers
+        # never read a partially written cache file
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as tmp_file:
+            torch.save(item, tmp_file)
+        os.replace(tmp_file.name, cache_file)
+        return item
+
+    def __getitem__(self, index):
+        return self._cachecheck(index)
+
+
 class AtlasDeformationDataset(Dataset):
     """TODO: work in progress"""
     def __init__(
@@ -104,8 +231,48 @@ class DeformationDataset(Dataset):
         return self.transform(index)
 
 
-def get_dataset(filepaths: str, transforms: Dict) -> Dataset:
-    """read filepaths csv and return Dataset"""
+def get_dataset(
+    filepaths: str,
+    transforms: Dict,
+    cache_dir: Optional[str] = None,
+    transform_params: Optional[Dict] = None,
+    label_format: str = "float32",
+    exclude_subjects: Optional[Collection[str]] = None,
+) -> Dataset:
+    """read filepaths csv and return Dataset
+    if `cache_dir` is given, the transformed samples are cached on disk
+    and keyed by `transform_params` e.g. {'size':128,'resolution':1.0,'family':'kasten'}
+    if `filepaths` is a shard directory written by `pack_dataset`, the samples are
+    served from the shard and `transforms` are not applied, labels are served
+    in `label_format` (for csv, the label format is set by the transforms)
+    samples whose segmentation stem (the `subject-id` of the metric log) is in
+    `exclude_subjects` are left out e.g. to resume an evaluation
+    """
+    # avoid circular import
+    from .packed_dataset import PackedDataset, is_packed_shard
+
+    exclude_subjects = set(exclude_subjects) if exclude_subjects else set()
+    if is_packed_shard(filepaths):
+        dataset = PackedDataset(filepaths, label_format=label_format)
+        if not exclude_subjects:
+            return dataset
+        indices = [
+            index
+            for index, filename in enumerate(dataset.filenames)
+            if get_nifti_stem(filename) not in exclude_subjects
+        ]
+        return Subset(dataset, indices)
     paths = pd.read_csv(filepaths, index_col=0).to_numpy()
-    paths = [{"ap": ap, "lat": lat, "seg": seg} for ap, lat, seg in paths]
+    paths = [
+        {"ap": ap, "lat": lat, "seg": seg}
+        for ap, lat, seg in paths
+        if get_nifti_stem(seg) not in exclude_subjects
+    ]
+    if cache_dir:
+        return PersistentBaseDataset(
+            data=paths,
+            transforms=transforms,
+            cache_dir=cache_dir,
+            transform_params=transform_params,
+        )
     return BaseDataset(data=paths, transforms=transforms)
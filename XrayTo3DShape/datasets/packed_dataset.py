@@ -0,0 +1,232 @@
+"""
+Pack AP, LAT, Segmentation triplets of a filepaths csv into a single fixed-shape
+memory-mapped shard and serve samples directly from the shard.
+
+shard layout:
+    shard.json  : number of samples, image size, dtypes, transform parameters
+    ap.npy      : (N,1,H,W) float16 or uint8 AP images
+    lat.npy     : (N,1,H,W) float16 or uint8 LAT images
+    seg.npy     : (N,1,D,H,W/8) uint8 segmentation bits packed along the last axis
+    meta.npz    : filename_or_obj, affine and original_affine of the segmentation
+"""
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from .base_dataset import BaseDataset
+
+SHARD_INFO_FILENAME = "shard.json"
+
+
+def is_packed_shard(path: Union[str, Path]) -> bool:
+    """does the path point to a shard directory written by `pack_dataset`"""
+    return Path(path).is_dir() and (Path(path) / SHARD_INFO_FILENAME).exists()
+
+
+def _to_2d_xray(image: torch.Tensor, view: str) -> np.ndarray:
+    """kasten transforms repeat the 2D x-ray along an orthogonal axis,
+    any slice along that axis recovers the 2D image"""
+    image = np.asarray(image)
+    if image.ndim == 3:
+        return image
+    if view == "ap":  # 1 m n -> 1 k m n
+        return image[:, 0]
+    return image[..., 0]  # 1 m n -> 1 m n k
+
+
+def _encode_xray(image: np.ndarray, xray_dtype: str) -> np.ndarray:
+    """x-rays are min-max scaled to [0,1] by the transforms"""
+    if xray_dtype == "uint8":
+        return np.round(np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+    return image.astype(np.float16)
+
+
+def decode_xray(image: torch.Tensor) -> torch.Tensor:
+    """expand x-rays served in the shard dtype to float, uint8 back to [0,1]"""
+    if image.dtype == torch.uint8:
+        return image.float().div_(255.0)
+    if image.dtype == torch.float16:
+        return image.float()
+    return image
+
+
+def decode_xray_batch(batch: Any) -> Any:
+    """decode the AP/LAT images of a (ap, lat, seg) batch, other batches are returned as is"""
+    if not isinstance(batch, (list, tuple)):
+        return batch
+    return type(batch)(
+        {
+            key: decode_xray(value)
+            if key in ("ap", "lat") and isinstance(value, torch.Tensor)
+            else value
+            for key, value in item.items()
+        }
+        if isinstance(item, dict)
+        else item
+        for item in batch
+    )
+
+
+def pack_dataset(
+    filepaths: str,
+    transforms: Dict[str, Callable],
+    output_dir: Union[str, Path],
+    xray_dtype: str = "float16",
+    transform_params: Optional[Dict] = None,
+    num_workers: int = 0,
+) -> Path:
+    """run the transforms once over all samples in the filepaths csv and
+    write them into a memory-mapped shard
+
+    Args:
+        filepaths (str): ap,lat,seg filepaths csv
+        transforms (Dict[str, Callable]): ap,lat,seg transforms e.g. from `get_transform_from_model_name`
+        output_dir (Union[str, Path]): shard directory
+        xray_dtype (str, optional): `float16` or `uint8`. Defaults to "float16".
+        transform_params (Optional[Dict], optional): recorded in the shard info e.g. size, resolution
+        num_workers (int, optional): dataloader workers used for decoding. Defaults to 0.
+
+    Returns:
+        Path: shard directory
+    """
+    if xray_dtype not in ("float16", "uint8"):
+        raise ValueError(f"xray_dtype can be either float16 or uint8, got {xray_dtype}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    paths = pd.read_csv(filepaths, index_col=0).to_numpy()
+    paths = [{"ap": ap, "lat": lat, "seg": seg} for ap, lat, seg in paths]
+    dataset = BaseDataset(data=paths, transforms=transforms)
+    num_samples = len(dataset)
+
+    # batch_size=None: do not collate, iterate over individual samples
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers)
+
+    ap_shard = lat_shard = seg_shard = None
+    filenames, affines, original_affines = [], [], []
+    kasten = False
+    for index, (ap, lat, seg) in enumerate(loader):
+        kasten = np.asarray(ap["ap"]).ndim == 4
+        ap_image = _encode_xray(_to_2d_xray(ap["ap"], "ap"), xray_dtype)
+        lat_image = _encode_xray(_to_2d_xray(lat["lat"], "lat"), xray_dtype)
+        seg_bits = np.packbits(np.asarray(seg["seg"]) > 0.5, axis=-1)
+
+        if ap_shard is None:
+            # fixed-shape arrays: allocate once, then fill sample by sample
+            ap_shard = np.lib.format.open_memmap(
+                output_dir / "ap.npy",
+                mode="w+",
+                dtype=ap_image.dtype,
+                shape=(num_samples, *ap_image.shape),
+            )
+            lat_shard = np.lib.format.open_memmap(
+                output_dir / "lat.npy",
+                mode="w+",
+                dtype=lat_image.dtype,
+                shape=(num_samples, *lat_image.shape),
+            )
+            seg_shard = np.lib.format.open_memmap(
+                output_dir / "seg.npy",
+                mode="w+",
+                dtype=np.uint8,
+                shape=(num_samples, *seg_bits.shape),
+            )
+            seg_shape = list(np.asarray(seg["seg"]).shape)
+        ap_shard[index] = ap_image
+        lat_shard[index] = lat_image
+        seg_shard[index] = seg_bits
+
+        seg_meta_dict = seg["seg_meta_dict"]
+        filenames.append(str(seg_meta_dict["filename_or_obj"]))
+        affines.append(np.asarray(seg_meta_dict["affine"], dtype=np.float64))
+        original_affines.append(
+            np.asarray(seg_meta_dict["original_affine"], dtype=np.float64)
+        )
+
+    if ap_shard is None:
+        raise ValueError(f"no samples found in {filepaths}")
+    for shard in (ap_shard, lat_shard, seg_shard):
+        shard.flush()
+
+    np.savez(
+        output_dir / "meta.npz",
+        filename_or_obj=np.asarray(filenames),
+        affine=np.stack(affines),
+        original_affine=np.stack(original_affines),
+    )
+    shard_info = {
+        "num_samples": num_samples,
+        "xray_dtype": xray_dtype,
+        "seg_shape": seg_shape,
+        "kasten": kasten,
+        "filepaths": str(filepaths),
+        "transform_params": transform_params if transform_params else {},
+    }
+    with open(output_dir / SHARD_INFO_FILENAME, "w") as f:
+        json.dump(shard_info, f, indent=4)
+    return output_dir
+
+
+class PackedDataset(Dataset):
+    """
+    serve (ap, lat, seg) samples from a shard written by `pack_dataset`.
+    The arrays are memory-mapped, only the pages of the requested sample are read.
+    The returned structure is the same as `BaseDataset` so that experiments
+    and prediction writers work unchanged. AP/LAT are always served as 2D images,
+    volume-as-input experiments expand them into volumes on the device.
+    AP/LAT are views of the memory-map in the shard dtype (float16 or uint8),
+    the only copy is the collation into a batch; experiments expand them to float
+    on the device with `decode_xray`.
+    Labels are stored as packed bits, `label_format='packbits'` serves them as is.
+    """
+
+    def __init__(
+        self, shard_dir: Union[str, Path], label_format: str = "float32"
+    ) -> None:
+        super().__init__()
+        self.shard_dir = Path(shard_dir)
+        self.label_format = label_format
+        with open(self.shard_dir / SHARD_INFO_FILENAME) as f:
+            self.shard_info = json.load(f)
+        meta = np.load(self.shard_dir / "meta.npz")
+        self.filenames = meta["filename_or_obj"].tolist()
+        self.affine = meta["affine"]
+        self.original_affine = meta["original_affine"]
+        self.ap: Optional[np.ndarray] = None
+        self.lat: Optional[np.ndarray] = None
+        self.seg: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self.shard_info["num_samples"]
+
+    def _open(self):
+        """open memory-maps lazily so that each dataloader worker has its own handle.
+        copy-on-write maps are writable views for `torch.from_numpy`, the shard is never written"""
+        self.ap = np.load(self.shard_dir / "ap.npy", mmap_mode="c")
+        self.lat = np.load(self.shard_dir / "lat.npy", mmap_mode="c")
+        self.seg = np.load(self.shard_dir / "seg.npy", mmap_mode="c")
+
+    def __getitem__(self, index: int):
+        if self.ap is None:
+            self._open()
+        ap = torch.from_numpy(self.ap[index])
+        lat = torch.from_numpy(self.lat[index])
+        if self.label_format == "packbits":
+            seg = torch.from_numpy(self.seg[index])
+        else:
+            seg = torch.from_numpy(
+                np.unpackbits(
+                    self.seg[index], axis=-1, count=self.shard_info["seg_shape"][-1]
+                ).astype(np.float32 if self.label_format == "float32" else np.uint8)
+            )
+        seg_meta_dict = {
+            "filename_or_obj": self.filenames[index],
+            "affine": torch.from_numpy(self.affine[index]),
+            "original_affine": torch.from_numpy(self.original_affine[index]),
+        }
+        return {"ap": ap}, {"lat": lat}, {"seg": seg, "seg_meta_dict": seg_meta_dict}
@@ -4,4 +4,5 @@ from .experiments import (
     ParallelHeadsExperiment,
     TLPredictorExperiment,
     VolumeAsInputExperiment,
+    expand_kasten_views,
 )
@@ -1,14 +1,27 @@
 """Base class with common functionality for encoder-decoder based methods"""
-from typing import Any, Optional, Tuple
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Optional, Sequence, Tuple, Union
 
 import pytorch_lightning as pl
 import torch
+from monai.inferers.utils import sliding_window_inference
 from monai.metrics.meandice import compute_dice
+from pytorch_lightning.utilities import rank_zero_only
+from pytorch_lightning.utilities.apply_func import apply_to_collection
 
 import wandb
 from XrayTo3DShape import post_transform
 
-from ..utils import reproject, to_numpy
+from ..architectures import to_channels_last_3d
+from ..datasets import decode_xray_batch
+from ..transforms import decode_label
+from ..utils import StageProfiler, reproject, to_numpy
+
+# meta data of the segmentation needed by the prediction writers and metric loggers
+PREDICTION_META_KEYS = ("filename_or_obj", "affine", "original_affine")
 
 
 class BaseExperiment(pl.LightningModule):
@@ -19,18 +32,162 @@ class BaseExperiment(pl.LightningModule):
     """
 
     def __init__(
-        self, model, optimizer=None, loss_function=None, batch_size=None, **kwargs: Any
+        self,
+        model,
+        optimizer=None,
+        loss_function=None,
+        batch_size=None,
+        label_format="float32",
+        patch_size: Optional[Union[int, Sequence[int]]] = None,
+        sw_batch_size=1,
+        sw_overlap=0.25,
+        sw_mode="gaussian",
+        sw_output_device=None,
+        channels_last=False,
+        stage_profiler: Optional[StageProfiler] = None,
+        **kwargs: Any,
     ) -> None:
         super().__init__()
         self.model = model
         self.optimizer = optimizer
         self.loss_function = loss_function
         self.batch_size = batch_size
+        self.label_format = label_format
+        # sliding window prediction: the model sees `patch_size` windows of the full volume
+        self.patch_size = patch_size
+        self.sw_batch_size = sw_batch_size
+        self.sw_overlap = sw_overlap
+        self.sw_mode = sw_mode
+        self.sw_output_device = sw_output_device
+        # store 3D weights and volumes as channels_last_3d
+        self.channels_last = channels_last
+        self._step_start_time: Optional[float] = None
+        self._step_start_event: Optional[torch.cuda.Event] = None
+        # step events of the cuda timing whose step may still be running on the device
+        self._pending_step_events: deque = deque()
+        # opt-in timing of the stages of the training step
+        self.stage_profiler = stage_profiler
 
     def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
         """subclasses should override this"""
         raise NotImplementedError()
 
+    def get_input_from_batch(self, batch) -> Any:
+        """model input from the (ap, lat) part of the batch, used when there is no label
+        e.g. when serving predictions. subclasses should override this"""
+        raise NotImplementedError()
+
+    def decode_label(self, seg_tensor: torch.Tensor) -> torch.Tensor:
+        """labels may be carried as uint8 or packed bits through the dataloader,
+        expand them to float on the device"""
+        return decode_label(seg_tensor, self.label_format)
+
+    def setup(self, stage: Optional[str] = None) -> None:
+        if self.channels_last:
+            to_channels_last_3d(self)
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        # x-rays of a packed shard are carried in the shard dtype, expand them on the device
+        batch = decode_xray_batch(batch)
+        if not self.channels_last:
+            return batch
+        return apply_to_collection(
+            batch,
+            torch.Tensor,
+            lambda t: t.contiguous(memory_format=torch.channels_last_3d)
+            if t.dim() == 5 and t.is_floating_point()
+            else t,
+        )
+
+    def profile_stage(self, name: str):
+        """time a stage of the training step if a stage profiler is set"""
+        if self.stage_profiler is None:
+            return nullcontext()
+        return self.stage_profiler.stage(name)
+
+    def on_train_batch_start(self, batch: Any, batch_idx: int, *args) -> None:
+        if self.device.type == "cuda" and self.stage_profiler is None:
+            # timed with cuda events, the step is not waited for
+            self._step_start_event = torch.cuda.Event(enable_timing=True)
+            self._step_start_event.record()
+            return
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self._step_start_time = time.perf_counter()
+        if self.stage_profiler is not None:
+            # the wait before the first batch of an epoch includes validation
+            self.stage_profiler.start_step(self.device, measure_data_wait=batch_idx > 0)
+
+    def on_train_batch_end(self, outputs: Any, batch: Any, batch_idx: int, *args) -> None:
+        """throughput and peak memory of the training step.
+        on cuda without a stage profiler, the throughput of the steps whose end
+        event has completed is logged and the peak memory is the peak since the
+        start of training, so that no step blocks on the device. with a stage
+        profiler, the device is synchronized and the peak memory is per step"""
+        _, _, seg = batch
+        batch_size = len(seg["seg"] if "seg" in seg else seg["orig"])
+        if self.device.type == "cuda" and self.stage_profiler is None:
+            if self._step_start_event is None:
+                return
+            end_event = torch.cuda.Event(enable_timing=True)
+            end_event.record()
+            self._pending_step_events.append((self._step_start_event, end_event, batch_size))
+            self._step_start_event = None
+            while self._pending_step_events and self._pending_step_events[0][1].query():
+                start_event, end_event, num_samples = self._pending_step_events.popleft()
+                elapsed = start_event.elapsed_time(end_event) / 1e3
+                self.log_step_perf(num_samples / elapsed, num_samples)
+            return
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        if self.stage_profiler is not None:
+            self.stage_profiler.end_step()
+        if self._step_start_time is None:
+            return
+        elapsed = time.perf_counter() - self._step_start_time
+        self.log_step_perf(batch_size / elapsed, batch_size)
+
+    def log_step_perf(self, samples_per_sec: float, batch_size: int):
+        """log the throughput and the peak allocated cuda memory"""
+        self.log(
+            "perf/samples_per_sec",
+            samples_per_sec,
+            on_step=True,
+            on_epoch=True,
+            batch_size=batch_size,
+        )
+        if self.device.type == "cuda":
+            peak_memory = torch.cuda.max_memory_allocated(self.device) / 2**20
+            if self.stage_profiler is not None:
+                # the profiler resets the peak memory statistics at every stage
+                peak_memory = max(peak_memory, self.stage_profiler.step_peak_memory)
+            self.log(
+                "perf/peak_memory_mb",
+                peak_memory,
+                on_step=True,
+                on_epoch=True,
+                reduce_fx="max",
+                batch_size=batch_size,
+            )
+
+    def on_train_end(self) -> None:
+        """each process exports its stage profile to `<run dir>/profile`. the run
+        directory is the parent of the checkpoint directory, which lightning
+        resolves on global rank zero and broadcasts to all processes"""
+        if self.stage_profiler is None:
+            return
+        checkpoint_callback = self.trainer.checkpoint_callback
+        if checkpoint_callback is not None and checkpoint_callback.dirpath:
+            run_dir = Path(checkpoint_callback.dirpath).parent
+        else:
+            run_dir = Path(self.trainer.default_root_dir)
+        prefix = self.stage_profiler.name
+        if self.trainer.world_size > 1:
+            prefix = f"{prefix}-rank{self.global_rank}"
+        paths = self.stage_profiler.export(run_dir / "profile", prefix, pid=self.global_rank)
+        print(self.stage_profiler.summary().round(2).to_string())
+        print(f"stage profile written to {paths['trace']}")
+
     def get_segmentation_meta_dict(self, batch):
         """util for extracting meta data from batch"""
         ap, lat, seg = batch
@@ -38,31 +195,39 @@ class BaseExperiment(pl.LightningModule):
 
     def training_step(self, batch, batch_idx):
         """single step backprop"""
-        batch_input, output = self.get_input_output_from_batch(batch)
-        pred_logits = self.model(*batch_input)
-        loss = self.loss_function(pred_logits, output)
-        with torch.no_grad():
+        with self.profile_stage("get_input_output"):
+            batch_input, output = self.get_input_output_from_batch(batch)
+        with self.profile_stage("forward"):
+            pred_logits = self.model(*batch_input)
+        with self.profile_stage("loss"):
+            loss = self.loss_function(pred_logits, output)
+        with self.profile_stage("metrics"), torch.no_grad():
             pred = post_transform(pred_logits.detach())
             dice_metric = torch.mean(compute_dice(pred, output))
 
-        self.log(
-            "train/loss",
-            loss.item(),
-            on_step=True,
-            on_epoch=True,
-            prog_bar=True,
-            batch_size=self.batch_size,
-        )
-        self.log(
-            "train/dice",
-            dice_metric.item(),
-            on_step=True,
-            on_epoch=True,
-            prog_bar=True,
-            batch_size=self.batch_size,
-        )
+        with self.profile_stage("log_sync"):
+            self.log(
+                "train/loss",
+                loss.item(),
+                on_step=True,
+                on_epoch=True,
+                prog_bar=True,
+                batch_size=self.batch_size,
+            )
+            self.log(
+                "train/dice",
+                dice_metric.item(),
+                on_step=True,
+                on_epoch=True,
+                prog_bar=True,
+                batch_size=self.batch_size,
+            )
         return loss
 
+    def backward(self, loss: torch.Tensor, *args, **kwargs) -> None:
+        with self.profile_stage("backward"):
+            super().backward(loss, *args, **kwargs)
+
     def validation_step(self, batch, batch_idx):
         batch_input, output = self.get_input_output_from_batch(batch)
         pred_logits = self.model(*batch_input)
@@ -78,6 +243,7 @@ class BaseExperiment(pl.LightningModule):
             loss.item(),
             on_step=False,
             on_epoch=True,
+            sync_dist=True,
             prog_bar=True,
             batch_size=self.batch_size,
         )
@@ -86,29 +252,73 @@ class BaseExperiment(pl.LightningModule):
             dice_metric.item(),
             on_step=False,
             on_epoch=True,
+            sync_dist=True,
             prog_bar=True,
             batch_size=self.batch_size,
         )
 
+    def predict_logits(self, batch_input) -> torch.Tensor:
+        """segmentation logits for the model input, override if the model
+        output has to be decoded first"""
+        return self.model(*batch_input)
+
+    def get_sliding_window_volume(self, batch_input) -> torch.Tensor:
+        """(B,C,D,H,W) volume that the sliding window runs over"""
+        (volume,) = batch_input
+        return volume
+
+    def get_window_input(self, window: torch.Tensor):
+        """model input for a window of the sliding window volume"""
+        return [window]
+
+    def predict_sliding_window(self, batch_input) -> torch.Tensor:
+        """predict `patch_size` windows and stitch their logits
+        with overlap-weighted (gaussian by default) averaging"""
+        volume = self.get_sliding_window_volume(batch_input)
+        patch_size = self.patch_size
+        if isinstance(patch_size, int):
+            patch_size = (patch_size,) * (volume.dim() - 2)
+        return sliding_window_inference(
+            volume,
+            roi_size=patch_size,
+            sw_batch_size=self.sw_batch_size,
+            predictor=lambda window: self.predict_logits(self.get_window_input(window)),
+            overlap=self.sw_overlap,
+            mode=self.sw_mode,
+            device=self.sw_output_device,
+        )
+
+    def predict_segmentation(self, batch_input) -> torch.Tensor:
+        """binary segmentation of the model input, sliding window if `patch_size` is set"""
+        if self.patch_size is None:
+            pred_logits = self.predict_logits(batch_input)
+        else:
+            pred_logits = self.predict_sliding_window(batch_input)
+        return post_transform(pred_logits)
+
     def predict_step(
         self, batch: Any, batch_idx: int, dataloader_idx: Optional[int] = None
     ) -> Any:
+        """lean prediction record: binary uint8 volumes, converted on the device
+        before the writers move them to the host, and only the meta data they need"""
         batch_input, output = self.get_input_output_from_batch(batch)
-        pred_logits = self.model(*batch_input)
-        pred = post_transform(pred_logits)
+        pred = self.predict_segmentation(batch_input)
 
         out = {}
         seg_meta_dict = self.get_segmentation_meta_dict(batch)
 
-        out["pred"] = pred
-        out["gt"] = output
-        out["seg_meta_dict"] = seg_meta_dict
+        out["pred"] = pred.to(torch.uint8)
+        out["gt"] = output.to(torch.uint8)
+        out["seg_meta_dict"] = {
+            key: seg_meta_dict[key] for key in PREDICTION_META_KEYS if key in seg_meta_dict
+        }
 
         return out
 
     def configure_optimizers(self):
         return self.optimizer
 
+    @rank_zero_only
     def log_3d_images(self, predictions, label):
         """log projections of 3d volume into wandb"""
         projections = [reproject(volume.squeeze(), 0) for volume in predictions]
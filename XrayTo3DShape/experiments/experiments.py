@@ -12,10 +12,11 @@ TLPredictor
 https://arxiv.org/abs/1603.08637
 Learning a Predictable and Generative Vector Representation for Objects
 """
-from typing import Any, Optional, Tuple
+from typing import Any, Tuple
 
 import torch
 from monai.metrics.meandice import compute_dice
+from pytorch_lightning.utilities import rank_zero_only
 
 import wandb
 
@@ -26,6 +27,23 @@ from .base_experiment import BaseExperiment
 from ..losses import l1_loss
 
 
+def expand_kasten_views(
+    ap_tensor: torch.Tensor, lat_tensor: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """broadcast 2D AP/LAT images (B,1,H,W) into (B,1,D,H,W) volumes without copying,
+    identical to repeating them in `get_kasten_transforms`.
+    Volumes that were already repeated on the CPU are returned as is."""
+    if ap_tensor.dim() == 4:
+        # 1 m n -> 1 k m n
+        size = ap_tensor.shape[-1]
+        ap_tensor = ap_tensor.unsqueeze(2).expand(-1, -1, size, -1, -1)
+    if lat_tensor.dim() == 4:
+        # 1 m n -> 1 m n k
+        size = lat_tensor.shape[-1]
+        lat_tensor = lat_tensor.unsqueeze(-1).expand(-1, -1, -1, -1, size)
+    return ap_tensor, lat_tensor
+
+
 class VolumeAsInputExperiment(BaseExperiment):
     """Merge AP and LAT volume as 2-channel 3D volume"""
 
@@ -34,11 +52,16 @@ class VolumeAsInputExperiment(BaseExperiment):
     ) -> None:
         super().__init__(model, optimizer, loss_function, batch_size, **kwargs)
 
-    def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
-        ap, lat, seg = batch
-        ap_tensor, lat_tensor, seg_tensor = ap["ap"], lat["lat"], seg["seg"]
+    def get_input_from_batch(self, batch) -> Any:
+        ap, lat = batch[0], batch[1]
+        ap_tensor, lat_tensor = expand_kasten_views(ap["ap"], lat["lat"])
         input = torch.cat((ap_tensor, lat_tensor), 1)
-        return [input], seg_tensor
+        return [input]
+
+    def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
+        _, _, seg = batch
+        seg_tensor = self.decode_label(seg["seg"])
+        return self.get_input_from_batch(batch), seg_tensor
 
 
 class ParallelHeadsExperiment(BaseExperiment):
@@ -48,12 +71,21 @@ class ParallelHeadsExperiment(BaseExperiment):
         self, model, optimizer=None, loss_function=None, batch_size=None, **kwargs: Any
     ) -> None:
         super().__init__(model, optimizer, loss_function, batch_size, **kwargs)
+        if self.patch_size is not None:
+            # a window would see crops of the radiographs, not the whole projections
+            raise ValueError(
+                "sliding window prediction needs volume input, "
+                f"{type(self).__name__} takes the whole AP/LAT radiographs"
+            )
+
+    def get_input_from_batch(self, batch) -> Any:
+        ap, lat = batch[0], batch[1]
+        return ap["ap"], lat["lat"]
 
     def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
-        ap, lat, seg = batch
-        ap_tensor, lat_tensor, seg_tensor = ap["ap"], lat["lat"], seg["seg"]
-        batch_input = (ap_tensor, lat_tensor)
-        return batch_input, seg_tensor
+        _, _, seg = batch
+        seg_tensor = self.decode_label(seg["seg"])
+        return self.get_input_from_batch(batch), seg_tensor
 
 
 class AutoencoderExperiment(BaseExperiment):
@@ -79,23 +111,31 @@ class AutoencoderExperiment(BaseExperiment):
             noisy_seg
         ], clean_seg  # the input has to be put inside a list as a hack to keep the interface same for all type of models self.model(*input)
 
+    def predict_logits(self, batch_input) -> torch.Tensor:
+        pred_logits, _ = self.model(*batch_input)
+        return pred_logits
+
     def training_step(self, batch, batch_idx):
-        batch_input, output = self.get_input_output_from_batch(batch)
-        pred_logits, latent_vector = self.model(*batch_input)
-        supervised_loss = self.loss_function(pred_logits, output)
-        if self.make_sparse:
-            sparsity_loss = l1_loss(latent_vector)
-            total_loss = supervised_loss + self.SPARSITY_REG_STRENGTH * sparsity_loss
-        else:
-            total_loss = supervised_loss
-        self.log(
-            "train/loss",
-            total_loss.item(),
-            on_step=True,
-            on_epoch=True,
-            prog_bar=True,
-            batch_size=self.batch_size,
-        )
+        with self.profile_stage("get_input_output"):
+            batch_input, output = self.get_input_output_from_batch(batch)
+        with self.profile_stage("forward"):
+            pred_logits, latent_vector = self.model(*batch_input)
+        with self.profile_stage("loss"):
+            supervised_loss = self.loss_function(pred_logits, output)
+            if self.make_sparse:
+                sparsity_loss = l1_loss(latent_vector)
+                total_loss = supervised_loss + self.SPARSITY_REG_STRENGTH * sparsity_loss
+            else:
+                total_loss = supervised_loss
+        with self.profile_stage("log_sync"):
+            self.log(
+                "train/loss",
+                total_loss.item(),
+                on_step=True,
+                on_epoch=True,
+                prog_bar=True,
+                batch_size=self.batch_size,
+            )
         if self.global_step % 20 and batch_idx == 0:
             with torch.no_grad():
                 self.log_3d_images(pred_logits.detach(), label="train/predictions")
@@ -116,6 +156,7 @@ class AutoencoderExperiment(BaseExperiment):
             total_loss.item(),
             on_step=False,
             on_epoch=True,
+            sync_dist=True,
             prog_bar=True,
             batch_size=self.batch_size,
         )
@@ -123,6 +164,7 @@ class AutoencoderExperiment(BaseExperiment):
             self.log_3d_images(pred_logits.detach(), label="val/predictions")
             self.log_3d_images(output, label="val/groundtruth")
 
+    @rank_zero_only
     def log_3d_images(self, predictions, label):
         projections = [reproject(volume.squeeze(), 0) for volume in predictions]
         wandb.log(
@@ -150,55 +192,51 @@ class TLPredictorExperiment(BaseExperiment):
         self.TNet = autoencoder_model
         self.TNet.eval()  # set to eval mode
 
-    def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
-        ap, lat, seg = batch
-        ap_tensor, lat_tensor, seg_tensor = ap["ap"], lat["lat"], seg["seg"]
+    def get_input_from_batch(self, batch) -> Any:
+        ap, lat = batch[0], batch[1]
+        ap_tensor, lat_tensor = expand_kasten_views(ap["ap"], lat["lat"])
         batch_input = torch.cat((ap_tensor, lat_tensor), 1)
-        return [batch_input], seg_tensor
+        return [batch_input]
 
-    def predict_step(
-        self, batch: Any, batch_idx: int, dataloader_idx: Optional[int] = None
-    ) -> Any:
-        batch_input, output = self.get_input_output_from_batch(batch)
-        pred_latent_vec = self.model(*batch_input)
-        pred_logits = self.TNet.latent_vec_decode(pred_latent_vec)
-        pred = post_transform(pred_logits)
-
-        out = {}
-        seg_meta_dict = self.get_segmentation_meta_dict(batch)
-
-        out["pred"] = pred
-        out["gt"] = output
-        out["seg_meta_dict"] = seg_meta_dict
-
-        return out
+    def get_input_output_from_batch(self, batch) -> Tuple[Any, torch.Tensor]:
+        _, _, seg = batch
+        seg_tensor = self.decode_label(seg["seg"])
+        return self.get_input_from_batch(batch), seg_tensor
 
-    def training_step(self, batch, batch_idx):
-        batch_input, output = self.get_input_output_from_batch(batch)
+    def predict_logits(self, batch_input) -> torch.Tensor:
         pred_latent_vec = self.model(*batch_input)
+        return self.TNet.latent_vec_decode(pred_latent_vec)
 
-        pred_logits = self.TNet.latent_vec_decode(pred_latent_vec)
-        loss = self.loss_function(pred_logits, output)
-        with torch.no_grad():
+    def training_step(self, batch, batch_idx):
+        with self.profile_stage("get_input_output"):
+            batch_input, output = self.get_input_output_from_batch(batch)
+        with self.profile_stage("forward"):
+            pred_latent_vec = self.model(*batch_input)
+        with self.profile_stage("decode"):
+            pred_logits = self.TNet.latent_vec_decode(pred_latent_vec)
+        with self.profile_stage("loss"):
+            loss = self.loss_function(pred_logits, output)
+        with self.profile_stage("metrics"), torch.no_grad():
             pred = post_transform(pred_logits.detach())
             dice_metric = torch.mean(compute_dice(pred, output))
 
-        self.log(
-            "train/loss",
-            loss.item(),
-            on_step=True,
-            on_epoch=True,
-            prog_bar=True,
-            batch_size=self.batch_size,
-        )
-        self.log(
-            "train/dice",
-            dice_metric.item(),
-            on_step=True,
-            on_epoch=True,
-            prog_bar=True,
-            batch_size=self.batch_size,
-        )
+        with self.profile_stage("log_sync"):
+            self.log(
+                "train/loss",
+                loss.item(),
+                on_step=True,
+                on_epoch=True,
+                prog_bar=True,
+                batch_size=self.batch_size,
+            )
+            self.log(
+                "train/dice",
+                dice_metric.item(),
+                on_step=True,
+                on_epoch=True,
+                prog_bar=True,
+                batch_size=self.batch_size,
+            )
         return loss
 
     def validation_step(self, batch, batch_idx):
@@ -213,6 +251,7 @@ class TLPredictorExperiment(BaseExperiment):
             loss.item(),
             on_step=False,
             on_epoch=True,
+            sync_dist=True,
             prog_bar=True,
             batch_size=self.batch_size,
         )
@@ -221,6 +260,7 @@ class TLPredictorExperiment(BaseExperiment):
             dice_metric.item(),
             on_step=False,
             on_epoch=True,
+            sync_dist=True,
             prog_bar=True,
             batch_size=self.batch_size,
         )
@@ -0,0 +1,190 @@
+"""
+compile and export model architectures for deployment.
+`compile_model` applies torch.compile in place and reports where dynamo breaks the graph,
+`export_model` writes TorchScript or ONNX and checks the exported outputs against eager.
+exported models run without Lightning or the experiment classes.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+from monai.utils import optional_import
+from torch import nn
+
+from .consts import model_experiment_dict
+from .experiments import (
+    AutoencoderExperiment,
+    ParallelHeadsExperiment,
+    TLPredictorExperiment,
+    VolumeAsInputExperiment,
+)
+
+onnxruntime, has_onnxruntime = optional_import("onnxruntime")
+
+EXPORT_FORMATS = ("torchscript", "onnx")
+EXPORT_SUFFIX = {"torchscript": ".pt", "onnx": ".onnx"}
+
+
+def get_example_inputs(
+    model_name: str, image_size: int, batch_size: int = 1, device="cpu"
+) -> List[torch.Tensor]:
+    """random inputs with the shapes the experiment of the model feeds into it"""
+    experiment_name = model_experiment_dict[model_name]
+    if experiment_name == ParallelHeadsExperiment.__name__:
+        shape = (batch_size, 1, image_size, image_size)
+        return [torch.rand(shape, device=device), torch.rand(shape, device=device)]
+    if experiment_name in (
+        VolumeAsInputExperiment.__name__,
+        TLPredictorExperiment.__name__,
+    ):
+        # AP and LAT volumes stacked along the channel dimension
+        shape = (batch_size, 2, image_size, image_size, image_size)
+        return [torch.rand(shape, device=device)]
+    if experiment_name == AutoencoderExperiment.__name__:
+        shape = (batch_size, 1, image_size, image_size, image_size)
+        return [torch.rand(shape, device=device)]
+    raise ValueError(f"Invalid experiment name {experiment_name}")
+
+
+def get_graph_breaks(model: nn.Module, example_inputs: Sequence[torch.Tensor]) -> Dict:
+    """number of graphs and graph breaks dynamo produces for the model forward"""
+    import torch._dynamo  # pylint: disable=import-outside-toplevel
+
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(model)(*example_inputs)
+    torch._dynamo.reset()
+    return {
+        "graph_count": explanation.graph_count,
+        "graph_break_count": explanation.graph_break_count,
+        "break_reasons": sorted(
+            {str(reason.reason) for reason in explanation.break_reasons}
+        ),
+    }
+
+
+def compile_model(
+    model: nn.Module,
+    example_inputs: Optional[Sequence[torch.Tensor]] = None,
+    mode: str = "default",
+) -> nn.Module:
+    """torch.compile the model forward in place. the module itself is kept so that
+    state_dict keys and checkpoints do not change. with example inputs, graph breaks
+    are printed first"""
+    if not hasattr(torch, "compile"):
+        raise RuntimeError(f"torch.compile requires torch>=2.0, got {torch.__version__}")
+    if example_inputs is not None:
+        breaks = get_graph_breaks(model, example_inputs)
+        print(
+            f"{type(model).__name__}: {breaks['graph_count']} graphs, "
+            f"{breaks['graph_break_count']} graph breaks"
+        )
+        for reason in breaks["break_reasons"]:
+            print(f"    {reason}")
+    model.forward = torch.compile(model.forward, mode=mode)
+    return model
+
+
+def _as_tuple(outputs) -> tuple:
+    return tuple(outputs) if isinstance(outputs, (tuple, list)) else (outputs,)
+
+
+def _max_abs_difference(reference, outputs) -> float:
+    return max(
+        float((torch.as_tensor(out).to(ref.device) - ref).abs().max())
+        for ref, out in zip(_as_tuple(reference), _as_tuple(outputs))
+    )
+
+
+def get_validation_inputs(
+    example_inputs: Sequence[torch.Tensor],
+) -> List[Tuple[torch.Tensor, ...]]:
+    """fresh random inputs of the example shapes, once with the example batch size and
+    once with a larger one, so that a trace that hard-codes the batch size or values
+    of the example inputs is caught"""
+    batch_size = example_inputs[0].shape[0]
+    return [
+        tuple(
+            torch.rand(size, *x.shape[1:], dtype=x.dtype, device=x.device)
+            for x in example_inputs
+        )
+        for size in (batch_size, batch_size + 1)
+    ]
+
+
+def export_model(
+    model: nn.Module,
+    example_inputs: Sequence[torch.Tensor],
+    path: Union[str, Path],
+    export_format: str = "torchscript",
+    atol: float = 1e-4,
+    validation_inputs: Optional[Sequence[Sequence[torch.Tensor]]] = None,
+) -> Dict:
+    """write the model as TorchScript (traced) or ONNX and compare the outputs of the
+    exported model with eager outputs on inputs it was not traced with, by default
+    `get_validation_inputs`. ONNX parity requires onnxruntime, `parity` is None without it.
+
+    Returns:
+        Dict: path, max absolute difference to eager over the validation inputs, whether
+        it is within `atol` and the batch size and difference of each validation input
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export format should be one of {EXPORT_FORMATS}, got {export_format}")
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    model = model.eval()
+    example_inputs = tuple(example_inputs)
+    if validation_inputs is None:
+        validation_inputs = get_validation_inputs(example_inputs)
+    input_names = [f"input_{i}" for i in range(len(example_inputs))]
+
+    if export_format == "torchscript":
+        with torch.no_grad():
+            torch.jit.save(torch.jit.trace(model, example_inputs), str(path))
+        exported = torch.jit.load(str(path))
+
+        def run_exported(inputs):
+            with torch.no_grad():
+                return exported(*inputs)
+
+    else:
+        with torch.no_grad():
+            num_outputs = len(_as_tuple(model(*example_inputs)))
+        output_names = [f"output_{i}" for i in range(num_outputs)]
+        torch.onnx.export(
+            model,
+            example_inputs,
+            str(path),
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes={name: {0: "batch"} for name in input_names + output_names},
+            opset_version=17,
+        )
+        if not has_onnxruntime:
+            return {"path": str(path), "max_abs_diff": None, "parity": None, "validation": []}
+        session = onnxruntime.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+
+        def run_exported(inputs):
+            return session.run(
+                None, {name: x.cpu().numpy() for name, x in zip(input_names, inputs)}
+            )
+
+    validation = []
+    for inputs in validation_inputs:
+        inputs = tuple(inputs)
+        record = {"batch_size": int(inputs[0].shape[0])}
+        with torch.no_grad():
+            reference = model(*inputs)
+        try:
+            record["max_abs_diff"] = _max_abs_difference(reference, run_exported(inputs))
+        except Exception as error:  # pylint: disable=broad-except
+            # e.g. a trace that hard-codes the batch size
+            record["max_abs_diff"] = float("inf")
+            record["error"] = str(error)
+        validation.append(record)
+    max_abs_diff = max(record["max_abs_diff"] for record in validation)
+    return {
+        "path": str(path),
+        "max_abs_diff": max_abs_diff,
+        "parity": max_abs_diff <= atol,
+        "validation": validation,
+    }
@@ -0,0 +1,11 @@
+from .batching import LATENCY_BUCKETS_MS, LatencyHistogram, MicroBatchScheduler
+from .service import (
+    RESPONSE_FORMATS,
+    ReconstructionModel,
+    ReconstructionServer,
+    decode_packbits_response,
+    encode_nifti,
+    encode_packbits,
+    load_experiment,
+    load_state_dict,
+)
@@ -0,0 +1,172 @@
+"""coalesce concurrent single-sample requests into batched forward passes"""
+import bisect
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+# milliseconds, upper edges of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class LatencyHistogram:
+    """bucketed latency counts and percentiles over the most recent `window` samples"""
+
+    def __init__(self, buckets_ms: Sequence[float] = LATENCY_BUCKETS_MS, window: int = 10000):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)  # last bucket: above the largest edge
+        self.recent: deque = deque(maxlen=window)
+        self.total_seconds = 0.0
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets_ms, seconds * 1000)] += 1
+        self.recent.append(seconds)
+        self.total_seconds += seconds
+        self.count += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """milliseconds"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return 1000 * ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> Dict:
+        labels = [f"<={edge}ms" for edge in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total_seconds / self.count if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class _Request:
+    __slots__ = ("sample", "future", "submitted")
+
+    def __init__(self, sample: Any) -> None:
+        self.sample = sample
+        self.future: Future = Future()
+        self.submitted = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """collect samples submitted from many threads and run `predict_fn(key, samples)`
+    on batches of up to `max_batch_size` samples in a single worker thread.
+    samples are grouped by `key` (e.g. model and image size) so that a batch never
+    needs padding. a batch is dispatched as soon as it is full or its oldest sample
+    has waited `max_wait` seconds, so batches grow with the load while a lone
+    request is delayed by at most `max_wait`. keys are served oldest request first.
+
+    Args:
+        predict_fn (Callable[[Hashable, List[Any]], Sequence[Any]]): one result per sample
+        max_batch_size (int, optional): Defaults to 8.
+        max_wait (float, optional): seconds. Defaults to 0.005.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[Hashable, List[Any]], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.005,
+    ) -> None:
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queues: Dict[Hashable, deque] = OrderedDict()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.stats_lock = threading.Lock()
+        self.latency: Dict[Hashable, LatencyHistogram] = {}
+        self.queue_wait: Dict[Hashable, LatencyHistogram] = {}
+        self.batch_sizes: Dict[Hashable, Counter] = {}
+        self.busy_seconds = 0.0
+        self.start_time = time.perf_counter()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, sample: Any, key: Hashable = None) -> Future:
+        """the future resolves to the result of the sample"""
+        request = _Request(sample)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("scheduler is closed")
+            self.queues.setdefault(key, deque()).append(request)
+            self.condition.notify()
+        return request.future
+
+    def _next_batch(self):
+        """block until a batch is full or due, None once closed and drained"""
+        with self.condition:
+            while True:
+                pending = [(q[0].submitted, key) for key, q in self.queues.items() if q]
+                if not pending:
+                    if self.closed:
+                        return None
+                    self.condition.wait()
+                    continue
+                oldest, key = min(pending, key=lambda item: item[0])
+                queue = self.queues[key]
+                wait = oldest + self.max_wait - time.perf_counter()
+                if len(queue) >= self.max_batch_size or wait <= 0 or self.closed:
+                    batch_size = min(len(queue), self.max_batch_size)
+                    return key, [queue.popleft() for _ in range(batch_size)]
+                self.condition.wait(wait)
+
+    def _predict(self, key, requests: List[_Request]):
+        start = time.perf_counter()
+        try:
+            results = self.predict_fn(key, [request.sample for request in requests])
+        except Exception as error:  # pylint: disable=broad-except
+            for request in requests:
+                request.future.set_exception(error)
+            return
+        end = time.perf_counter()
+        with self.stats_lock:
+            self.busy_seconds += end - start
+            self.batch_sizes.setdefault(key, Counter())[len(requests)] += 1
+            for request in requests:
+                self.queue_wait.setdefault(key, LatencyHistogram()).record(
+                    start - request.submitted
+                )
+                self.latency.setdefault(key, LatencyHistogram()).record(
+                    end - request.submitted
+                )
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._predict(*batch)
+
+    def stats(self) -> Dict:
+        """per key request latency (submit to result), queue wait and batch sizes,
+        and the fraction of time the worker spent in `predict_fn`"""
+        with self.stats_lock:
+            return {
+                "utilisation": self.busy_seconds / (time.perf_counter() - self.start_time),
+                "keys": {
+                    str(key): {
+                        "latency": self.latency[key].summary(),
+                        "queue_wait": self.queue_wait[key].summary(),
+                        "batch_sizes": dict(sorted(self.batch_sizes[key].items())),
+                    }
+                    for key in self.latency
+                },
+            }
+
+    def close(self):
+        """serve the queued samples, then stop the worker thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
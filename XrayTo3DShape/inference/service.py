@@ -0,0 +1,262 @@
+"""
+HTTP service that reconstructs 3D shapes from AP/LAT x-ray pairs.
+checkpoints are loaded once, every request goes through the same transforms as
+training and concurrent requests are batched into a single forward pass.
+
+    POST /predict  {"model": "femur", "ap": <base64 png>, "lat": <base64 png>, "format": "nifti"}
+        nifti    -> gzipped nifti (application/gzip) with the PIR affine of the predictions
+        packbits -> json {"shape", "affine", "bits": <base64 bits packed along the last axis>}
+    GET /health    served models
+    GET /stats     per model latency histograms, batch sizes and utilisation of the batching worker
+"""
+import base64
+import gzip
+import json
+import tempfile
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import nibabel as nib
+import numpy as np
+import torch
+from monai.utils import convert_to_tensor
+
+from .. import experiments
+from ..architectures import CustomAutoEncoder, get_model
+from ..consts import (
+    get_transform_family_from_model_name,
+    get_transform_from_model_name,
+    model_experiment_dict,
+)
+from ..experiments import BaseExperiment, TLPredictorExperiment
+from ..utils import get_pir_affine, modify_checkpoint_keys
+from .batching import MicroBatchScheduler
+
+RESPONSE_FORMATS = ("nifti", "packbits")
+
+
+def load_state_dict(ckpt_path):
+    """lightning checkpoint without the loss function buffers e.g. pos_weight"""
+    checkpoint = torch.load(ckpt_path, map_location="cpu")
+    for key in list(checkpoint["state_dict"].keys()):
+        if key.startswith("loss_function."):
+            checkpoint["state_dict"].pop(key)
+    return checkpoint
+
+
+def load_experiment(
+    model_name: str,
+    ckpt_path: str,
+    image_size: int,
+    label_format: str = "float32",
+    patch_size: Optional[int] = None,
+    load_autoencoder_from: Optional[str] = None,
+    device="cpu",
+    **kwargs: Any,
+) -> BaseExperiment:
+    """build the experiment module of the model and restore its checkpoint.
+    `kwargs` are passed to the experiment e.g. sw_batch_size, channels_last"""
+    experiment_name = model_experiment_dict[model_name]
+    # with sliding window prediction, the model is built for the patch size
+    model_image_size = patch_size if patch_size else image_size
+    model_architecture = get_model(model_name=model_name, image_size=model_image_size)
+    model_module = getattr(experiments, experiment_name)(
+        model=model_architecture, label_format=label_format, patch_size=patch_size, **kwargs
+    )
+    if experiment_name == TLPredictorExperiment.__name__:
+        ae_model = get_model(
+            model_name=CustomAutoEncoder.__name__, image_size=model_image_size
+        )
+        if load_autoencoder_from is None or not Path(load_autoencoder_from).exists():
+            raise ValueError(
+                f"autoencoder checkpoint {load_autoencoder_from} does not exist"
+            )
+        checkpoint = load_state_dict(load_autoencoder_from)
+        for key in list(checkpoint["state_dict"].keys()):
+            # model.layer1.conv1 -> layer1.conv1
+            modified_key = key.replace("model.", "")
+            checkpoint["state_dict"][modified_key] = checkpoint["state_dict"].pop(key)
+        ae_model.load_state_dict(checkpoint["state_dict"], strict=True)
+        model_module.set_decoder(ae_model)  # type: ignore
+
+        checkpoint = modify_checkpoint_keys(load_state_dict(ckpt_path))
+        model_architecture.load_state_dict(checkpoint["state_dict"], strict=False)
+        model_module.model = model_architecture
+    else:
+        checkpoint = load_state_dict(ckpt_path)
+        model_module.load_state_dict(checkpoint["state_dict"], strict=True)
+    return model_module.to(device).eval()
+
+
+def encode_nifti(volume: np.ndarray, affine: np.ndarray) -> bytes:
+    """gzipped nifti of a binary volume"""
+    image = nib.Nifti1Image(volume.astype(np.uint8), affine)
+    return gzip.compress(image.to_bytes(), compresslevel=1)
+
+
+def encode_packbits(volume: np.ndarray, affine: np.ndarray) -> Dict:
+    """binary volume as bits packed along the last axis, same layout as the `packbits` label format"""
+    return {
+        "shape": list(volume.shape),
+        "affine": affine.tolist(),
+        "bits": base64.b64encode(np.packbits(volume > 0, axis=-1).tobytes()).decode(),
+    }
+
+
+class ReconstructionModel:
+    """experiment module with its preprocessing transforms"""
+
+    def __init__(
+        self,
+        model_module: BaseExperiment,
+        model_name: str,
+        image_size: int,
+        resolution: float,
+        device="cpu",
+    ) -> None:
+        if get_transform_family_from_model_name(model_name) == "denoising_autoencoder":
+            raise ValueError(f"{model_name} does not take x-ray images as input")
+        self.model_name = model_name
+        self.image_size = image_size
+        self.resolution = resolution
+        self.device = torch.device(device)
+        self.model_module = model_module.to(self.device).eval()
+        # kasten views are expanded into volumes on the device
+        self.transforms = get_transform_from_model_name(
+            model_name, image_size=image_size, resolution=resolution, lazy_kasten=True
+        )
+        self.affine = get_pir_affine(resolution)
+
+    def preprocess(self, ap_png: bytes, lat_png: bytes) -> Tuple[torch.Tensor, torch.Tensor]:
+        """run the training transforms on the PNG pair"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ap_path, lat_path = Path(tmp_dir) / "ap.png", Path(tmp_dir) / "lat.png"
+            ap_path.write_bytes(ap_png)
+            lat_path.write_bytes(lat_png)
+            ap = self.transforms["ap"]({"ap": str(ap_path)})["ap"]
+            lat = self.transforms["lat"]({"lat": str(lat_path)})["lat"]
+        return convert_to_tensor(ap, track_meta=False), convert_to_tensor(lat, track_meta=False)
+
+    def predict_batch(self, samples: List[Tuple[torch.Tensor, torch.Tensor]]) -> List[np.ndarray]:
+        """(D,H,W) uint8 predictions of preprocessed samples"""
+        ap = torch.stack([ap for ap, _ in samples]).to(self.device)
+        lat = torch.stack([lat for _, lat in samples]).to(self.device)
+        with torch.inference_mode():
+            batch_input = self.model_module.get_input_from_batch(({"ap": ap}, {"lat": lat}))
+            pred = self.model_module.predict_segmentation(batch_input)
+        return list(pred[:, 0].to(torch.uint8).cpu().numpy())
+
+    def info(self) -> Dict:
+        return {
+            "model_name": self.model_name,
+            "image_size": self.image_size,
+            "resolution": self.resolution,
+        }
+
+
+class ReconstructionRequestHandler(BaseHTTPRequestHandler):
+    """json requests, one thread per connection"""
+
+    server: "ReconstructionServer"
+
+    def _send(self, status: HTTPStatus, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: HTTPStatus, payload: Dict):
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == "/health":
+            models = {name: model.info() for name, model in self.server.models.items()}
+            self._send_json(HTTPStatus.OK, {"models": models})
+        elif self.path == "/stats":
+            self._send_json(HTTPStatus.OK, self.server.scheduler.stats())
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.path != "/predict":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            name = self.server.get_model_name(request.get("model"))
+            response_format = request.get("format", "nifti")
+            if response_format not in RESPONSE_FORMATS:
+                raise ValueError(f"format should be one of {RESPONSE_FORMATS}, got {response_format}")
+            ap_png = base64.b64decode(request["ap"])
+            lat_png = base64.b64decode(request["lat"])
+        except (ValueError, KeyError, TypeError) as error:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        try:
+            volume = self.server.reconstruct(name, ap_png, lat_png)
+        except Exception as error:  # pylint: disable=broad-except
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)})
+            return
+        affine = self.server.models[name].affine
+        if response_format == "nifti":
+            self._send(HTTPStatus.OK, encode_nifti(volume, affine), "application/gzip")
+        else:
+            self._send_json(HTTPStatus.OK, encode_packbits(volume, affine))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ReconstructionServer(ThreadingHTTPServer):
+    """serve one or more `ReconstructionModel`s by name.
+    preprocessing runs in the request threads, the forward passes of all models
+    share one `MicroBatchScheduler` that batches requests per model"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        models: Dict[str, ReconstructionModel],
+        max_batch_size: int = 8,
+        max_wait: float = 0.005,
+        verbose: bool = False,
+    ) -> None:
+        super().__init__(server_address, ReconstructionRequestHandler)
+        self.models = models
+        self.verbose = verbose
+        self.scheduler = MicroBatchScheduler(
+            lambda name, samples: self.models[name].predict_batch(samples),
+            max_batch_size=max_batch_size,
+            max_wait=max_wait,
+        )
+
+    def get_model_name(self, name: Optional[str]) -> str:
+        """the only model may be requested without a name"""
+        if name is None and len(self.models) == 1:
+            return next(iter(self.models))
+        if name not in self.models:
+            raise ValueError(f"model should be one of {sorted(self.models)}, got {name}")
+        return name
+
+    def reconstruct(self, name: str, ap_png: bytes, lat_png: bytes) -> np.ndarray:
+        """(D,H,W) uint8 prediction of the named model"""
+        sample = self.models[name].preprocess(ap_png, lat_png)
+        return self.scheduler.submit(sample, key=name).result()
+
+    def server_close(self):
+        super().server_close()
+        self.scheduler.close()
+
+
+def decode_packbits_response(response: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """client side: (D,H,W) uint8 volume and affine of a `packbits` response"""
+    shape: Sequence[int] = response["shape"]
+    bits = np.frombuffer(base64.b64decode(response["bits"]), dtype=np.uint8)
+    packed_shape = (*shape[:-1], -1)
+    volume = np.unpackbits(bits.reshape(packed_shape), axis=-1, count=shape[-1])
+    return volume, np.asarray(response["affine"])
@@ -25,9 +25,9 @@ def get_loss(loss_name, **kwargs):
     elif loss_name == DiceCELoss.__name__:
         return get_DiceCE(**kwargs, sigmoid=True)
     elif loss_name == HausdorffDTLoss.__name__:
-        return HausdorffDTLoss(device=kwargs["device"])
+        return HausdorffDTLoss(device=kwargs["device"], sigmoid=True)
     elif loss_name == HausdorffERLoss.__name__:
-        return HausdorffERLoss(device=kwargs["device"])  # broken
+        return HausdorffERLoss(device=kwargs["device"], sigmoid=True)
     else:
         raise ValueError(f"invalid loss name {loss_name}")
 
@@ -7,27 +7,64 @@ https://arxiv.org/pdf/1904.10030.pdf
 copy pasted from - all credit goes to original authors:
 https://github.com/SilmarilBearer/HausdorffLoss
 """
-import cv2 as cv
 import numpy as np
 import torch
-from scipy.ndimage import convolve
+import torch.nn.functional as F
 from scipy.ndimage.morphology import distance_transform_edt as edt
 from torch import nn
 
+from ..metrics import distance_transform_edt
+
 
 class HausdorffDTLoss(nn.Module):
-    """Binary Hausdorff loss based on distance transform"""
+    """Binary Hausdorff loss based on distance transform.
+    distance fields are computed in torch on the device of the input,
+    backend="scipy" keeps the reference cpu implementation"""
 
-    def __init__(self, device, alpha=2.0, **kwargs):
+    def __init__(self, device, alpha=2.0, backend="torch", sigmoid=False, **kwargs):
         super(HausdorffDTLoss, self).__init__()
+        if backend not in ("torch", "scipy"):
+            raise ValueError(f"backend can be either torch or scipy, got {backend}")
         self.alpha = alpha
         self.device = device
+        self.backend = backend
+        self.sigmoid = sigmoid
 
     @torch.no_grad()
-    def distance_field(self, img: np.ndarray) -> np.ndarray:
+    def distance_field(self, img: torch.Tensor) -> torch.Tensor:
+        """sum of the distances to the boundary from inside and outside the foreground,
+        zero for items without foreground. Items are expected to have one channel,
+        the torch and scipy backends then agree also for items without background"""
+        if self.backend == "scipy":
+            return (
+                torch.from_numpy(self.distance_field_scipy(img.detach().cpu().numpy()))
+                .float()
+                .to(device=img.device)
+            )
+        fg_mask = (img > 0.5).flatten(0, 1)  # (b*c, x, y, z)
+        field = distance_transform_edt(fg_mask) + distance_transform_edt(~fg_mask)
+        item_shape = (-1,) + (1,) * (fg_mask.ndim - 1)
+        # items without foreground have no boundary
+        has_fg = fg_mask.flatten(1).any(dim=1).view(item_shape)
+        field = torch.where(has_fg, field, torch.zeros_like(field))
+        # for items without background, scipy measures the distance to the voxel
+        # preceding the origin along the channel axis of the (1, x, y, z) item
+        no_bg = fg_mask.flatten(1).all(dim=1)
+        if no_bg.any():
+            sq_distance = torch.ones(fg_mask.shape[1:], device=field.device)
+            for axis, size in enumerate(fg_mask.shape[1:]):
+                coords = torch.arange(size, dtype=field.dtype, device=field.device) ** 2
+                view_shape = [1] * (fg_mask.ndim - 1)
+                view_shape[axis] = size
+                sq_distance = sq_distance + coords.view(view_shape)
+            field[no_bg] = sq_distance.sqrt()
+        return field.view(img.shape)
+
+    @staticmethod
+    def distance_field_scipy(img: np.ndarray) -> np.ndarray:
         field = np.zeros_like(img)
 
-        for batch in img:
+        for index, batch in enumerate(img):
             fg_mask = batch > 0.5
 
             if fg_mask.any():
@@ -36,7 +73,7 @@ class HausdorffDTLoss(nn.Module):
                 fg_dist: np.ndarray = edt(fg_mask)  # type: ignore
                 bg_dist: np.ndarray = edt(bg_mask)  # type: ignore
 
-                field[batch] = fg_dist + bg_dist
+                field[index] = fg_dist + bg_dist
 
         return field
 
@@ -53,18 +90,11 @@ class HausdorffDTLoss(nn.Module):
             pred.dim() == target.dim()
         ), "Prediction and target need to be of same dimension"
 
-        # pred = torch.sigmoid(pred)
+        if self.sigmoid:
+            pred = torch.sigmoid(pred)
 
-        pred_dt = (
-            torch.from_numpy(self.distance_field(pred.detach().cpu().numpy()))
-            .float()
-            .to(device=self.device)
-        )
-        target_dt = (
-            torch.from_numpy(self.distance_field(target.detach().cpu().numpy()))
-            .float()
-            .to(device=self.device)
-        )
+        pred_dt = self.distance_field(pred)
+        target_dt = self.distance_field(target)
 
         pred_error = (pred - target) ** 2
         distance = pred_dt**self.alpha + target_dt**self.alpha
@@ -89,59 +119,65 @@ class HausdorffDTLoss(nn.Module):
 
 
 class HausdorffERLoss(nn.Module):
-    """Binary Hausdorff loss based on morphological erosion"""
+    """Binary Hausdorff loss based on morphological erosion.
+    erosions run as grouped convolutions over the whole batch on the device of the input"""
 
-    def __init__(self, device, alpha=2.0, erosions=10, **kwargs):
+    def __init__(self, device, alpha=2.0, erosions=10, sigmoid=False, **kwargs):
         super(HausdorffERLoss, self).__init__()
         self.alpha = alpha
         self.erosions = erosions
         self.device = device
+        self.sigmoid = sigmoid
         self.prepare_kernels()
 
     def prepare_kernels(self):
-        cross = np.array([cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))])
-        bound = np.array([[[0, 0, 0], [0, 1, 0], [0, 0, 0]]])
-
-        self.kernel2D = cross * 0.2
-        self.kernel3D = np.array([bound, cross, bound]) * (1 / 7)
+        cross = torch.tensor([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=torch.float32)
+        bound = torch.tensor([[0, 0, 0], [0, 1, 0], [0, 0, 0]], dtype=torch.float32)
+
+        self.register_buffer("kernel2D", (cross * 0.2)[None, None], persistent=False)
+        self.register_buffer(
+            "kernel3D",
+            (torch.stack([bound, cross, bound]) * (1 / 7))[None, None],
+            persistent=False,
+        )
 
-    @torch.no_grad()
-    def perform_erosion(
-        self, pred: np.ndarray, target: np.ndarray, debug
-    ) -> np.ndarray:
+    def perform_erosion(self, pred: torch.Tensor, target: torch.Tensor, debug):
         bound = (pred - target) ** 2
 
         if bound.ndim == 5:
-            kernel = self.kernel3D
+            conv, kernel = F.conv3d, self.kernel3D
         elif bound.ndim == 4:
-            kernel = self.kernel2D
+            conv, kernel = F.conv2d, self.kernel2D
         else:
             raise ValueError(f"Dimension {bound.ndim} is nor supported.")
+        channels = bound.shape[1]
+        kernel = kernel.to(dtype=bound.dtype, device=bound.device)
+        kernel = kernel.expand(channels, *kernel.shape[1:])
+        item_shape = (-1,) + (1,) * (bound.ndim - 1)
+
+        eroded = torch.zeros_like(bound)
+        erosions = [bound[0, 0].detach().cpu().numpy()]
+
+        for k in range(self.erosions):
+            # compute convolution with kernel
+            dilation = conv(bound, kernel, padding=1, groups=channels)
+
+            # apply soft thresholding at 0.5 and normalize each batch item
+            erosion = F.relu(dilation - 0.5)
+            erosion_min = erosion.flatten(1).amin(dim=1).view(item_shape)
+            erosion_ptp = erosion.flatten(1).amax(dim=1).view(item_shape) - erosion_min
+            erosion = torch.where(
+                erosion_ptp > 0,
+                (erosion - erosion_min) / erosion_ptp.clamp(min=1e-12),
+                erosion,
+            )
 
-        eroded = np.zeros_like(bound)
-        erosions = []
-
-        for batch, _ in enumerate(bound):
-            # debug
-            erosions.append(np.copy(bound[batch][0]))
-
-            for k in range(self.erosions):
-                # compute convolution with kernel
-                dilation = convolve(bound[batch], kernel, mode="constant", cval=0.0)
-
-                # apply soft thresholding at 0.5 and normalize
-                erosion = dilation - 0.5
-                erosion[erosion < 0] = 0
-
-                if erosion.ptp() != 0:
-                    erosion = (erosion - erosion.min()) / erosion.ptp()
-
-                # save erosion and add to loss
-                bound[batch] = erosion
-                eroded[batch] += erosion * (k + 1) ** self.alpha
+            # save erosion and add to loss
+            bound = erosion
+            eroded = eroded + erosion * (k + 1) ** self.alpha
 
-                if debug:
-                    erosions.append(np.copy(erosion[0]))
+            if debug:
+                erosions.append(erosion[0, 0].detach().cpu().numpy())
 
         # image visualization in debug mode
         if debug:
@@ -162,27 +198,11 @@ class HausdorffERLoss(nn.Module):
             pred.dim() == target.dim()
         ), "Prediction and target need to be of same dimension"
 
-        # pred = torch.sigmoid(pred)
+        if self.sigmoid:
+            pred = torch.sigmoid(pred)
 
         if debug:
-            eroded, erosions = self.perform_erosion(
-                pred.cpu().numpy(), target.cpu().numpy(), debug
-            )
+            eroded, erosions = self.perform_erosion(pred, target, debug)
             return eroded.mean(), erosions
 
-        else:
-            eroded = (
-                torch.from_numpy(
-                    self.perform_erosion(
-                        pred.detach().cpu().numpy(),
-                        target.detach().cpu().numpy(),
-                        debug,
-                    )
-                )
-                .float()
-                .to(device=self.device)
-            )
-
-            loss = eroded.mean()
-
-            return loss
+        return self.perform_erosion(pred, target, debug).mean()
@@ -0,0 +1,3 @@
+from .distance_transform import distance_transform_edt
+from .surface_metrics import (compute_surface_metrics, get_mask_edges,
+                              get_neighbour_code)
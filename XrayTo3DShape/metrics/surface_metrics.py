@@ -0,0 +1,180 @@
+"""
+batched DSC, ASD, HD95 and NSD on the device of the predictions.
+
+Surfaces and distance maps are computed once per batch and shared between the
+metrics. ASD/HD95 follow the monai conventions (surface = voxels removed by a
+binary erosion, distances in voxels). NSD follows `surface_distance`: surfels
+live on the 2x2x2 neighbourhood grid, are weighted by their surface area and
+distances are in mm. The two surface definitions live on different grids,
+so there is one set of distance maps per grid.
+"""
+from typing import Dict, Sequence, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+from surface_distance.lookup_tables import (
+    ENCODE_NEIGHBOURHOOD_3D_KERNEL,
+    create_table_neighbour_code_to_surface_area,
+)
+
+from .distance_transform import DEFAULT_CHUNK_SIZE, distance_transform_edt
+
+
+def _as_batch_of_masks(volume: torch.Tensor) -> torch.Tensor:
+    """(B,1,D,H,W) or (B,D,H,W) -> (B,D,H,W) bool"""
+    volume = torch.as_tensor(volume)
+    if volume.ndim == 5:
+        if volume.shape[1] != 1:
+            raise ValueError(f"expected single channel masks, got {volume.shape}")
+        volume = volume[:, 0]
+    if volume.ndim != 4:
+        raise ValueError(f"expected (B,1,D,H,W) or (B,D,H,W) masks, got {volume.shape}")
+    return volume != 0
+
+
+def _crop_to_foreground(
+    pred: torch.Tensor, gt: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """crop the batch to the bounding box of the union of all masks.
+    distances between surfaces do not change, the distance transforms get cheaper."""
+    union = (pred | gt).any(dim=0).to(torch.uint8)
+    if not union.any():
+        return pred, gt
+    slices = [slice(None)]
+    for axis in range(union.ndim):
+        other_axes = [a for a in range(union.ndim) if a != axis]
+        nonzero = union.amax(dim=other_axes).nonzero().flatten()
+        slices.append(slice(int(nonzero[0]), int(nonzero[-1]) + 1))
+    return pred[tuple(slices)], gt[tuple(slices)]
+
+
+def get_mask_edges(mask: torch.Tensor) -> torch.Tensor:
+    """voxels removed by a binary erosion with a cross-shaped structuring element,
+    same as `monai.metrics.utils.get_mask_edges`. (B,D,H,W) bool"""
+    padded = F.pad(mask.to(torch.uint8), (1,) * 6)
+    eroded = mask.clone()
+    for axis in range(1, mask.ndim):
+        for shift in (0, 2):
+            window = [slice(None)] + [slice(1, 1 + n) for n in mask.shape[1:]]
+            window[axis] = slice(shift, shift + mask.shape[axis])
+            eroded &= padded[tuple(window)].bool()
+    return mask & ~eroded
+
+
+def get_neighbour_code(mask: torch.Tensor) -> torch.Tensor:
+    """(B,D,H,W) bool -> (B,D+1,H+1,W+1) code of each 2x2x2 neighbourhood,
+    same as the correlation in `surface_distance.compute_surface_distances`"""
+    padded = F.pad(mask.to(torch.int32), (1,) * 6)
+    spatial_shape = [n + 1 for n in mask.shape[1:]]
+    code = torch.zeros(
+        (mask.shape[0], *spatial_shape), dtype=torch.int64, device=mask.device
+    )
+    for i in range(2):
+        for j in range(2):
+            for k in range(2):
+                code += int(ENCODE_NEIGHBOURHOOD_3D_KERNEL[i, j, k]) * padded[
+                    :,
+                    i : i + spatial_shape[0],
+                    j : j + spatial_shape[1],
+                    k : k + spatial_shape[2],
+                ]
+    return code
+
+
+def _percentile(values: torch.Tensor, percentile: float) -> torch.Tensor:
+    """linear interpolation, same as `np.percentile`"""
+    return torch.quantile(values.double(), percentile / 100.0)
+
+
+def compute_surface_metrics(
+    pred: torch.Tensor,
+    gt: torch.Tensor,
+    voxel_spacing: Union[float, Sequence[float]] = 1.0,
+    nsd_tolerance: float = 1.5,
+    percentile: float = 95,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, torch.Tensor]:
+    """evaluate a batch of binary predictions against the ground truth
+
+    DSC  : nan for empty ground truth, as `monai.metrics.DiceMetric`
+    ASD  : mean distance from the predicted to the ground truth surface in voxels, as `monai.metrics.SurfaceDistanceMetric`
+    HD95 : larger of the two directed percentile distances in voxels, as `monai.metrics.HausdorffDistanceMetric(percentile=95)`
+    NSD  : fraction of the ground truth surface area within `nsd_tolerance` mm of the predicted surface,
+           as `compute_surface_overlap_at_tolerance(compute_surface_distances(gt, pred, spacing), tolerance)[0]`
+    ASD/HD95 are `inf` when exactly one of the masks is empty and `nan` when both are.
+
+    Args:
+        pred (torch.Tensor): (B,1,D,H,W) or (B,D,H,W) binary prediction
+        gt (torch.Tensor): same shape as `pred`
+        voxel_spacing (float or Sequence[float], optional): spacing in mm used by NSD. Defaults to 1.0.
+        nsd_tolerance (float, optional): NSD tolerance in mm. Defaults to 1.5.
+        percentile (float, optional): Hausdorff distance percentile. Defaults to 95.
+        chunk_size (int, optional): bounds memory of the distance transforms
+
+    Returns:
+        Dict[str, torch.Tensor]: DSC, ASD, HD95, NSD, each (B,) float64 on cpu
+    """
+    pred, gt = _as_batch_of_masks(pred), _as_batch_of_masks(gt)
+    if pred.shape != gt.shape:
+        raise ValueError(f"pred {pred.shape} and gt {gt.shape} should have same shape")
+    batch_size = pred.shape[0]
+    if isinstance(voxel_spacing, (int, float)):
+        voxel_spacing = (float(voxel_spacing),) * 3
+    nan = torch.tensor(float("nan"), dtype=torch.float64, device=pred.device)
+    inf = torch.tensor(float("inf"), dtype=torch.float64, device=pred.device)
+
+    pred_volume = pred.flatten(1).sum(1).double()
+    gt_volume = gt.flatten(1).sum(1).double()
+    intersection = (pred & gt).flatten(1).sum(1).double()
+    dsc = torch.where(
+        gt_volume > 0, 2.0 * intersection / (pred_volume + gt_volume), nan
+    )
+
+    pred, gt = _crop_to_foreground(pred, gt)
+
+    # voxel grid: edges and distance maps shared by ASD and HD95
+    pred_edges, gt_edges = get_mask_edges(pred), get_mask_edges(gt)
+    dist_to_gt, dist_to_pred = distance_transform_edt(
+        ~torch.cat([gt_edges, pred_edges]), chunk_size=chunk_size
+    ).split(batch_size)
+    pred_count = pred_edges.flatten(1).sum(1)
+    gt_count = gt_edges.flatten(1).sum(1)
+    any_empty = (pred_count == 0) | (gt_count == 0)
+    empty_value = torch.where((pred_count == 0) & (gt_count == 0), nan, inf)
+
+    asd = (
+        torch.where(pred_edges, dist_to_gt, 0.0).flatten(1).double().sum(1)
+        / pred_count.clamp(min=1)
+    )
+    asd = torch.where(any_empty, empty_value, asd)
+
+    hd = empty_value.clone()
+    for index in torch.nonzero(~any_empty).flatten().tolist():
+        hd[index] = torch.maximum(
+            _percentile(dist_to_gt[index][pred_edges[index]], percentile),
+            _percentile(dist_to_pred[index][gt_edges[index]], percentile),
+        )
+
+    # surfel grid: area weighted gt surface, distance map of the predicted surface
+    pred_code, gt_code = get_neighbour_code(pred), get_neighbour_code(gt)
+    pred_borders = (pred_code != 0) & (pred_code != 255)
+    gt_borders = (gt_code != 0) & (gt_code != 255)
+    area_table = torch.as_tensor(
+        create_table_neighbour_code_to_surface_area(voxel_spacing),
+        dtype=torch.float64,
+        device=pred.device,
+    )
+    gt_area = torch.where(gt_borders, area_table[gt_code], 0.0)
+    dist_gt_to_pred = distance_transform_edt(
+        ~pred_borders, spacing=voxel_spacing, chunk_size=chunk_size, dtype=torch.float64
+    )
+    nsd = torch.where(dist_gt_to_pred <= nsd_tolerance, gt_area, 0.0).flatten(1).sum(
+        1
+    ) / gt_area.flatten(1).sum(1)
+
+    return {
+        "DSC": dsc.cpu(),
+        "ASD": asd.cpu(),
+        "HD95": hd.cpu(),
+        "NSD": nsd.cpu(),
+    }
@@ -3,4 +3,7 @@ from .base_transforms import (get_denoising_autoencoder_transforms,
                               get_resize_transform)
 from .deformable_transforms import (get_atlas_deformation_transforms,
                                     get_deformation_transforms)
+from .label_transforms import (LABEL_FORMATS, decode_label,
+                               get_label_format_transform, pack_label_bits,
+                               unpack_label_bits)
 from .post_transform import post_transform, post_transform_onehot
@@ -15,6 +15,8 @@ from monai.transforms.croppad.dictionary import ResizeWithPadOrCropD
 from monai.transforms.compose import Compose
 from skimage.util import random_noise
 
+from .label_transforms import get_label_format_transform
+
 
 def get_resize_transform(
     keys, original_size: Sequence[int], reduction_rate: float, mode="nearest"
@@ -87,8 +89,9 @@ def get_denoising_autoencoder_transforms(size=64, resolution=1.5):
     }
 
 
-def get_nonkasten_transforms(size=64, resolution=1.5):
-    """transform AP and LAT images as 2D images"""
+def get_nonkasten_transforms(size=64, resolution=1.5, label_format="float32"):
+    """transform AP and LAT images as 2D images
+    labels are carried as `float32`, `uint8` or `packbits`"""
     ap_transform = Compose(
         [
             LoadImageD(
@@ -153,14 +156,48 @@ def get_nonkasten_transforms(size=64, resolution=1.5):
             ResizeWithPadOrCropD(keys={"seg"}, spatial_size=(size, size, size)),
             OrientationD(keys={"seg"}, axcodes="PIR"),
             ThresholdIntensityD(keys="seg", threshold=0.5, above=False, cval=1.0),
+            *get_label_format_transform(keys="seg", label_format=label_format),
             # DataStatsD(keys='seg')
         ]
     )
     return {"ap": ap_transform, "lat": lat_transform, "seg": seg_transform}
 
 
-def get_kasten_transforms(size=64, resolution=1.5):
-    """transform AP/LAT images into 3D volumes by repeating along orthogonal directions"""
+def get_kasten_transforms(size=64, resolution=1.5, lazy=False, label_format="float32"):
+    """transform AP/LAT images into 3D volumes by repeating along orthogonal directions
+
+    Args:
+        size (int, optional): image size. Defaults to 64.
+        resolution (float, optional): image resolution. Defaults to 1.5.
+        lazy (bool, optional): keep AP/LAT as 2D images, the experiment broadcasts
+            them into volumes on the device. Defaults to False.
+        label_format (str, optional): carry labels as `float32`, `uint8` or `packbits`.
+            Defaults to "float32".
+
+    Returns:
+        dict[str,monai.transforms]: ap,lat,seg callable transforms
+    """
+    # repeating does not change the min-max intensity scaling, so the
+    # lazily expanded volumes are identical to the repeated ones
+    ap_expansion = (
+        []
+        if lazy
+        else [
+            LambdaD(
+                keys={"ap"}, func=lambda t: einops.repeat(t, "1 m n -> 1 k m n", k=size)
+            )
+        ]
+    )
+    lat_expansion = (
+        []
+        if lazy
+        else [
+            LambdaD(
+                keys={"lat"},
+                func=lambda t: einops.repeat(t, "1 m n -> 1 m n k", k=size),
+            )
+        ]
+    )
     ap_transform = Compose(
         [
             LoadImageD(
@@ -179,9 +216,7 @@ def get_kasten_transforms(size=64, resolution=1.5):
                 mode="bilinear",
                 align_corners=True,
             ),
-            LambdaD(
-                keys={"ap"}, func=lambda t: einops.repeat(t, "1 m n -> 1 k m n", k=size)
-            ),
+            *ap_expansion,
             ScaleIntensityD(keys={"ap"}),
             # DataStatsD(keys='ap')
         ]
@@ -204,10 +239,7 @@ def get_kasten_transforms(size=64, resolution=1.5):
                 mode="bilinear",
                 align_corners=True,
             ),
-            LambdaD(
-                keys={"lat"},
-                func=lambda t: einops.repeat(t, "1 m n -> 1 m n k", k=size),
-            ),
+            *lat_expansion,
             ScaleIntensityD(keys={"lat"}),
             # DataStatsD(keys='lat')
         ]
@@ -230,6 +262,7 @@ def get_kasten_transforms(size=64, resolution=1.5):
             ),
             ResizeWithPadOrCropD(keys={"seg"}, spatial_size=(size, size, size)),
             ThresholdIntensityD(keys="seg", threshold=0.5, above=False, cval=1.0),
+            *get_label_format_transform(keys="seg", label_format=label_format),
             # DataStatsD(keys='seg')
         ]
     )
@@ -0,0 +1,45 @@
+"""compact representation of binary segmentation labels in the data pipeline.
+labels are carried as uint8 or as bits packed along the last axis
+and expanded to float only on the device"""
+import numpy as np
+import torch
+from monai.transforms.utility.dictionary import CastToTypeD, LambdaD
+
+LABEL_FORMATS = ("float32", "uint8", "packbits")
+
+
+def pack_label_bits(seg) -> np.ndarray:
+    """(C,D,H,W) binary label -> (C,D,H,W/8) uint8, same bit order as `np.packbits`"""
+    seg = np.asarray(seg)
+    if seg.shape[-1] % 8 != 0:
+        raise ValueError(
+            f"last dimension of the label should be divisible by 8, got {seg.shape}"
+        )
+    return np.packbits(seg >= 0.5, axis=-1)
+
+
+def unpack_label_bits(packed: torch.Tensor) -> torch.Tensor:
+    """(...,W/8) uint8 -> (...,W) uint8 on the device of the packed tensor"""
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=packed.device)
+    bits = (packed.to(torch.uint8).unsqueeze(-1) >> shifts) & 1
+    return bits.flatten(-2)
+
+
+def decode_label(seg: torch.Tensor, label_format: str = "float32") -> torch.Tensor:
+    """expand compact labels to float"""
+    if label_format == "packbits":
+        return unpack_label_bits(seg).float()
+    if label_format in ("float32", "uint8"):
+        return seg.float()
+    raise ValueError(f"label format should be one of {LABEL_FORMATS}, got {label_format}")
+
+
+def get_label_format_transform(keys, label_format: str = "float32"):
+    """transforms to append to the segmentation pipeline after thresholding"""
+    if label_format == "float32":
+        return []
+    if label_format == "uint8":
+        return [CastToTypeD(keys=keys, dtype=np.uint8)]
+    if label_format == "packbits":
+        return [LambdaD(keys=keys, func=pack_label_bits)]
+    raise ValueError(f"label format should be one of {LABEL_FORMATS}, got {label_format}")
@@ -2,7 +2,12 @@ from .np_utils import *
 from .io_utils import *
 from .np_show import *
 from .misc_utils import *
+from .mask_store import *
+from .metrics_store import *
 from .callbacks import *
+from .results_index import *
+from .bootstrap import *
+from .profiling import *
 from .wandb_utils import *
 from .print_arr import *
 from .config_utils import *
@@ -0,0 +1,326 @@
+"""
+bootstrap confidence intervals, paired permutation tests and ranking stability
+over a metric table (one row per case and model, e.g. merged-metric-log.csv),
+without the challengeR round trip (results/challengeR_script.r).
+
+resamples are drawn as (block, num_cases) index or int8 sign matrices, in
+blocks of at most MAX_BLOCK_ELEMENTS entries so that memory does not grow with
+num_boot/num_perm. a block of bootstrap indices is reduced to per-case counts,
+the resample means are a single (block, num_cases) @ (num_cases, num_cols)
+product. groups (anatomies, models) are processed in parallel processes.
+"""
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "SMALL_BETTER",
+    "bootstrap_indices",
+    "bootstrap_means",
+    "bootstrap_ci",
+    "paired_permutation_test",
+    "get_case_matrix",
+    "rank_models",
+    "bootstrap_rank_stability",
+    "metric_confidence_intervals",
+    "benchmark_ranking",
+]
+
+# is a lower value better?
+SMALL_BETTER = {"DSC": False, "NSD": False, "ASD": True, "HD95": True}
+# entries of a block of resamples, (block, num_cases) counts are float64
+MAX_BLOCK_ELEMENTS = 2**22
+
+
+def bootstrap_indices(
+    num_cases: int, num_boot: int, rng: np.random.Generator
+) -> np.ndarray:
+    """(num_boot, num_cases) case indices, one resample per row"""
+    return rng.integers(0, num_cases, size=(num_boot, num_cases))
+
+
+def _block_sizes(num_total: int, num_cases: int, block_size: Optional[int]) -> Iterator[int]:
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(num_cases, 1))
+    for start in range(0, num_total, block_size):
+        yield min(block_size, num_total - start)
+
+
+def _resample_counts(indices: np.ndarray, num_cases: int) -> np.ndarray:
+    """(block, num_cases) number of times each case is drawn in each resample"""
+    num_resamples = len(indices)
+    offsets = (np.arange(num_resamples) * num_cases)[:, None]
+    counts = np.bincount((indices + offsets).ravel(), minlength=num_resamples * num_cases)
+    return counts.reshape(num_resamples, num_cases).astype(np.float64)
+
+
+def bootstrap_means(
+    values: np.ndarray,
+    num_boot: int,
+    rng: np.random.Generator,
+    block_size: Optional[int] = None,
+) -> np.ndarray:
+    """(num_boot, num_cols) mean of each column of `values` (num_cases, num_cols)
+    on every bootstrap resample of the cases, nan values are ignored.
+    `block_size` resamples are drawn at a time, the result does not depend on it"""
+    num_cases = len(values)
+    finite = np.isfinite(values)
+    filled = np.where(finite, values, 0.0)
+    finite = finite.astype(np.float64)
+    means = []
+    for size in _block_sizes(num_boot, num_cases, block_size):
+        counts = _resample_counts(bootstrap_indices(num_cases, size, rng), num_cases)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # all-nan resamples are nan
+            means.append((counts @ filled) / (counts @ finite))
+    return np.concatenate(means)
+
+
+def _nanmean(values: np.ndarray, axis: int) -> np.ndarray:
+    with warnings.catch_warnings():
+        # all-nan slices are nan
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(values, axis=axis)
+
+
+def bootstrap_ci(
+    values: np.ndarray,
+    num_boot: int = 1000,
+    alpha: float = 0.05,
+    seed=None,
+    block_size: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """mean and percentile confidence interval of each column of `values`
+    (num_cases, num_metrics), the columns share the resampled cases.
+    nan and inf values are ignored"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    values = np.where(np.isfinite(values), values, np.nan)
+    if len(values) == 0:
+        nans = np.full(values.shape[1], np.nan)
+        return nans, nans, nans
+    rng = np.random.default_rng(seed)
+    boot_means = bootstrap_means(values, num_boot, rng, block_size)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        low, high = np.nanquantile(boot_means, [alpha / 2, 1 - alpha / 2], axis=0)
+    return _nanmean(values, axis=0), low, high
+
+
+def paired_permutation_test(
+    matrix: np.ndarray,
+    small_better: bool,
+    num_perm: int = 10000,
+    seed=None,
+    block_size: Optional[int] = None,
+) -> np.ndarray:
+    """one-sided p-values of the paired sign-flip permutation test of the mean
+    difference for all model pairs: p[i, j] tests `model i is better than model j`.
+    matrix: (num_cases, num_models) without missing values"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    num_cases, num_models = matrix.shape
+    # (num_cases, num_models * num_models) differences, positive if i is better
+    diffs = (matrix[:, :, None] - matrix[:, None, :]).reshape(num_cases, -1)
+    if small_better:
+        diffs = -diffs
+    rng = np.random.default_rng(seed)
+    observed = diffs.mean(axis=0)
+    exceed = np.zeros(diffs.shape[1], dtype=np.int64)
+    for size in _block_sizes(num_perm, num_cases, block_size):
+        # drawn as uint32 (one draw per sign, independent of the block size), kept as int8
+        signs = rng.integers(0, 2, size=(size, num_cases), dtype=np.uint32).astype(np.int8)
+        signs = signs * 2 - 1
+        null = signs @ diffs / num_cases
+        # tolerance for permutations that reproduce the observed statistic
+        exceed += (null >= observed - 1e-12).sum(axis=0)
+    p_values = (exceed + 1) / (num_perm + 1)
+    p_values = p_values.reshape(num_models, num_models)
+    np.fill_diagonal(p_values, 1.0)
+    return p_values
+
+
+def get_case_matrix(
+    table: pd.DataFrame,
+    metric: str,
+    case_column: str = "subject-id",
+    model_column: str = "model",
+    na_value: Optional[float] = None,
+) -> pd.DataFrame:
+    """(cases, models) values of `metric`. cases missing (or inf) for some model
+    are dropped, or set to `na_value` (challengeR's na.treat)"""
+    matrix = table.pivot_table(
+        index=case_column, columns=model_column, values=metric, aggfunc="first", observed=True
+    )
+    matrix = matrix.replace([np.inf, -np.inf], np.nan)
+    if na_value is None:
+        return matrix.dropna()
+    return matrix.fillna(na_value)
+
+
+def _min_ranks(scores: np.ndarray, small_better: bool) -> np.ndarray:
+    """ranks along the last axis, ties get the smallest rank"""
+    if not small_better:
+        scores = -scores
+    return 1 + (scores[..., None, :] < scores[..., :, None]).sum(axis=-1)
+
+
+def rank_models(
+    matrix: pd.DataFrame,
+    small_better: bool,
+    alpha: float = 0.05,
+    num_perm: int = 10000,
+    seed=None,
+    block_size: Optional[int] = None,
+) -> pd.DataFrame:
+    """test-then-rank: a model is ranked by the number of models it is
+    significantly better than (paired permutation test at level `alpha`)"""
+    p_values = paired_permutation_test(matrix.values, small_better, num_perm, seed, block_size)
+    wins = (p_values < alpha).sum(axis=1)
+    ranking = pd.DataFrame(
+        {
+            "mean": matrix.values.mean(axis=0),
+            "significant_wins": wins,
+            "rank": _min_ranks(wins.astype(np.float64), small_better=False),
+        },
+        index=pd.Index(matrix.columns, name="model"),
+    )
+    return ranking.sort_values(["rank", "mean"], ascending=[True, small_better])
+
+
+def bootstrap_rank_stability(
+    matrix: pd.DataFrame,
+    small_better: bool,
+    num_boot: int = 1000,
+    seed=None,
+    block_size: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """rank the models by their mean on every bootstrap resample of the cases.
+    returns the rank summary per model (full data rank, median and 95% rank
+    interval, mean kendall's tau of the resample ranking to the full data ranking)
+    and the frequency of each rank per model"""
+    values = matrix.values.astype(np.float64)
+    num_models = values.shape[1]
+    rng = np.random.default_rng(seed)
+    boot_ranks = _min_ranks(bootstrap_means(values, num_boot, rng, block_size), small_better)
+    full_ranks = _min_ranks(values.mean(axis=0), small_better)
+
+    # kendall's tau (tau-a) between each resample ranking and the full data ranking
+    upper = np.triu_indices(num_models, k=1)
+    full_order = np.sign(full_ranks[:, None] - full_ranks[None, :])[upper]
+    boot_order = np.sign(boot_ranks[:, :, None] - boot_ranks[:, None, :])[:, upper[0], upper[1]]
+    kendall_tau = (boot_order * full_order).mean(axis=1) if num_models > 1 else np.ones(num_boot)
+
+    models = pd.Index(matrix.columns, name="model")
+    summary = pd.DataFrame(
+        {
+            "rank": full_ranks,
+            "median_rank": np.median(boot_ranks, axis=0),
+            "rank_low": np.quantile(boot_ranks, 0.025, axis=0),
+            "rank_high": np.quantile(boot_ranks, 0.975, axis=0),
+            "kendall_tau": kendall_tau.mean(),
+        },
+        index=models,
+    ).sort_values("rank")
+    # (num_models, num_models): fraction of resamples in which a model gets rank r
+    frequency = (boot_ranks[:, :, None] == np.arange(1, num_models + 1)).mean(axis=0)
+    frequency = pd.DataFrame(
+        frequency, index=models, columns=pd.Index(np.arange(1, num_models + 1), name="rank")
+    )
+    return summary, frequency
+
+
+def _parallel_map(func: Callable, tasks: Sequence, num_workers: int) -> List:
+    if num_workers <= 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(num_workers, len(tasks))) as executor:
+        return list(executor.map(func, *zip(*tasks)))
+
+
+def _spawn_seeds(seed, num_tasks: int) -> List[np.random.SeedSequence]:
+    """independent seeds per task, so results do not depend on `num_workers`"""
+    return np.random.SeedSequence(seed).spawn(num_tasks)
+
+
+def _group_confidence_intervals(key, values, metrics, num_boot, alpha, seed):
+    mean, low, high = bootstrap_ci(values, num_boot, alpha, seed)
+    key = key if isinstance(key, tuple) else (key,)
+    return [
+        (*key, metric, mean[i], low[i], high[i], int(np.isfinite(values[:, i]).sum()))
+        for i, metric in enumerate(metrics)
+    ]
+
+
+def metric_confidence_intervals(
+    table: pd.DataFrame,
+    metrics: Sequence[str] = ("DSC", "HD95", "ASD", "NSD"),
+    by: Sequence[str] = ("anatomy", "model"),
+    num_boot: int = 1000,
+    alpha: float = 0.05,
+    seed=None,
+    num_workers: int = 1,
+) -> pd.DataFrame:
+    """bootstrap mean and (1 - alpha) confidence interval of each metric per group,
+    one row per group and metric"""
+    metrics, by = list(metrics), list(by)
+    groups = list(table.groupby(by, observed=True))
+    seeds = _spawn_seeds(seed, len(groups))
+    tasks = [
+        (key, group[metrics].to_numpy(dtype=np.float64), metrics, num_boot, alpha, group_seed)
+        for (key, group), group_seed in zip(groups, seeds)
+    ]
+    rows = _parallel_map(_group_confidence_intervals, tasks, num_workers)
+    return pd.DataFrame(
+        [row for group_rows in rows for row in group_rows],
+        columns=by + ["metric", "mean", "ci_low", "ci_high", "num_cases"],
+    )
+
+
+def _rank_anatomy(anatomy, matrix, small_better, alpha, num_boot, num_perm, seed):
+    test_seed, boot_seed = seed.spawn(2)
+    ranking = rank_models(matrix, small_better, alpha, num_perm, test_seed)
+    summary, frequency = bootstrap_rank_stability(matrix, small_better, num_boot, boot_seed)
+    ranking = ranking.join(summary.drop(columns="rank"))
+    for df in (ranking, frequency):
+        df.insert(0, "anatomy", anatomy)
+        df["num_cases"] = len(matrix)
+    return ranking.reset_index(), frequency.reset_index()
+
+
+def benchmark_ranking(
+    table: pd.DataFrame,
+    metric: str = "DSC",
+    by: str = "anatomy",
+    alpha: float = 0.05,
+    num_boot: int = 1000,
+    num_perm: int = 10000,
+    na_value: Optional[float] = None,
+    seed=None,
+    num_workers: int = 1,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """test-then-rank ranking of the models with bootstrap rank stability per
+    anatomy (the `by` column). returns the ranking and the rank frequencies"""
+    small_better = SMALL_BETTER.get(metric, False)
+    groups = list(table.groupby(by, observed=True))
+    seeds = _spawn_seeds(seed, len(groups))
+    tasks = [
+        (
+            anatomy,
+            get_case_matrix(group, metric, na_value=na_value),
+            small_better,
+            alpha,
+            num_boot,
+            num_perm,
+            group_seed,
+        )
+        for (anatomy, group), group_seed in zip(groups, seeds)
+    ]
+    results = _parallel_map(_rank_anatomy, tasks, num_workers)
+    if not results:
+        return pd.DataFrame(), pd.DataFrame()
+    ranking = pd.concat([ranking for ranking, _ in results], ignore_index=True)
+    frequency = pd.concat([frequency for _, frequency in results], ignore_index=True)
+    return ranking.rename(columns={"anatomy": by}), frequency.rename(columns={"anatomy": by})
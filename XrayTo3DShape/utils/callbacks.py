@@ -1,9 +1,12 @@
 """custom pytorch-lightning callbacks for saving model prediction
 and evaluating metrics."""
-import copy
 import csv
+import os
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Optional, Sequence
+from typing import Any, Callable, Optional, Sequence
 
 import numpy as np
 import torch
@@ -19,7 +22,65 @@ from surface_distance.metrics import (
 )
 from typing_extensions import Literal
 
+from ..metrics import compute_surface_metrics
 from .io_utils import get_nifti_stem, to_numpy
+from .mask_store import PackedMaskWriter, is_complete_mask_store
+from .metrics_store import ParquetMetricsWriter
+
+
+def get_pir_affine(resolution: float, origin: Optional[Sequence[float]] = None) -> np.ndarray:
+    """affine of the predicted volumes: PIR orientation with isotropic voxel `resolution`"""
+    affine = np.asarray(
+        [
+            [0, 0, resolution, 0],
+            [-resolution, 0, 0, 0],
+            [0, -resolution, 0, 0],
+            [0, 0, 0, 1],
+        ],
+        dtype=np.float64,
+    )
+    if origin is not None:
+        affine[:3, 3] = origin
+    return affine
+
+
+class OrderedWorkerPool:
+    """run jobs on a bounded pool of background threads.
+    results are handed to their callback in submission order, in the calling thread.
+    `submit` blocks once `max_pending` jobs are in flight (back-pressure).
+    num_workers=0 runs every job synchronously."""
+
+    def __init__(self, num_workers: int = 0, max_pending: Optional[int] = None):
+        self.num_workers = num_workers
+        self.max_pending = max_pending if max_pending else 2 * max(num_workers, 1)
+        self.executor = (
+            ThreadPoolExecutor(max_workers=num_workers) if num_workers > 0 else None
+        )
+        self.pending: deque = deque()
+
+    def submit(self, job: Callable, *args, callback: Optional[Callable] = None):
+        if self.executor is None:
+            result = job(*args)
+            if callback is not None:
+                callback(result)
+            return
+        self.pending.append((self.executor.submit(job, *args), callback))
+        self._collect(max_pending=self.max_pending)
+
+    def _collect(self, max_pending: int):
+        """hand over finished jobs from the head of the queue,
+        wait for the head while more than `max_pending` jobs are in flight"""
+        while self.pending and (
+            self.pending[0][0].done() or len(self.pending) > max_pending
+        ):
+            future, callback = self.pending.popleft()
+            result = future.result()  # re-raises exceptions of the job
+            if callback is not None:
+                callback(result)
+
+    def flush(self):
+        """wait for all submitted jobs"""
+        self._collect(max_pending=0)
 
 
 class NiftiPredictionWriter(BasePredictionWriter):
@@ -34,9 +95,13 @@ class NiftiPredictionWriter(BasePredictionWriter):
         save_gt=True,
         image_size=64,
         resolution=1.5,
-        save_input=True
+        save_input=True,
+        num_workers=0,
+        max_pending=None,
     ) -> None:
         super().__init__(write_interval)
+        # gzip nifti writes run in the background, overlapping the next forward pass
+        self.worker_pool = OrderedWorkerPool(num_workers, max_pending)
         self.output_dir = output_dir
         self.save_pred = save_pred
         self.save_gt = save_gt
@@ -70,44 +135,162 @@ class NiftiPredictionWriter(BasePredictionWriter):
         batch_idx: int,
         dataloader_idx: int,
     ) -> None:
-        # rewrite metadict to reflect the actual shape and orientation of the volume
-        batch_size = len(prediction["seg_meta_dict"]["filename_or_obj"])
+        # new metadict with the actual shape and orientation of the volume,
+        # the meta data of the batch is not copied
         original_meta_dict = prediction["seg_meta_dict"]
-        metadict = copy.deepcopy(original_meta_dict)
-        # metadict["filename_or_obj"] = prediction["seg_meta_dict"]["filename_or_obj"]
-        metadict["spatial_shape"] = torch.from_numpy(
-            np.asarray(
-                [
-                    [self.image_size, self.image_size, self.image_size],
-                ]
-                * batch_size
+        batch_size = len(original_meta_dict["filename_or_obj"])
+        affine = np.stack([get_pir_affine(self.resolution)] * batch_size)
+        # save the origin information too, which resides in the last column of the `affine matrix`
+        affine[:, :, -1] = to_numpy(original_meta_dict["affine"][:, :, -1])
+        metadict = {
+            "filename_or_obj": original_meta_dict["filename_or_obj"],
+            "original_affine": original_meta_dict["original_affine"],
+            "affine": torch.from_numpy(affine),
+            "spatial_shape": torch.tensor(
+                [[self.image_size] * 3] * batch_size, dtype=torch.int64
+            ),
+            "space": ["PIL"] * batch_size,
+        }
+        self.worker_pool.submit(
+            self.save_batch, prediction["pred"], prediction["gt"], metadict
+        )
+
+    def save_batch(self, pred, gt, metadict):
+        """write prediction and groundtruth volumes"""
+        if self.save_pred:
+            self.pred_nifti_saver.save_batch(pred, metadict)
+        if self.save_gt:
+            self.gt_nifti_saver.save_batch(gt, metadict)
+
+    def on_predict_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule"):
+        self.worker_pool.flush()
+
+
+class PackedPredictionWriter(BasePredictionWriter):
+    """Save model prediction as bit-packed mask stores (see `mask_store`)
+    instead of one int16 nifti per volume.
+    predictions go to `<output_dir>/pred_masks`, groundtruth to `gt_store_dir`
+    (defaults to `<output_dir>/gt_masks`). a complete groundtruth store is not
+    rewritten, so models evaluated on the same test set, also concurrently, share it."""
+
+    def __init__(
+        self,
+        output_dir,
+        write_interval: Literal["batch", "epoch", "batch_and_epoch"] = "batch",
+        save_pred=True,
+        save_gt=True,
+        gt_store_dir=None,
+        image_size=64,
+        resolution=1.5,
+        chunk_size=256,
+        source=None,
+        num_workers=0,
+        max_pending=None,
+    ) -> None:
+        super().__init__(write_interval)
+        self.worker_pool = OrderedWorkerPool(num_workers, max_pending)
+        self.image_size = image_size
+        self.resolution = resolution
+        affine = get_pir_affine(resolution)
+        self.pred_store = (
+            PackedMaskWriter(
+                Path(output_dir) / "pred_masks", affine, "pred", chunk_size, source
             )
+            if save_pred
+            else None
         )
-        metadict["space"] = [
-            "PIL",
-        ] * batch_size
-        metadict["affine"] = torch.from_numpy(
-            np.asarray(
-                [
-                    [
-                        [0, 0, self.resolution, 0],
-                        [-self.resolution, 0, 0, 0],
-                        [0, -self.resolution, 0, 0],
-                        [0, 0, 0, 1],
-                    ],
-                ]
-                * batch_size
+        gt_store_dir = gt_store_dir if gt_store_dir else Path(output_dir) / "gt_masks"
+        if save_gt and is_complete_mask_store(gt_store_dir):
+            print(f"groundtruth masks already stored in {gt_store_dir}")
+            save_gt = False
+        self.gt_store = (
+            PackedMaskWriter(
+                gt_store_dir, affine, "gt", chunk_size, source, keep_existing=True
             )
+            if save_gt
+            else None
         )
-        # save the origin information too, which resides in the last column of the `affine matrix`
 
-        metadict["affine"][:, :, -1] = torch.tensor(
-            original_meta_dict["affine"][:, :, -1]
-        )
-        if self.save_pred:
-            self.pred_nifti_saver.save_batch(prediction["pred"], metadict)
-        if self.save_gt:
-            self.gt_nifti_saver.save_batch(prediction["gt"], metadict)
+    def write_on_batch_end(
+        self,
+        trainer: "pl.Trainer",
+        pl_module: "pl.LightningModule",
+        prediction: Any,
+        batch_indices: Optional[Sequence[int]],
+        batch: Any,
+        batch_idx: int,
+        dataloader_idx: int,
+    ) -> None:
+        meta_dict = prediction["seg_meta_dict"]
+        for store, key in ((self.pred_store, "pred"), (self.gt_store, "gt")):
+            if store is None:
+                continue
+            self.worker_pool.submit(
+                self.pack_batch,
+                prediction[key],
+                meta_dict,
+                callback=lambda packed, store=store: store.append(**packed),
+            )
+            # chunk files are written by the same background workers
+            for index, chunk in store.pop_chunks():
+                self.worker_pool.submit(store.write_chunk, index, chunk)
+
+    @staticmethod
+    def pack_batch(masks, meta_dict):
+        masks = to_numpy(masks)
+        return {
+            "bits": PackedMaskWriter.pack(masks),
+            "filenames": list(meta_dict["filename_or_obj"]),
+            # the rest of the affine is the PIR affine stored once per store
+            "origins": to_numpy(meta_dict["affine"][:, :3, -1]),
+            "original_affines": to_numpy(meta_dict["original_affine"]),
+            "shape": masks.shape[-3:],
+        }
+
+    def on_predict_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule"):
+        self.worker_pool.flush()
+        for store in (self.pred_store, self.gt_store):
+            if store is not None:
+                store.close()
+
+
+METRIC_LOG_FILENAME = "metric-log.csv"
+METRIC_LOG_HEADER = ["subject-id", "DSC", "ASD", "HD95", "NSD", "checkpoint"]
+# logs written before the checkpoint column was added
+LEGACY_METRIC_LOG_HEADER = METRIC_LOG_HEADER[:-1]
+
+
+def read_metric_log(log_path, checkpoint_hash: Optional[str] = ""):
+    """well-formed rows of a metric log written by `MetricsLogger`.
+    with a `checkpoint_hash`, only rows of that checkpoint are returned
+    (None: rows of any checkpoint, "": rows of an unknown checkpoint).
+    rows of logs without the checkpoint column are of an unknown checkpoint"""
+    log_path = Path(log_path)
+    if not log_path.exists():
+        return []
+    with open(log_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header not in (METRIC_LOG_HEADER, LEGACY_METRIC_LOG_HEADER):
+            return []
+        rows = []
+        for row in reader:
+            if len(row) != len(header) or not row[0]:
+                continue
+            if header == LEGACY_METRIC_LOG_HEADER:
+                row = row + [""]
+            try:
+                [float(value) for value in row[1:-1]]
+            except ValueError:
+                continue
+            if checkpoint_hash is None or row[-1] == checkpoint_hash:
+                rows.append(row)
+    return rows
+
+
+def get_scored_subjects(log_path, checkpoint_hash: Optional[str] = "") -> set:
+    """subject-ids already in the metric log"""
+    return {row[0] for row in read_metric_log(log_path, checkpoint_hash)}
 
 
 class MetricsLogger(BasePredictionWriter):
@@ -120,14 +303,51 @@ class MetricsLogger(BasePredictionWriter):
         voxel_spacing,
         nsd_tolerance=1.5,
         write_interval: Literal["batch", "epoch", "batch_and_epoch"] = "batch",
+        metrics_backend: Literal["torch", "monai"] = "torch",
+        num_workers=0,
+        max_pending=None,
+        checkpoint_hash=None,
+        resume=False,
+        columnar_writer: Optional[ParquetMetricsWriter] = None,
     ) -> None:
         super().__init__(write_interval)
+        if metrics_backend not in ("torch", "monai"):
+            raise ValueError(
+                f"metrics_backend can be either `torch` or `monai`, got {metrics_backend}"
+            )
+        self.metrics_backend = metrics_backend
+        self.voxel_spacing = voxel_spacing
+        self.nsd_tolerance = nsd_tolerance
+        self.checkpoint_hash = checkpoint_hash if checkpoint_hash else ""
         Path(output_dir).mkdir(exist_ok=True, parents=True)
-        self.filestream_writer = csv.writer(
-            open(Path(output_dir) / "metric-log.csv", "w")
-        )
-        header = ["subject-id", "DSC", "ASD", "HD95", "NSD"]
-        self.filestream_writer.writerow(header)
+        log_path = Path(output_dir) / METRIC_LOG_FILENAME
+        # with `resume`, rows of the same checkpoint are kept and their subjects skipped
+        rows = []
+        if resume:
+            logged_rows = read_metric_log(log_path, checkpoint_hash=None)
+            rows = [row for row in logged_rows if row[-1] == self.checkpoint_hash]
+            if len(rows) < len(logged_rows):
+                warnings.warn(
+                    f"{log_path}: {len(logged_rows) - len(rows)} rows of another "
+                    "or an unknown checkpoint are not resumed, their subjects are scored again"
+                )
+        self.scored_subjects = {row[0] for row in rows}
+        # the kept rows are rewritten, dropping malformed rows e.g. the partial
+        # last line of a crashed run and rows of another checkpoint.
+        # replace the log in one step so that a crash here does not lose them
+        tmp_path = log_path.with_suffix(".csv.tmp")
+        with open(tmp_path, "w", newline="") as f:
+            csv.writer(f).writerows([METRIC_LOG_HEADER, *rows])
+        os.replace(tmp_path, log_path)
+        # new rows are appended
+        self.filestream = open(log_path, "a", newline="")
+        self.filestream_writer = csv.writer(self.filestream)
+        # optional full precision copy of the log in parquet
+        self.columnar_writer = columnar_writer
+        if self.columnar_writer is not None:
+            self.columnar_writer.open(self.checkpoint_hash, rows if resume else None)
+        # metrics are computed in the background, rows are written in batch order
+        self.worker_pool = OrderedWorkerPool(num_workers, max_pending)
         # metric
         self.DSC = DiceMetric()
         self.ASD = SurfaceDistanceMetric()
@@ -142,6 +362,26 @@ class MetricsLogger(BasePredictionWriter):
             nsd_tolerance,
         )[0]
 
+    def compute_metrics(self, pred, gt):
+        """DSC, ASD, HD95, NSD lists for a batch of predictions.
+        the torch backend shares surfaces and distance maps between the metrics
+        and runs on the device of the predictions"""
+        if self.metrics_backend == "torch":
+            metrics = compute_surface_metrics(
+                pred,
+                gt,
+                voxel_spacing=self.voxel_spacing,
+                nsd_tolerance=self.nsd_tolerance,
+            )
+            return [metrics[key].tolist() for key in ("DSC", "ASD", "HD95", "NSD")]
+        # predictions are carried as uint8, monai metrics expect float masks
+        pred, gt = pred.float(), gt.float()
+        dsc = to_numpy(self.DSC(pred, gt)).flatten().tolist()
+        asd = to_numpy(self.ASD(pred, gt)).flatten().tolist()
+        hd95 = to_numpy(self.HD95(pred, gt)).flatten().tolist()
+        nsd = [self.NSD(p, g) for p, g in zip(pred, gt)]
+        return dsc, asd, hd95, nsd
+
     def get_filename(self, prediction: Any):
         """this will be column name identifier for each row"""
         return [
@@ -161,11 +401,24 @@ class MetricsLogger(BasePredictionWriter):
         pred = prediction["pred"]
         gt = prediction["gt"]
         subjects = self.get_filename(prediction)
-        dsc = to_numpy(self.DSC(pred, gt)).flatten().tolist()
-        asd = to_numpy(self.ASD(pred, gt)).flatten().tolist()
-        hd95 = to_numpy(self.HD95(pred, gt)).flatten().tolist()
-        nsd = [self.NSD(p, g) for p, g in zip(pred, gt)]
+        if self.scored_subjects.issuperset(subjects):
+            return
+        self.worker_pool.submit(
+            self.compute_metrics,
+            pred,
+            gt,
+            callback=lambda metrics: self.write_rows(subjects, metrics),
+        )
+
+    def write_rows(self, subjects, metrics):
+        """one row per subject, subjects scored by a previous run are not repeated"""
+        dsc, asd, hd95, nsd = metrics
         for row in zip(subjects, dsc, asd, hd95, nsd):
+            if row[0] in self.scored_subjects:
+                continue
+            self.scored_subjects.add(row[0])
+            if self.columnar_writer is not None:
+                self.columnar_writer.add_row(row[0], row[1:])
             self.filestream_writer.writerow(
                 [
                     f"{item:.2f}"
@@ -173,7 +426,18 @@ class MetricsLogger(BasePredictionWriter):
                     else item
                     for item in row
                 ]
+                + [self.checkpoint_hash]
             )
+        # rows on disk survive a crash and are skipped on resume
+        self.filestream.flush()
+        if self.columnar_writer is not None:
+            self.columnar_writer.flush()
+
+    def on_predict_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule"):
+        self.worker_pool.flush()
+        self.filestream.flush()
+        if self.columnar_writer is not None:
+            self.columnar_writer.compact()
 
 
 class AnglePerturbationMetricsLogger(MetricsLogger):
@@ -185,8 +449,25 @@ class AnglePerturbationMetricsLogger(MetricsLogger):
         voxel_spacing,
         nsd_tolerance=1.5,
         write_interval: Literal["batch", "epoch", "batch_and_epoch"] = "batch",
+        metrics_backend: Literal["torch", "monai"] = "torch",
+        num_workers=0,
+        max_pending=None,
+        checkpoint_hash=None,
+        resume=False,
+        columnar_writer: Optional[ParquetMetricsWriter] = None,
     ) -> None:
-        super().__init__(output_dir, voxel_spacing, nsd_tolerance, write_interval)
+        super().__init__(
+            output_dir,
+            voxel_spacing,
+            nsd_tolerance,
+            write_interval,
+            metrics_backend,
+            num_workers,
+            max_pending,
+            checkpoint_hash,
+            resume,
+            columnar_writer,
+        )
 
     def write_on_batch_end(
         self,
@@ -198,21 +479,14 @@ class AnglePerturbationMetricsLogger(MetricsLogger):
         batch_idx: int,
         dataloader_idx: int,
     ) -> None:
-        pred = prediction["pred"]
-        gt = prediction["gt"]
         print(prediction["seg_meta_dict"]["original_affine"])
         print(prediction["seg_meta_dict"]["filename_or_obj"])
-        subjects = self.get_filename(prediction)
-        dsc = to_numpy(self.DSC(pred, gt)).flatten().tolist()
-        asd = to_numpy(self.ASD(pred, gt)).flatten().tolist()
-        hd95 = to_numpy(self.HD95(pred, gt)).flatten().tolist()
-        nsd = [self.NSD(p, g) for p, g in zip(pred, gt)]
-        for row in zip(subjects, dsc, asd, hd95, nsd):
-            self.filestream_writer.writerow(
-                [
-                    f"{item:.2f}"
-                    if isinstance(item, (np.ndarray, np.float64, float))
-                    else item
-                    for item in row
-                ]
-            )
+        super().write_on_batch_end(
+            trainer,
+            pl_module,
+            prediction,
+            batch_indices,
+            batch,
+            batch_idx,
+            dataloader_idx,
+        )
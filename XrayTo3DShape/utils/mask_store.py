@@ -0,0 +1,265 @@
+"""
+compact storage of binary prediction/groundtruth masks.
+masks are packed into bits along the last axis (same layout as the `packbits`
+label format) and written in chunks of many subjects. the PIR affine of the
+predictions is stored once, only the origin varies between subjects.
+
+store layout:
+    store.json        : mask shape, base affine, postfix, number of samples, chunk files.
+                        written last, a store without it is incomplete
+    chunk-00000.npz   : bits (N,D,H,W/8) uint8, filename_or_obj (N,),
+                        origin (N,3) and original_affine (N,4,4)
+
+`export_nifti` writes the same `<subject>_<postfix>.nii.gz` files as `NiftiPredictionWriter`
+for scripts that read nifti e.g. the morphometry pipelines.
+"""
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from monai.data.nifti_saver import NiftiSaver
+
+from .io_utils import get_nifti_stem
+
+__all__ = [
+    "MASK_STORE_INFO_FILENAME",
+    "PackedMaskWriter",
+    "PackedMaskStore",
+    "is_complete_mask_store",
+    "get_gt_store_dir",
+    "export_nifti",
+]
+
+MASK_STORE_INFO_FILENAME = "store.json"
+
+
+def _chunk_filename(index: int) -> str:
+    return f"chunk-{index:05d}.npz"
+
+
+def is_complete_mask_store(store_dir: Union[str, Path]) -> bool:
+    """was the store at `store_dir` written to the end"""
+    return (Path(store_dir) / MASK_STORE_INFO_FILENAME).exists()
+
+
+def get_gt_store_dir(
+    gt_store_dir: Union[str, Path], testpaths: str, image_size: int, resolution: float
+) -> Path:
+    """groundtruth masks depend only on the test set and the voxel grid,
+    all models evaluated on the same grid share one store"""
+    return Path(gt_store_dir) / f"{Path(testpaths).stem}_size-{image_size}_res-{resolution}"
+
+
+class PackedMaskWriter:
+    """append binary masks to a store, `close` finalises it.
+    packing and chunk writes are separate steps so that the caller can run
+    them on background threads: `append` collects packed masks, `pop_chunks`
+    hands over full chunks in order and `write_chunk` is safe to call concurrently.
+    the store is written to a hidden temporary directory next to `store_dir` and
+    moved into place by `close`, so evaluations reading or writing the same store
+    never see a partial store.
+
+    Args:
+        store_dir (Union[str, Path]): an existing store is replaced, unless `keep_existing`
+        affine (np.ndarray): 4x4 affine shared by all masks, the origin is stored per mask
+        postfix (str, optional): `pred` or `gt`, used for the exported nifti filenames
+        chunk_size (int, optional): masks per chunk file. Defaults to 256.
+        source (Optional[Dict], optional): recorded in store.json e.g. the test set
+        keep_existing (bool, optional): keep a complete store written in the meantime,
+            e.g. the groundtruth store shared by concurrent evaluations. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        store_dir: Union[str, Path],
+        affine: np.ndarray,
+        postfix: str = "pred",
+        chunk_size: int = 256,
+        source: Optional[Dict] = None,
+        keep_existing: bool = False,
+    ) -> None:
+        self.store_dir = Path(store_dir)
+        self.store_dir.parent.mkdir(exist_ok=True, parents=True)
+        self.tmp_dir = Path(
+            tempfile.mkdtemp(prefix=f".{self.store_dir.name}-", dir=self.store_dir.parent)
+        )
+        self.keep_existing = keep_existing
+        self.affine = np.asarray(affine, dtype=np.float64)
+        self.postfix = postfix
+        self.chunk_size = chunk_size
+        self.source = source if source else {}
+        self.shape: Optional[List[int]] = None
+        self.buffer: Dict[str, list] = {
+            "bits": [],
+            "filename_or_obj": [],
+            "origin": [],
+            "original_affine": [],
+        }
+        self.num_chunks = 0
+        self.num_samples = 0
+
+    @staticmethod
+    def pack(masks: np.ndarray) -> np.ndarray:
+        """(N,1,D,H,W) or (N,D,H,W) binary masks -> (N,D,H,W/8) uint8 bits"""
+        masks = np.asarray(masks)
+        if masks.ndim == 5:
+            masks = masks[:, 0]
+        return np.packbits(masks > 0, axis=-1)
+
+    def append(
+        self,
+        bits: np.ndarray,
+        filenames: Sequence[str],
+        origins: np.ndarray,
+        original_affines: np.ndarray,
+        shape: Sequence[int],
+    ):
+        """add a batch of packed masks of the (D,H,W) `shape`"""
+        if self.shape is None:
+            self.shape = [int(s) for s in shape]
+        elif list(shape) != self.shape:
+            raise ValueError(f"expected masks of shape {self.shape}, got {list(shape)}")
+        self.buffer["bits"].extend(bits)
+        self.buffer["filename_or_obj"].extend(str(f) for f in filenames)
+        self.buffer["origin"].extend(np.asarray(origins, dtype=np.float64))
+        self.buffer["original_affine"].extend(np.asarray(original_affines, dtype=np.float64))
+        self.num_samples += len(filenames)
+
+    def pop_chunks(self, final: bool = False) -> List[Tuple[int, Dict[str, np.ndarray]]]:
+        """full chunks in the buffer and their indices, with `final` also the remainder"""
+        chunks = []
+        while len(self.buffer["bits"]) >= self.chunk_size or (
+            final and self.buffer["bits"]
+        ):
+            chunk = {}
+            for key, values in self.buffer.items():
+                chunk[key] = np.stack(values[: self.chunk_size])
+                del values[: self.chunk_size]
+            chunks.append((self.num_chunks, chunk))
+            self.num_chunks += 1
+        return chunks
+
+    def write_chunk(self, index: int, chunk: Dict[str, np.ndarray]):
+        # packed bits of smooth masks still compress well
+        np.savez_compressed(self.tmp_dir / _chunk_filename(index), **chunk)
+
+    def close(self):
+        """write the remaining masks and the store info, then move the store into place"""
+        for index, chunk in self.pop_chunks(final=True):
+            self.write_chunk(index, chunk)
+        store_info = {
+            "num_samples": self.num_samples,
+            "shape": self.shape,
+            "affine": self.affine.tolist(),
+            "postfix": self.postfix,
+            "chunks": [_chunk_filename(index) for index in range(self.num_chunks)],
+            "source": self.source,
+        }
+        with open(self.tmp_dir / MASK_STORE_INFO_FILENAME, "w") as f:
+            json.dump(store_info, f, indent=4)
+        if self.keep_existing and is_complete_mask_store(self.store_dir):
+            shutil.rmtree(self.tmp_dir)
+            return
+        # a directory is only replaced by a rename if the target does not exist
+        old_dir = self.store_dir.with_name(f".{self.store_dir.name}-old-{uuid.uuid4().hex}")
+        if self.store_dir.exists():
+            os.replace(self.store_dir, old_dir)
+        try:
+            os.replace(self.tmp_dir, self.store_dir)
+        except OSError:
+            # another writer moved its store into place first
+            if not (self.keep_existing and is_complete_mask_store(self.store_dir)):
+                raise
+            shutil.rmtree(self.tmp_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class PackedMaskStore:
+    """read masks of a store written by `PackedMaskWriter`, subjects are
+    addressed by the nifti stem of their filename as in the metric logs"""
+
+    def __init__(self, store_dir: Union[str, Path]) -> None:
+        self.store_dir = Path(store_dir)
+        if not is_complete_mask_store(self.store_dir):
+            raise ValueError(f"{self.store_dir} is not a complete mask store")
+        with open(self.store_dir / MASK_STORE_INFO_FILENAME) as f:
+            self.store_info = json.load(f)
+        self.shape = self.store_info["shape"]
+        self.affine = np.asarray(self.store_info["affine"])
+        self.postfix = self.store_info["postfix"]
+        # subject -> (chunk index, row), only the filenames of each chunk are read
+        self.index: Dict[str, Tuple[int, int]] = {}
+        for chunk_index, chunk_file in enumerate(self.store_info["chunks"]):
+            with np.load(self.store_dir / chunk_file) as chunk:
+                for row, filename in enumerate(chunk["filename_or_obj"]):
+                    self.index[get_nifti_stem(str(filename))] = (chunk_index, row)
+
+    def __len__(self) -> int:
+        return self.store_info["num_samples"]
+
+    @property
+    def subjects(self) -> List[str]:
+        return list(self.index)
+
+    def _unpack(self, chunk, row: int) -> Dict:
+        affine = self.affine.copy()
+        affine[:3, 3] = chunk["origin"][row]
+        return {
+            "mask": np.unpackbits(chunk["bits"][row], axis=-1, count=self.shape[-1]),
+            "affine": affine,
+            "original_affine": chunk["original_affine"][row],
+            "filename_or_obj": str(chunk["filename_or_obj"][row]),
+        }
+
+    def read(self, subject: str) -> Dict:
+        """(D,H,W) uint8 mask, its affine, original_affine and filename"""
+        chunk_index, row = self.index[subject]
+        with np.load(self.store_dir / self.store_info["chunks"][chunk_index]) as chunk:
+            return self._unpack(chunk, row)
+
+    def __iter__(self) -> Iterator[Dict]:
+        """all masks in write order, one chunk in memory at a time"""
+        for chunk_file in self.store_info["chunks"]:
+            with np.load(self.store_dir / chunk_file) as chunk:
+                chunk = {key: chunk[key] for key in chunk.files}
+            for row in range(len(chunk["bits"])):
+                yield self._unpack(chunk, row)
+
+
+def export_nifti(
+    store_dir: Union[str, Path],
+    output_dir: Union[str, Path],
+    subjects: Optional[Sequence[str]] = None,
+    dtype=np.int16,
+) -> int:
+    """write masks of the store as `<subject>_<postfix>.nii.gz`, the same
+    files `NiftiPredictionWriter` writes. returns the number of exported masks"""
+    store = PackedMaskStore(store_dir)
+    saver = NiftiSaver(
+        output_dir=str(output_dir),
+        output_postfix=store.postfix,
+        resample=False,
+        dtype=dtype,
+        separate_folder=False,
+    )
+    records = (
+        (store.read(subject) for subject in subjects) if subjects is not None else iter(store)
+    )
+    num_exported = 0
+    for record in records:
+        saver.save(
+            record["mask"][None],
+            {
+                "filename_or_obj": record["filename_or_obj"],
+                "affine": record["affine"],
+                "original_affine": record["original_affine"],
+                "spatial_shape": np.asarray(store.shape),
+            },
+        )
+        num_exported += 1
+    return num_exported
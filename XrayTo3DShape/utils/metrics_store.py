@@ -0,0 +1,218 @@
+"""
+typed, full precision metric logs in parquet, partitioned by anatomy, model and tag
+(hive layout) so that readers only open the partitions and columns they need.
+
+    <root>/anatomy=femur/model=UNet/tag=model-compare/<run-id>-<subdir>-00000.parquet
+
+columns: subject-id, DSC, ASD, HD95, NSD (float64), checkpoint, run_id, subdir.
+a part is written whenever the csv log is flushed, the parts of an evaluation
+are compacted into one when it ends. requires pyarrow, the csv metric log is
+written regardless.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+from monai.utils import optional_import
+
+pa, has_pyarrow = optional_import("pyarrow")
+pq, _ = optional_import("pyarrow.parquet")
+pads, _ = optional_import("pyarrow.dataset")
+
+__all__ = [
+    "has_pyarrow",
+    "ParquetMetricsWriter",
+    "get_run_tag",
+    "get_parquet_metrics_writer",
+    "read_metrics_table",
+]
+
+METRIC_FIELDS = ("DSC", "ASD", "HD95", "NSD")
+
+
+def get_run_tag(run_dir: Union[str, Path], default: str = "untagged") -> str:
+    """first `--tags` tag of the run, from the run-info.json written by train.py.
+    train.py tags runs with model name, anatomy and loss before the `--tags` tags"""
+    run_info_path = Path(run_dir) / "run-info.json"
+    if run_info_path.exists():
+        with open(run_info_path) as f:
+            tags = json.load(f)["tags"]
+        if len(tags) > 3:
+            return tags[3]
+    return default
+
+
+class ParquetMetricsWriter:
+    """collect metric rows of one evaluation and write them as parquet parts of
+    at most `rows_per_part` rows. flush with the csv log so that a resumed
+    evaluation finds every scored subject at full precision
+
+    Args:
+        root_dir (Union[str, Path]): root of the partitioned dataset
+        anatomy, model, tag (str): partition of the rows
+        run_id (str): training run the checkpoint belongs to
+        subdir (str): evaluation of the run e.g. `evaluation`, `domain_shift_x`
+        rows_per_part (int, optional): Defaults to 1024.
+    """
+
+    def __init__(
+        self,
+        root_dir: Union[str, Path],
+        anatomy: str,
+        model: str,
+        tag: str,
+        run_id: str,
+        subdir: str = "evaluation",
+        rows_per_part: int = 1024,
+    ) -> None:
+        if not has_pyarrow:
+            raise ImportError("parquet metric logs require pyarrow")
+        self.partition_dir = (
+            Path(root_dir) / f"anatomy={anatomy}" / f"model={model}" / f"tag={tag}"
+        )
+        self.partition_dir.mkdir(exist_ok=True, parents=True)
+        self.run_id = run_id
+        self.subdir = subdir
+        self.prefix = f"{run_id}-{subdir.replace('/', '_')}-"
+        self.rows_per_part = rows_per_part
+        self.rows: List[Dict] = []
+        self.num_parts = 0
+        self.checkpoint_hash = ""
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.partition_dir.glob(f"{self.prefix}*.parquet"))
+
+    def _part_path(self, number: int) -> Path:
+        return self.partition_dir / f"{self.prefix}{number:05d}.parquet"
+
+    def _next_part_number(self) -> int:
+        parts = self._parts()
+        return int(parts[-1].stem[len(self.prefix) :]) + 1 if parts else 0
+
+    def _read_parts(self, columns: Optional[Sequence[str]] = None):
+        return pads.dataset([str(p) for p in self._parts()], format="parquet").to_table(
+            columns=list(columns) if columns else None
+        )
+
+    def open(
+        self, checkpoint_hash: str, resume_rows: Optional[Sequence[Sequence[str]]] = None
+    ):
+        """start a fresh log, or with `resume_rows` (the rows kept from the csv log)
+        keep the parts of the same checkpoint and add rows that never reached a part"""
+        self.checkpoint_hash = checkpoint_hash
+        stored_subjects = set()
+        if resume_rows is not None and self._parts():
+            stored = self._read_parts(["subject-id", "checkpoint"]).to_pandas()
+            if stored["subject-id"].duplicated().any():
+                # a compaction was interrupted after writing the compacted (last) part
+                for part in self._parts()[:-1]:
+                    part.unlink()
+                stored = self._read_parts(["subject-id", "checkpoint"]).to_pandas()
+            # the csv log decides which subjects are scored, parts with other rows are stale
+            if set(stored["checkpoint"]) == {checkpoint_hash} and set(
+                stored["subject-id"]
+            ).issubset(row[0] for row in resume_rows):
+                stored_subjects = set(stored["subject-id"])
+        if not stored_subjects:
+            for part in self._parts():
+                part.unlink()
+        self.num_parts = self._next_part_number()
+        # rows of the csv log are rounded, used only for subjects missing in the parts
+        for row in resume_rows if resume_rows is not None else []:
+            if row[0] not in stored_subjects:
+                self.add_row(row[0], row[1 : 1 + len(METRIC_FIELDS)])
+
+    def add_row(self, subject: str, metrics: Sequence[float]):
+        self.rows.append(
+            {
+                "subject-id": subject,
+                **{key: float(value) for key, value in zip(METRIC_FIELDS, metrics)},
+                "checkpoint": self.checkpoint_hash,
+                "run_id": self.run_id,
+                "subdir": self.subdir,
+            }
+        )
+        if len(self.rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        """write the collected rows as a new part"""
+        if not self.rows:
+            return
+        schema = pa.schema(
+            [("subject-id", pa.string())]
+            + [(key, pa.float64()) for key in METRIC_FIELDS]
+            + [("checkpoint", pa.string()), ("run_id", pa.string()), ("subdir", pa.string())]
+        )
+        table = pa.Table.from_pylist(self.rows, schema=schema)
+        pq.write_table(table, self._part_path(self.num_parts))
+        self.num_parts += 1
+        self.rows = []
+
+    def compact(self):
+        """merge the parts of the evaluation into a single part. the merged part
+        is written (as the last part) before the others are removed"""
+        self.flush()
+        parts = self._parts()
+        if len(parts) <= 1:
+            return
+        path = self._part_path(self.num_parts)
+        tmp_path = path.with_suffix(".tmp")
+        pq.write_table(self._read_parts(), tmp_path)
+        os.replace(tmp_path, path)
+        self.num_parts += 1
+        for part in parts:
+            part.unlink()
+
+
+def get_parquet_metrics_writer(
+    root_dir: Union[str, Path],
+    ckpt_path: Union[str, Path],
+    output_dir: Union[str, Path],
+    anatomy: str,
+    model: str,
+    tag: Optional[str] = None,
+) -> ParquetMetricsWriter:
+    """writer for the evaluation of a checkpoint at `runs/<project>/<run-id>/checkpoints/*.ckpt`
+    into `output_dir`, the subdir is the output directory relative to the run directory"""
+    run_dir = Path(ckpt_path).resolve().parent.parent
+    try:
+        subdir = Path(output_dir).resolve().relative_to(run_dir).as_posix()
+    except ValueError:
+        subdir = Path(output_dir).name
+    return ParquetMetricsWriter(
+        root_dir,
+        anatomy=anatomy,
+        model=model,
+        tag=tag if tag else get_run_tag(run_dir),
+        run_id=run_dir.name,
+        subdir=subdir,
+    )
+
+
+def _partition_filter(filters: Dict[str, Union[str, Sequence[str]]]):
+    expression = None
+    for key, value in filters.items():
+        values = [value] if isinstance(value, str) else list(value)
+        condition = pads.field(key).isin(values)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_metrics_table(
+    root_dir: Union[str, Path],
+    columns: Optional[Sequence[str]] = None,
+    filters: Optional[Dict[str, Union[str, Sequence[str]]]] = None,
+) -> pd.DataFrame:
+    """read the selected columns of the rows matching `filters`, e.g.
+        read_metrics_table("results/metrics", ["model", "DSC"], {"anatomy": "femur", "tag": "model-compare"})
+    filters on anatomy/model/tag skip whole partitions, other columns are
+    filtered while reading the row groups"""
+    dataset = pads.dataset(str(root_dir), format="parquet", partitioning="hive")
+    table = dataset.to_table(
+        columns=list(columns) if columns else None,
+        filter=_partition_filter(filters) if filters else None,
+    )
+    return table.to_pandas()
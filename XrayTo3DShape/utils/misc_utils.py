@@ -1,9 +1,14 @@
 """utils that do not belong anywhere else or do not require separate module yet"""
+import hashlib
 import re
+import sys
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple, Union
 import wandb
 
+# fp32, bfloat16 autocast, float16 autocast with dynamic loss scaling
+PRECISION_MODES = ("32", "bf16-mixed", "16-mixed")
+
 
 def split_subject_vertebra_id(filepath) -> Tuple[str, str]:
     """
@@ -28,6 +33,52 @@ def split_subject_vertebra_id(filepath) -> Tuple[str, str]:
     return subject_id, vertebra_id
 
 
+def get_trainer_precision(precision: Union[str, int]) -> Union[str, int]:
+    """map precision mode to the value understood by `pl.Trainer(precision=...)`.
+    lightning enables a GradScaler for 16-bit mixed precision."""
+    precision = str(precision)
+    trainer_precision = {
+        "32": 32,
+        "bf16-mixed": "bf16",
+        "bf16": "bf16",
+        "16-mixed": 16,
+        "16": 16,
+    }
+    if precision not in trainer_precision:
+        raise ValueError(f"precision should be one of {PRECISION_MODES}, got {precision}")
+    return trainer_precision[precision]
+
+
+def get_checkpoint_hash(
+    ckpt_path: Union[str, Path],
+    chunk_size: int = 2**24,
+    autoencoder_path: Optional[Union[str, Path]] = None,
+) -> str:
+    """content hash of a checkpoint file, identifies the weights a metric log was computed with.
+    the TLPredictor decodes with the weights of `autoencoder_path`, which are hashed as well"""
+    md5 = hashlib.md5()
+    for path in [ckpt_path, autoencoder_path] if autoencoder_path else [ckpt_path]:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_peak_rss_megabytes():
+    """peak resident memory of this process and of its terminated children (dataloader workers),
+    nan where the `resource` module is not available e.g. windows"""
+    try:
+        import resource
+    except ImportError:
+        return {"main": float("nan"), "workers": float("nan")}
+    # linux reports kilobytes, macos bytes
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
 def get_anatomy_from_path(path: str):
     """used to infer dataset anatomy from filepath
     for example
@@ -0,0 +1,233 @@
+"""
+opt-in per-stage profiling of the training step (data wait, input, forward,
+loss, metrics, logging syncs, backward): wall time, device time and memory
+high-water mark of every stage.
+
+device time is measured with cuda events that are resolved after the step
+has finished on the device, so profiling does not add synchronizations
+(unless `synchronize` is set to get wall times that include the device work).
+exported as a chrome trace (chrome://tracing or https://ui.perfetto.dev),
+the raw stage records and a summary table per stage.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+import torch
+
+__all__ = ["StageProfiler", "PROFILE_SUMMARY_SUFFIX"]
+
+PROFILE_SUMMARY_SUFFIX = "-stage-summary.csv"
+
+
+class StageProfiler:
+    """record the stages of the profiled training steps.
+
+    Args:
+        name (str, optional): prefix of the exported files e.g. the architecture. Defaults to "train".
+        skip_first (int, optional): warm-up steps (cudnn autotuning, compilation) that are not profiled. Defaults to 5.
+        num_steps (Optional[int], optional): number of steps to profile, all remaining steps if None.
+        record_device_time (bool, optional): cuda event timing of each stage. Defaults to True.
+        record_memory (bool, optional): peak allocated cuda memory of each stage. Defaults to True.
+        synchronize (bool, optional): synchronize the device around each stage. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        name: str = "train",
+        skip_first: int = 5,
+        num_steps: Optional[int] = None,
+        record_device_time: bool = True,
+        record_memory: bool = True,
+        synchronize: bool = False,
+    ) -> None:
+        self.name = name
+        self.skip_first = skip_first
+        self.num_steps = num_steps
+        self.record_device_time = record_device_time
+        self.record_memory = record_memory
+        self.synchronize = synchronize
+        self.device = torch.device("cpu")
+        self.records: List[Dict] = []
+        # records waiting for their cuda events to complete
+        self._pending: List[Tuple[Dict, Tuple[torch.cuda.Event, torch.cuda.Event]]] = []
+        self.step = -1
+        self.active = False
+        self.step_peak_memory = 0.0
+        self._origin = time.perf_counter()
+        self._step_start = 0.0
+        self._last_step_end: Optional[float] = None
+
+    def start_step(self, device: Optional[torch.device] = None, measure_data_wait: bool = True):
+        """call at the start of each training step, the time since the end of
+        the previous step is recorded as `data_wait`"""
+        self.step += 1
+        if device is not None:
+            self.device = torch.device(device)
+        self.active = self.step >= self.skip_first and (
+            self.num_steps is None or self.step < self.skip_first + self.num_steps
+        )
+        self.step_peak_memory = 0.0
+        now = time.perf_counter()
+        if self.active and measure_data_wait and self._last_step_end is not None:
+            self._add_record("data_wait", self._last_step_end, now)
+        self._step_start = now
+
+    def end_step(self):
+        """call at the end of each training step, after backward and optimizer step"""
+        now = time.perf_counter()
+        if self.active:
+            record = self._add_record("step", self._step_start, now)
+            if self._use_cuda and self.record_memory:
+                self.step_peak_memory = max(
+                    self.step_peak_memory, torch.cuda.max_memory_allocated(self.device) / 2**20
+                )
+                record["peak_memory_mb"] = self.step_peak_memory
+            self._resolve(block=False)
+        self._last_step_end = now
+
+    @property
+    def _use_cuda(self) -> bool:
+        return self.device.type == "cuda"
+
+    def stage(self, name: str):
+        """context manager timing a stage of an active step"""
+        if not self.active:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        use_cuda = self._use_cuda
+        if use_cuda and self.synchronize:
+            torch.cuda.synchronize(self.device)
+        if use_cuda and self.record_memory:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        events = None
+        if use_cuda and self.record_device_time:
+            events = (
+                torch.cuda.Event(enable_timing=True),
+                torch.cuda.Event(enable_timing=True),
+            )
+            events[0].record()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if events is not None:
+                events[1].record()
+            if use_cuda and self.synchronize:
+                torch.cuda.synchronize(self.device)
+            record = self._add_record(name, start, time.perf_counter(), events)
+            if use_cuda and self.record_memory:
+                peak_memory = torch.cuda.max_memory_allocated(self.device) / 2**20
+                record["peak_memory_mb"] = peak_memory
+                self.step_peak_memory = max(self.step_peak_memory, peak_memory)
+
+    def _add_record(self, name: str, start: float, end: float, events=None) -> Dict:
+        record = {
+            "stage": name,
+            "step": self.step,
+            "start_ms": (start - self._origin) * 1e3,
+            "wall_ms": (end - start) * 1e3,
+            "device_ms": None,
+            "peak_memory_mb": None,
+        }
+        self.records.append(record)
+        if events is not None:
+            self._pending.append((record, events))
+        return record
+
+    def _resolve(self, block: bool):
+        """device time of the records whose events completed (all of them if `block`)"""
+        pending = []
+        for record, (start_event, end_event) in self._pending:
+            if block:
+                end_event.synchronize()
+            elif not end_event.query():
+                pending.append((record, (start_event, end_event)))
+                continue
+            record["device_ms"] = start_event.elapsed_time(end_event)
+        self._pending = pending
+
+    def get_records(self) -> pd.DataFrame:
+        """one row per recorded stage"""
+        self._resolve(block=True)
+        return pd.DataFrame(
+            self.records,
+            columns=["stage", "step", "start_ms", "wall_ms", "device_ms", "peak_memory_mb"],
+        )
+
+    def summary(self) -> pd.DataFrame:
+        """per stage: count, mean/median/p95/total wall time, mean device time,
+        peak memory and share of the step wall time, in order of first occurrence"""
+        records = self.get_records()
+        if records.empty:
+            return pd.DataFrame()
+        records["device_ms"] = records["device_ms"].astype(float)
+        records["peak_memory_mb"] = records["peak_memory_mb"].astype(float)
+        grouped = records.groupby("stage", sort=False)
+        summary = pd.DataFrame(
+            {
+                "count": grouped["wall_ms"].count(),
+                "wall_ms_mean": grouped["wall_ms"].mean(),
+                "wall_ms_median": grouped["wall_ms"].median(),
+                "wall_ms_p95": grouped["wall_ms"].quantile(0.95),
+                "wall_ms_total": grouped["wall_ms"].sum(),
+                "device_ms_mean": grouped["device_ms"].mean(),
+                "peak_memory_mb": grouped["peak_memory_mb"].max(),
+            }
+        )
+        step_total = summary["wall_ms_total"].get("step", float("nan"))
+        summary["step_share"] = summary["wall_ms_total"] / step_total
+        return summary
+
+    def get_chrome_trace(self, pid: int = 0) -> Dict:
+        """chrome trace event format, one complete event per stage record
+        with the device time and peak memory as arguments"""
+        events = []
+        for record in self.get_records().to_dict("records"):
+            args = {"step": record["step"]}
+            for key in ("device_ms", "peak_memory_mb"):
+                if pd.notna(record[key]):
+                    args[key] = record[key]
+            events.append(
+                {
+                    "name": record["stage"],
+                    "ph": "X",
+                    "ts": record["start_ms"] * 1e3,
+                    "dur": record["wall_ms"] * 1e3,
+                    "pid": pid,
+                    "tid": 0,
+                    "args": args,
+                }
+            )
+            if "peak_memory_mb" in args:
+                events.append(
+                    {
+                        "name": "peak_memory_mb",
+                        "ph": "C",
+                        "ts": record["start_ms"] * 1e3,
+                        "pid": pid,
+                        "args": {"MB": args["peak_memory_mb"]},
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, output_dir: Union[str, Path], prefix: str, pid: int = 0) -> Dict[str, Path]:
+        """write `<prefix>-trace.json`, `<prefix>-stages.csv` and `<prefix>-stage-summary.csv`"""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(exist_ok=True, parents=True)
+        paths = {
+            "trace": output_dir / f"{prefix}-trace.json",
+            "stages": output_dir / f"{prefix}-stages.csv",
+            "summary": output_dir / f"{prefix}{PROFILE_SUMMARY_SUFFIX}",
+        }
+        with open(paths["trace"], "w") as f:
+            json.dump(self.get_chrome_trace(pid), f)
+        self.get_records().to_csv(paths["stages"], index=False)
+        self.summary().to_csv(paths["summary"], index_label="stage")
+        return paths
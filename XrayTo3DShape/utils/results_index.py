@@ -0,0 +1,334 @@
+"""
+local index of training runs and their metric logs, replaces the wandb API
+queries of the benchmark table scripts.
+
+    run-id -> {"model_name", "anatomy", "tags", "created", "metric_logs": {subdir: csv path}}
+
+run metadata is read from `run-info.json` in the run directory (written by train.py),
+older runs fall back to the files wandb keeps next to the runs
+(`wandb/run-<date>_<time>-<run-id>/files/config.yaml, wandb-metadata.json`) or to
+the wandb API. metric logs are found under `<runs_dir>/<run-id>/<subdir>/metric-log.csv`
+or `<runs_dir>/<run-id>/angle_perturbation/<angle>/metric-log.csv`, only these fixed
+locations are checked so that the thousands of predictions next to the logs are never
+listed. the index is cached as json and rebuilt when the run infos or metric logs change.
+"""
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from .callbacks import METRIC_LOG_FILENAME
+from .metrics_store import read_metrics_table
+
+__all__ = [
+    "RUN_INFO_FILENAME",
+    "METRIC_COLUMNS",
+    "write_run_info",
+    "build_results_index",
+    "load_results_index",
+    "filter_runs",
+    "select_run_per_model",
+    "select_benchmark_runs",
+    "load_metric_logs",
+    "summarize_metrics",
+]
+
+RUN_INFO_FILENAME = "run-info.json"
+# subdirs whose subdirectories hold the metric logs, <run-id>/angle_perturbation/5/metric-log.csv
+NESTED_METRIC_LOG_SUBDIRS = ("angle_perturbation",)
+METRIC_COLUMNS = ["DSC", "ASD", "HD95", "NSD"]
+WANDB_RUN_DIR_PATTERN = re.compile(r"(?:offline-)?run-(\d{8}_\d{6})-(\w+)$")
+
+
+def write_run_info(
+    run_dir: Union[str, Path],
+    run_id: str,
+    model_name: str,
+    anatomy: str,
+    tags: Sequence[str],
+    created: str,
+    config: Optional[Dict] = None,
+):
+    """record what the results index needs to know about a run in its directory.
+    `created` is an iso timestamp, the most recent run of a model is reported"""
+    run_dir = Path(run_dir)
+    run_dir.mkdir(exist_ok=True, parents=True)
+    run_info = {
+        "run_id": run_id,
+        "model_name": model_name,
+        "anatomy": anatomy,
+        "tags": list(tags),
+        "created": created,
+        "config": config if config else {},
+    }
+    with open(run_dir / RUN_INFO_FILENAME, "w") as f:
+        json.dump(run_info, f, indent=4, default=str)
+
+
+def _find_metric_logs(run_dir: Path) -> Dict[str, str]:
+    """subdir (e.g. `evaluation`, `angle_perturbation/5`) -> metric log path"""
+    directories = [subdir for subdir in run_dir.iterdir() if subdir.is_dir()]
+    for nested in NESTED_METRIC_LOG_SUBDIRS:
+        if (run_dir / nested).is_dir():
+            directories += [d for d in (run_dir / nested).iterdir() if d.is_dir()]
+    return {
+        directory.relative_to(run_dir).as_posix(): str(directory / METRIC_LOG_FILENAME)
+        for directory in sorted(directories)
+        if (directory / METRIC_LOG_FILENAME).exists()
+    }
+
+
+def _read_wandb_run_dir(wandb_run_dir: Path) -> Optional[Dict]:
+    """run metadata from the local files of a wandb run, tags as set by train.py:
+    model name, anatomy, loss and the `--tags` command line arguments"""
+    config_path = wandb_run_dir / "files" / "config.yaml"
+    if not config_path.exists():
+        return None
+    with open(config_path) as f:
+        config = {
+            key: value["value"] if isinstance(value, dict) and "value" in value else value
+            for key, value in (yaml.safe_load(f) or {}).items()
+        }
+    if "MODEL_NAME" not in config:
+        return None
+    tags = [config["MODEL_NAME"], config.get("ANATOMY", ""), config.get("LOSS", "")]
+    metadata_path = wandb_run_dir / "files" / "wandb-metadata.json"
+    if metadata_path.exists():
+        with open(metadata_path) as f:
+            args = json.load(f).get("args", [])
+        if "--tags" in args:
+            for arg in args[args.index("--tags") + 1 :]:
+                if arg.startswith("--"):
+                    break
+                tags.append(arg)
+    return {
+        "model_name": config["MODEL_NAME"],
+        "anatomy": config.get("ANATOMY", "none"),
+        "tags": [tag for tag in tags if tag],
+        "config": config,
+    }
+
+
+def _read_wandb_api_runs(project_name: str) -> Dict[str, Dict]:
+    """run metadata of all runs of the project from the wandb API"""
+    import wandb  # pylint: disable=import-outside-toplevel
+
+    runs = {}
+    for run in wandb.Api().runs(project_name):
+        if "MODEL_NAME" not in run.config:
+            continue
+        runs[run.id] = {
+            "model_name": run.config["MODEL_NAME"],
+            "anatomy": run.config.get("ANATOMY", "none"),
+            "tags": list(run.tags),
+            "created": run.created_at,
+            "config": dict(run.config),
+        }
+    return runs
+
+
+def build_results_index(
+    runs_dir: Union[str, Path] = "runs/2d-3d-benchmark",
+    wandb_dir: Optional[Union[str, Path]] = "runs/wandb",
+    wandb_project: Optional[str] = None,
+) -> Dict[str, Dict]:
+    """index every run directory of `runs_dir` that has metadata
+
+    Args:
+        runs_dir (Union[str, Path], optional): one directory per run-id
+        wandb_dir (Optional[Union[str, Path]], optional): local wandb run directories
+        wandb_project (Optional[str], optional): e.g. `msrepo/2d-3d-benchmark`, query the
+            wandb API for runs without local metadata. Defaults to None (offline).
+    """
+    runs_dir = Path(runs_dir)
+    wandb_runs = {}
+    if wandb_dir is not None and Path(wandb_dir).exists():
+        for wandb_run_dir in Path(wandb_dir).iterdir():
+            match = WANDB_RUN_DIR_PATTERN.match(wandb_run_dir.name)
+            if match:
+                run = _read_wandb_run_dir(wandb_run_dir)
+                if run is not None:
+                    run["created"] = datetime.strptime(
+                        match.group(1), "%Y%m%d_%H%M%S"
+                    ).isoformat()
+                    wandb_runs[match.group(2)] = run
+    api_runs: Optional[Dict[str, Dict]] = None
+
+    index = {}
+    for run_dir in sorted(p for p in runs_dir.iterdir() if p.is_dir()):
+        run_id = run_dir.name
+        if (run_dir / RUN_INFO_FILENAME).exists():
+            with open(run_dir / RUN_INFO_FILENAME) as f:
+                run = json.load(f)
+        elif run_id in wandb_runs:
+            run = wandb_runs[run_id]
+        elif wandb_project is not None:
+            if api_runs is None:
+                api_runs = _read_wandb_api_runs(wandb_project)
+            if run_id not in api_runs:
+                continue
+            run = api_runs[run_id]
+        else:
+            continue
+        index[run_id] = {
+            "model_name": run["model_name"],
+            "anatomy": run["anatomy"],
+            "tags": list(run["tags"]),
+            "created": str(run.get("created", "")),
+            "metric_logs": _find_metric_logs(run_dir),
+        }
+    return index
+
+
+def _get_runs_fingerprint(
+    runs_dir: Path, wandb_dir: Optional[Union[str, Path]], wandb_project: Optional[str]
+) -> str:
+    """changes when a run info or metric log is added, removed or rewritten, when a
+    local wandb run is added or when the index is requested with other metadata sources"""
+    md5 = hashlib.md5(f"{wandb_dir}:{wandb_project}".encode())
+    if wandb_dir is not None and Path(wandb_dir).exists():
+        md5.update(f"{Path(wandb_dir).stat().st_mtime_ns}".encode())
+    for run_dir in sorted(p for p in runs_dir.iterdir() if p.is_dir()):
+        paths = [run_dir / RUN_INFO_FILENAME, *map(Path, _find_metric_logs(run_dir).values())]
+        for path in paths:
+            if path.exists():
+                md5.update(f"{path}:{path.stat().st_mtime_ns}".encode())
+    return md5.hexdigest()
+
+
+def load_results_index(
+    runs_dir: Union[str, Path] = "runs/2d-3d-benchmark",
+    wandb_dir: Optional[Union[str, Path]] = "runs/wandb",
+    cache_path: Union[str, Path] = "results/results-index.json",
+    wandb_project: Optional[str] = None,
+    rebuild: bool = False,
+) -> Dict[str, Dict]:
+    """cached `build_results_index`"""
+    cache_path = Path(cache_path)
+    fingerprint = _get_runs_fingerprint(Path(runs_dir), wandb_dir, wandb_project)
+    if cache_path.exists() and not rebuild:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get("fingerprint") == fingerprint:
+            return cache["runs"]
+    index = build_results_index(runs_dir, wandb_dir, wandb_project)
+    cache_path.parent.mkdir(exist_ok=True, parents=True)
+    with open(cache_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "runs": index}, f, indent=4)
+    return index
+
+
+def filter_runs(
+    index: Dict[str, Dict], anatomy: str, tags: Iterable[str] = ("model-compare",)
+) -> Dict[str, Dict]:
+    """runs of the anatomy that carry all tags, same criteria as `filter_wandb_run`"""
+    tags = set(tags) if tags else set()
+    return {
+        run_id: run
+        for run_id, run in index.items()
+        if anatomy in run["anatomy"] and tags.issubset(run["tags"])
+    }
+
+
+def select_run_per_model(runs: Dict[str, Dict]) -> Dict[str, str]:
+    """model name -> run-id of its most recent run"""
+    selected: Dict[str, str] = {}
+    for run_id, run in sorted(runs.items(), key=lambda item: item[1]["created"]):
+        selected[run["model_name"]] = run_id
+    return selected
+
+
+def select_benchmark_runs(
+    index: Dict[str, Dict], tags: Optional[Iterable[str]] = ("model-compare",)
+) -> List[str]:
+    """run-ids of the most recent run of each model of each anatomy carrying all tags"""
+    run_ids: List[str] = []
+    for anatomy in sorted({run["anatomy"] for run in index.values()}):
+        runs = {
+            run_id: run for run_id, run in filter_runs(index, anatomy, tags).items()
+            if run["anatomy"] == anatomy
+        }
+        run_ids += select_run_per_model(runs).values()
+    return run_ids
+
+
+def _read_metric_log(path: str, inf_as_nan: bool) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    if inf_as_nan:
+        df[METRIC_COLUMNS] = df[METRIC_COLUMNS].replace([np.inf, -np.inf], np.nan)
+    return df
+
+
+def load_metric_logs(
+    index: Dict[str, Dict],
+    subdir: str = "evaluation",
+    run_ids: Optional[Iterable[str]] = None,
+    num_workers: int = 8,
+    inf_as_nan: bool = True,
+    parquet_dir: Optional[Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """metric logs of the runs read in parallel into one table, one row per
+    subject and run with `run_id`, `model`, `anatomy`, `subdir` columns.
+    with `inf_as_nan`, inf distances are read as nan so that they are dropped when aggregating.
+    with `parquet_dir` (evaluate.py --parquet_dir), the full precision metrics of the runs
+    are read from the parquet store, only runs missing there are read from the csv logs"""
+    run_ids = list(run_ids) if run_ids is not None else list(index)
+    jobs = [
+        (run_id, index[run_id]["metric_logs"][subdir])
+        for run_id in run_ids
+        if subdir in index[run_id]["metric_logs"]
+    ]
+    columns = ["run_id", "model", "anatomy", "subdir", "subject-id", *METRIC_COLUMNS]
+    if not jobs:
+        return pd.DataFrame(columns=columns)
+    dataframes = []
+    if parquet_dir is not None and Path(parquet_dir).exists():
+        # anatomy partitions of the runs, run and subdir rows selected while reading
+        stored = read_metrics_table(
+            parquet_dir,
+            columns=["run_id", "subject-id", *METRIC_COLUMNS],
+            filters={
+                "anatomy": sorted({index[run_id]["anatomy"] for run_id, _ in jobs}),
+                "run_id": [run_id for run_id, _ in jobs],
+                "subdir": subdir,
+            },
+        )
+        # a run evaluated under several tags
+        stored = stored.drop_duplicates(["run_id", "subject-id"], keep="last")
+        if inf_as_nan:
+            stored[METRIC_COLUMNS] = stored[METRIC_COLUMNS].replace([np.inf, -np.inf], np.nan)
+        stored_jobs = [job for job in jobs if job[0] in set(stored["run_id"])]
+        dataframes += [
+            stored[stored["run_id"] == run_id].drop(columns="run_id").reset_index(drop=True)
+            for run_id, _ in stored_jobs
+        ]
+        jobs = stored_jobs + [job for job in jobs if job not in stored_jobs]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        dataframes += list(
+            executor.map(
+                lambda job: _read_metric_log(job[1], inf_as_nan), jobs[len(dataframes) :]
+            )
+        )
+    for (run_id, _), df in zip(jobs, dataframes):
+        df["run_id"] = run_id
+        df["model"] = index[run_id]["model_name"]
+        df["anatomy"] = index[run_id]["anatomy"]
+        df["subdir"] = subdir
+    table = pd.concat(dataframes, ignore_index=True)
+    for column in ("run_id", "model", "anatomy", "subdir"):
+        table[column] = table[column].astype("category")
+    return table
+
+
+def summarize_metrics(
+    table: pd.DataFrame, by: Sequence[str] = ("anatomy", "model")
+) -> pd.DataFrame:
+    """mean of each metric per group, nan ignored"""
+    return table.groupby(list(by), observed=True)[METRIC_COLUMNS].mean()
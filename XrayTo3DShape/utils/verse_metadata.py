@@ -1,27 +1,49 @@
 """query verse metadata"""
+import hashlib
 import math
+import os
+import pickle
+import tempfile
 import warnings
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 
 from .enums import DatasetConsts, VerseKeys
 from .misc_utils import split_subject_vertebra_id
 
 
+def get_default_cache_path(annotations_filename) -> Path:
+    """cache of the parsed sheet in the user cache directory, one per sheet path"""
+    cache_home = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    sheet_path = Path(annotations_filename).resolve()
+    digest = hashlib.md5(str(sheet_path).encode()).hexdigest()[:12]
+    return cache_home / "xrayto3d" / f"{sheet_path.stem}-{digest}.pkl"
+
+
 class VerseExcelSheet:
     """Reads the annotation excel sheet and allows to query vertebra level, shape, grade"""
 
     n_rows, n_cols = 161, 48
     data_frame: pd.DataFrame
+    # per (subject, vertebra) metadata, see `metadata_table`
+    METADATA_COLUMNS = ("shape", "severity", "level", "ct_device", "ct_resolution", "bmd")
 
     def __init__(
-        self, annotations_filename="metadata/ryai190138_appendixe1.xlsx"
+        self,
+        annotations_filename="metadata/ryai190138_appendixe1.xlsx",
+        cache_path: Optional[str] = None,
     ) -> None:
+        """the parsed sheet and the metadata table are cached as a pickle in the user
+        cache directory (`get_default_cache_path`) or at `cache_path`, and reused while
+        the sheet is unmodified. the cache is trusted like the sheet itself"""
         warnings.filterwarnings("ignore", category=UserWarning)
         self.annotations_filename = annotations_filename
-        # UserWarning: Unknown extension is not supported and will be removed
-        self._read_extra_annotations()
+        self.cache_path = (
+            Path(cache_path) if cache_path else get_default_cache_path(annotations_filename)
+        )
 
         self.gradeid_to_grade_key = {
             "0": VerseKeys.NORMAL,
@@ -37,6 +59,125 @@ class VerseExcelSheet:
             "3": VerseKeys.CRUSH,
             "x": VerseKeys.FOREIGN_MATERIAL,
         }
+        self._load_annotations()
+
+    def _load_annotations(self):
+        """read the sheet once, afterwards from the cache keyed by the sheet's mtime"""
+        mtime_ns = os.stat(self.annotations_filename).st_mtime_ns
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path, "rb") as f:
+                    cache = pickle.load(f)
+                if cache["mtime_ns"] == mtime_ns and cache["shape"] == (self.n_rows, self.n_cols):
+                    self.data_frame = cache["data_frame"]
+                    self.metadata_table = cache["metadata_table"]
+                    self._index_subjects()
+                    return
+            except Exception as e:  # corrupt or incompatible cache, rebuild
+                # not a UserWarning, those are filtered while the sheet is read
+                warnings.warn(
+                    f"could not load cache {self.cache_path}: {e}", RuntimeWarning
+                )
+        # UserWarning: Unknown extension is not supported and will be removed
+        self._read_extra_annotations()
+        self._index_subjects()
+        self.metadata_table = self._build_metadata_table()
+        cache = {
+            "mtime_ns": mtime_ns,
+            "shape": (self.n_rows, self.n_cols),
+            "data_frame": self.data_frame,
+            "metadata_table": self.metadata_table,
+        }
+        # write to a temporary file and rename so that concurrent readers never see a partial cache
+        self.cache_path.parent.mkdir(exist_ok=True, parents=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_path.parent, suffix=".tmp", delete=False
+        ) as tmp_file:
+            pickle.dump(cache, tmp_file)
+        os.replace(tmp_file.name, self.cache_path)
+
+    def _index_subjects(self):
+        """rows indexed by subject id. `verse_ID` is expected to be unique, as with
+        the row lookups before, the first row of a repeated subject is used"""
+        duplicated = self.data_frame["verse_ID"].duplicated(keep="first")
+        if duplicated.any():
+            warnings.warn(
+                f"verse_ID {sorted(self.data_frame['verse_ID'][duplicated].unique())} "
+                "repeated in the sheet, the first row of each is used",
+                RuntimeWarning,
+            )
+        self.subject_frame = self.data_frame[~duplicated].set_index("verse_ID")
+
+    def _build_metadata_table(self) -> pd.DataFrame:
+        """shape, severity, level, ct device, resolution and bmd of every
+        vertebra of every subject, indexed by (subject, vertebra)"""
+        subjects = self.subject_frame
+        frames = []
+        for vertebra_id in range(1, DatasetConsts.LAST_LUMBAR + 2):
+            vertebra_name = self.get_vertebra_name(vertebra_id)
+            frame = pd.DataFrame(
+                {
+                    VerseKeys.SUBJECT: subjects.index.values,
+                    VerseKeys.VERTEBRA: vertebra_id,
+                }
+            )
+            for column, column_name, id_to_key in (
+                ("shape", self._get_shape_column_name(vertebra_name), self.shapeid_to_shape_key),
+                ("severity", self._get_grade_column_name(vertebra_name), self.gradeid_to_grade_key),
+            ):
+                if vertebra_name.startswith("C"):
+                    # cervical vertebra do not have shape or grade information
+                    frame[column] = VerseKeys.NORMAL
+                elif column_name in subjects.columns:
+                    frame[column] = (
+                        subjects[column_name].map(self._cast_to_string).map(id_to_key).values
+                    )
+                else:
+                    frame[column] = np.nan
+            frame["level"] = self.get_vertebra_level({VerseKeys.VERTEBRA: vertebra_id})
+            frame["ct_device"] = subjects["CT_device"].values
+            frame["ct_resolution"] = subjects["Res"].values
+            frame["bmd"] = subjects["BMD"].values
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True).set_index(
+            [VerseKeys.SUBJECT, VerseKeys.VERTEBRA]
+        ).sort_index()
+
+    @staticmethod
+    def split_subject_vertebra_ids(filepaths: pd.Series) -> pd.DataFrame:
+        """vectorised `split_subject_vertebra_id` -> `subject`, `vertebra` columns"""
+        names = filepaths.astype(str).str.rsplit("/", n=1).str[-1]
+        ids = names.str.findall(r"\d+")
+        num_ids = ids.str.len()
+        invalid = ~num_ids.isin([2, 3])
+        if invalid.any():
+            raise ValueError(
+                f"could not split {names[invalid].tolist()[:5]} into subject and vertebra"
+            )
+        # 3 numbers: sub-verse401_10_split-verse253_ct, the first part is ignored
+        return pd.DataFrame(
+            {
+                VerseKeys.SUBJECT: ids.str[-2].astype(int),
+                VerseKeys.VERTEBRA: ids.str[-1].astype(int),
+            },
+            index=filepaths.index,
+        )
+
+    def annotate(
+        self,
+        metric_log: pd.DataFrame,
+        columns: Sequence[str] = ("shape", "severity", "level"),
+        subject_column: str = "subject-id",
+    ) -> pd.DataFrame:
+        """add the metadata `columns` to every row of a metric log in a single merge"""
+        keys = self.split_subject_vertebra_ids(metric_log[subject_column])
+        annotated = pd.concat([metric_log, keys], axis="columns").merge(
+            self.metadata_table[list(columns)],
+            left_on=[VerseKeys.SUBJECT, VerseKeys.VERTEBRA],
+            right_index=True,
+            how="left",
+        )
+        return annotated.drop(columns=[VerseKeys.SUBJECT, VerseKeys.VERTEBRA])
 
     @classmethod
     def get_vertebra_keys(cls, filepath):
@@ -163,11 +304,11 @@ class VerseExcelSheet:
         return f"{vertebra_name}_fx-g"
 
     def _get_row_item(self, vertebra_keys: Dict, column_name):
-        """get whole row"""
-        subject_details = self._get_excel_row(vertebra_keys)
-        return subject_details[column_name].values[0]
+        """cell of the subject's row"""
+        return self.subject_frame.at[vertebra_keys[VerseKeys.SUBJECT], column_name]
 
     def _get_excel_row(self, vertebra_keys):
+        """every row of the subject"""
         return self.data_frame.loc[
             self.data_frame.verse_ID == vertebra_keys[VerseKeys.SUBJECT]
         ]
@@ -6,22 +6,32 @@ import argparse
 import os
 from pathlib import Path
 
-import torch
 import pytorch_lightning as pl
 from torch.utils.data import DataLoader
 
-import XrayTo3DShape
 from XrayTo3DShape import (
+    LABEL_FORMATS,
+    METRIC_LOG_FILENAME,
+    PRECISION_MODES,
     MetricsLogger,
     AnglePerturbationMetricsLogger,
     NiftiPredictionWriter,
+    PackedPredictionWriter,
+    TLPredictorExperiment,
+    compile_model,
     get_dataset,
+    get_checkpoint_hash,
+    get_example_inputs,
+    get_gt_store_dir,
     get_latest_checkpoint,
-    get_model,
+    get_parquet_metrics_writer,
+    get_peak_rss_megabytes,
+    get_scored_subjects,
+    get_trainer_precision,
+    get_transform_family_from_model_name,
     get_transform_from_model_name,
+    load_experiment,
     model_experiment_dict,
-    TLPredictorExperiment,
-    CustomAutoEncoder,
     anatomy_resolution_dict,
     get_anatomy_from_path,
 )
@@ -42,14 +52,94 @@ def parse_evaluation_arguments():
     parser.add_argument("--res", type=float)
     parser.add_argument("--load_autoencoder_from", type=str)
     parser.add_argument("--nsd_tolerance", type=float, default=1.5)
+    parser.add_argument(
+        "--metrics_backend",
+        choices=["torch", "monai"],
+        default="torch",
+        help="torch: batched surface metrics on the prediction device, monai: per-sample reference implementation",
+    )
     parser.add_argument("--image_size", type=int)
+    parser.add_argument(
+        "--patch_size",
+        type=int,
+        default=None,
+        help="model input size for sliding window prediction over the full `image_size` volume, volume input models only",
+    )
+    parser.add_argument("--sw_batch_size", type=int, default=4)
+    parser.add_argument("--sw_overlap", type=float, default=0.25)
     parser.add_argument("--output_path", default=None)
     parser.add_argument("--gpu", default=0, type=int)
     parser.add_argument("--batch_size", default=1, type=int)
     parser.add_argument("--num_workers", default=8, type=int)
     parser.add_argument("--accelerator", default="gpu")
-    parser.add_argument("--precision", default=32)
+    parser.add_argument("--precision", default="32", choices=PRECISION_MODES)
+    parser.add_argument("--channels_last", default=False, action="store_true")
+    parser.add_argument(
+        "--compile",
+        default=False,
+        action="store_true",
+        help="torch.compile the model forward, graph breaks are reported before prediction",
+    )
+    parser.add_argument(
+        "--compile_mode",
+        default="default",
+        choices=["default", "reduce-overhead", "max-autotune"],
+    )
+    parser.add_argument(
+        "--writer_workers",
+        default=2,
+        type=int,
+        help="background threads for nifti writes and metrics, 0 runs them in the prediction loop",
+    )
+    parser.add_argument(
+        "--prediction_format",
+        choices=["nifti", "packed"],
+        default="nifti",
+        help="nifti: int16 .nii.gz per volume, packed: bit-packed mask stores, see scripts/export_packed_masks.py",
+    )
+    parser.add_argument(
+        "--gt_store_dir",
+        default=None,
+        type=str,
+        help="packed groundtruth masks are written once per test set under this directory",
+    )
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="skip subjects already in the metric log of the same checkpoint, append the rest",
+    )
+    parser.add_argument(
+        "--parquet_dir",
+        default=None,
+        type=str,
+        help="also write full precision metrics to this parquet dataset, partitioned by anatomy/model/tag (requires pyarrow)",
+    )
+    parser.add_argument(
+        "--results_tag",
+        default=None,
+        type=str,
+        help="tag partition of the parquet metrics, defaults to the first --tags tag of the training run",
+    )
     parser.add_argument("--angle_perturbation", default=False, action="store_true")
+    parser.add_argument(
+        "--lazy_kasten",
+        default=False,
+        action="store_true",
+        help="expand AP/LAT images into volumes on the device instead of the dataloader",
+    )
+    parser.add_argument(
+        "--label_format",
+        choices=LABEL_FORMATS,
+        default="float32",
+        help="carry segmentation labels through the dataloader as float32, uint8 or packed bits",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        type=str,
+        help="cache preprocessed samples on disk in this directory",
+    )
     return parser.parse_args()
 
 
@@ -63,9 +153,12 @@ def update_args(args):
     Returns:
         dict: (key,value)
     """
-    args.precision = 16 if args.gpu == 0 else 32  # use bfloat16 on RTX 3090
     args.devices = os.cpu_count() if args.accelerator == "cpu" else [args.gpu]
     args.experiment_name = model_experiment_dict[args.model_name]
+    args.transform_family = get_transform_family_from_model_name(args.model_name)
+    if args.cache_dir and args.transform_family == "denoising_autoencoder":
+        print("noisy labels are sampled on every pass, disabling on-disk cache")
+        args.cache_dir = None
     if args.output_path is None:
         args.output_path = str(Path(args.ckpt_path) / "../evaluation")
     if args.ckpt_type == "best":
@@ -80,6 +173,15 @@ def update_args(args):
         raise ValueError(
             f"ckpt_type can be either `best` or `latest` but got {args.ckpt_type}"
         )
+    if args.resume and args.prediction_format == "packed":
+        raise ValueError("--resume keeps nifti predictions of scored subjects, use --prediction_format nifti")
+    # a metric log of a different checkpoint is not resumed
+    args.checkpoint_hash = get_checkpoint_hash(
+        args.ckpt_path,
+        autoencoder_path=args.load_autoencoder_from
+        if args.experiment_name == TLPredictorExperiment.__name__
+        else None,
+    )
     # assert resolution and size agree for each anatomy
     args.anatomy = get_anatomy_from_path(args.testpaths)
     # this requirement does not make sense when data is a patch 
@@ -95,90 +197,141 @@ args = update_args(args)
 print(args)
 
 test_transform = get_transform_from_model_name(
-    args.model_name, image_size=args.image_size, resolution=args.res
+    args.model_name,
+    image_size=args.image_size,
+    resolution=args.res,
+    lazy_kasten=args.lazy_kasten,
+    label_format=args.label_format,
 )
 
+scored_subjects = (
+    get_scored_subjects(
+        Path(args.output_path) / METRIC_LOG_FILENAME, args.checkpoint_hash
+    )
+    if args.resume
+    else set()
+)
+if scored_subjects:
+    print(f"resuming: {len(scored_subjects)} subjects already scored")
+
 test_loader = DataLoader(
-    get_dataset(args.testpaths, transforms=test_transform),
+    get_dataset(
+        args.testpaths,
+        transforms=test_transform,
+        cache_dir=args.cache_dir,
+        transform_params={
+            "size": args.image_size,
+            "resolution": args.res,
+            "family": args.transform_family,
+            "lazy_kasten": args.lazy_kasten,
+            "label_format": args.label_format,
+        },
+        label_format=args.label_format,
+        exclude_subjects=scored_subjects,
+    ),
     batch_size=args.batch_size,
     num_workers=args.num_workers,
     shuffle=False,
     drop_last=False,
 )
 
-nifti_saver = NiftiPredictionWriter(
-    output_dir=args.output_path,
-    write_interval="batch",
-    image_size=args.image_size,
-    resolution=args.res,
+if args.prediction_format == "packed":
+    nifti_saver = PackedPredictionWriter(
+        output_dir=args.output_path,
+        write_interval="batch",
+        gt_store_dir=get_gt_store_dir(
+            args.gt_store_dir, args.testpaths, args.image_size, args.res
+        )
+        if args.gt_store_dir
+        else None,
+        image_size=args.image_size,
+        resolution=args.res,
+        source={"testpaths": args.testpaths, "ckpt_path": args.ckpt_path},
+        num_workers=args.writer_workers,
+    )
+else:
+    nifti_saver = NiftiPredictionWriter(
+        output_dir=args.output_path,
+        write_interval="batch",
+        image_size=args.image_size,
+        resolution=args.res,
+        num_workers=args.writer_workers,
+    )
+columnar_writer = (
+    get_parquet_metrics_writer(
+        args.parquet_dir,
+        args.ckpt_path,
+        args.output_path,
+        anatomy=args.anatomy,
+        model=args.model_name,
+        tag=args.results_tag,
+    )
+    if args.parquet_dir
+    else None
 )
 if args.angle_perturbation:
     metrics_saver = AnglePerturbationMetricsLogger(
         output_dir=args.output_path,
         voxel_spacing=args.res,
         nsd_tolerance=args.nsd_tolerance,
+        metrics_backend=args.metrics_backend,
+        num_workers=args.writer_workers,
+        checkpoint_hash=args.checkpoint_hash,
+        resume=args.resume,
+        columnar_writer=columnar_writer,
     )
 else:
     metrics_saver = MetricsLogger(
         output_dir=args.output_path,
         voxel_spacing=args.res,
         nsd_tolerance=args.nsd_tolerance,
+        metrics_backend=args.metrics_backend,
+        num_workers=args.writer_workers,
+        checkpoint_hash=args.checkpoint_hash,
+        resume=args.resume,
+        columnar_writer=columnar_writer,
     )
 evaluation_callbacks = [nifti_saver, metrics_saver]
 
-model_architecture = get_model(model_name=args.model_name, image_size=args.image_size)
-model_module: pl.LightningModule = getattr(
-    XrayTo3DShape.experiments, args.experiment_name
-)(model=model_architecture)
+# the same checkpoint loading as evaluate_multi.py and serve.py
+model_module = load_experiment(
+    args.model_name,
+    args.ckpt_path,
+    args.image_size,
+    label_format=args.label_format,
+    patch_size=args.patch_size,
+    load_autoencoder_from=args.load_autoencoder_from,
+    sw_batch_size=args.sw_batch_size,
+    sw_overlap=args.sw_overlap,
+    channels_last=args.channels_last,
+)
 
-if args.experiment_name == TLPredictorExperiment.__name__:
-    print(f"loading autoencoder from {args.load_autoencoder_from}")
-    ae_model = get_model(
-        model_name=CustomAutoEncoder.__name__, image_size=args.image_size
+if args.compile:
+    # the forward is compiled in place, the checkpoint is already loaded
+    compile_model(
+        model_module.model,
+        example_inputs=get_example_inputs(
+            args.model_name, args.patch_size if args.patch_size else args.image_size
+        ),
+        mode=args.compile_mode,
     )
-    if Path(args.load_autoencoder_from).exists():
-        checkpoint = torch.load(args.load_autoencoder_from)
-    else:
-        raise ValueError(
-            f"autoencoder checkpoint {args.load_autoencoder_from} does not exist"
-        )
-    for key in list(checkpoint["state_dict"].keys()):
-        # model.layer1.conv1 -> layer1.conv1
-        modified_key = key.replace("model.", "")
-        value = checkpoint["state_dict"].pop(key)
-        checkpoint["state_dict"][modified_key] = value
-    if "loss_function.pos_weight" in checkpoint["state_dict"]:
-        checkpoint["state_dict"].pop("loss_function.pos_weight")
-
-    ae_model.load_state_dict(checkpoint["state_dict"], strict=True)
-    model_module.set_decoder(ae_model)  # type: ignore
-
-    # load model architecture
-    if Path(args.ckpt_path).exists():
-        checkpoint = torch.load(args.ckpt_path)
-    else:
-        raise ValueError(f"model checkpoint {args.ckpt_path} does not exist")
-    for key in list(checkpoint["state_dict"].keys()):
-        # model.layer1.conv1 -> layer1.conv1
-        if str(key).startswith("model."):
-            modified_key = str(key)[len("model.") :]
-            value = checkpoint["state_dict"].pop(key)
-            checkpoint["state_dict"][modified_key] = value
-    if "loss_function.pos_weight" in checkpoint["state_dict"]:
-        checkpoint["state_dict"].pop("loss_function.pos_weight")
-    print(checkpoint["state_dict"].keys())
-
-    model_architecture.load_state_dict(checkpoint["state_dict"], strict=False)
-    model_module.model = model_architecture
 
 trainer = pl.Trainer(
-    callbacks=evaluation_callbacks, accelerator=args.accelerator, devices=args.devices
+    callbacks=evaluation_callbacks,
+    accelerator=args.accelerator,
+    devices=args.devices,
+    precision=get_trainer_precision(args.precision),
 )
-trainer.predict(
-    model=model_module,
-    dataloaders=test_loader,
-    return_predictions=False,
-    ckpt_path=None
-    if args.experiment_name == TLPredictorExperiment.__name__
-    else args.ckpt_path,
+if len(test_loader.dataset) == 0:
+    print(f"all subjects of {args.testpaths} are already scored")
+else:
+    trainer.predict(
+        model=model_module,
+        dataloaders=test_loader,
+        return_predictions=False,
+    )
+peak_rss = get_peak_rss_megabytes()
+print(
+    f"peak host memory {peak_rss['main']:.0f} MB main process, "
+    f"{peak_rss['workers']:.0f} MB dataloader workers"
 )
@@ -0,0 +1,325 @@
+"""
+run inference for many model checkpoints and test sets in a single process.
+jobs that share the test set and the data transformation pipeline are grouped,
+each group decodes its test set once and every checkpoint of the group is
+evaluated on the same batches. writes the same `metric-log.csv` and nifti
+predictions as `evaluate.py`.
+
+manifest: json list of jobs
+    [
+        {"model_name": "OneDConcat", "ckpt_path": "runs/2d-3d-benchmark/j9mkkkxc/checkpoints",
+         "testpaths": "configs/paths/femur/30k/TotalSegmentor-femur-left-DRR-30k_test.csv",
+         "res": 1.0, "image_size": 128},
+        ...
+    ]
+optional keys per job: output_path, ckpt_type, load_autoencoder_from,
+patch_size (sliding window prediction with a volume input model trained on patches)
+    python evaluate_multi.py manifest.json --gpu 0 --batch_size 8
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import pytorch_lightning as pl
+from pytorch_lightning.callbacks import BasePredictionWriter
+from torch import nn
+from torch.utils.data import DataLoader
+
+from XrayTo3DShape import (
+    LABEL_FORMATS,
+    METRIC_LOG_FILENAME,
+    PRECISION_MODES,
+    MetricsLogger,
+    NiftiPredictionWriter,
+    PackedPredictionWriter,
+    TLPredictorExperiment,
+    get_checkpoint_hash,
+    get_dataset,
+    get_gt_store_dir,
+    get_anatomy_from_path,
+    get_latest_checkpoint,
+    get_parquet_metrics_writer,
+    get_peak_rss_megabytes,
+    get_scored_subjects,
+    get_trainer_precision,
+    get_transform_family_from_model_name,
+    get_transform_from_model_name,
+    load_experiment,
+    model_experiment_dict,
+)
+
+
+def parse_evaluation_arguments():
+    """read options shared by all jobs of the manifest"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest")
+    parser.add_argument("--ckpt_type", choices=["latest", "best"], default="latest")
+    parser.add_argument("--nsd_tolerance", type=float, default=1.5)
+    parser.add_argument(
+        "--metrics_backend", choices=["torch", "monai"], default="torch"
+    )
+    parser.add_argument("--gpu", default=0, type=int)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--num_workers", default=8, type=int)
+    parser.add_argument("--writer_workers", default=2, type=int)
+    parser.add_argument("--accelerator", default="gpu")
+    parser.add_argument("--precision", default="32", choices=PRECISION_MODES)
+    parser.add_argument("--channels_last", default=False, action="store_true")
+    parser.add_argument("--prediction_format", choices=["nifti", "packed"], default="nifti")
+    parser.add_argument("--gt_store_dir", default=None, type=str)
+    parser.add_argument("--parquet_dir", default=None, type=str)
+    parser.add_argument("--results_tag", default=None, type=str)
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="skip subjects already in the metric log of the same checkpoint",
+    )
+    parser.add_argument("--lazy_kasten", default=False, action="store_true")
+    parser.add_argument("--label_format", choices=LABEL_FORMATS, default="float32")
+    parser.add_argument("--cache_dir", default=None, type=str)
+    return parser.parse_args()
+
+
+def read_manifest(path, ckpt_type):
+    """read jobs and fill in defaults as in `evaluate.py`"""
+    with open(path) as f:
+        jobs = json.load(f)
+    checkpoint_regex = {"best": "epoch=*.ckpt", "latest": "last*.ckpt"}
+    for job in jobs:
+        job.setdefault("ckpt_type", ckpt_type)
+        if job["ckpt_type"] not in checkpoint_regex:
+            raise ValueError(
+                f"ckpt_type can be either `best` or `latest` but got {job['ckpt_type']}"
+            )
+        job.setdefault("output_path", str(Path(job["ckpt_path"]) / "../evaluation"))
+        job["ckpt_path"] = get_latest_checkpoint(
+            job["ckpt_path"], checkpoint_regex=checkpoint_regex[job["ckpt_type"]]
+        )
+        job["res"] = float(job["res"])
+        job["image_size"] = int(job["image_size"])
+        job["experiment_name"] = model_experiment_dict[job["model_name"]]
+        job["transform_family"] = get_transform_family_from_model_name(
+            job["model_name"]
+        )
+        job["checkpoint_hash"] = get_checkpoint_hash(
+            job["ckpt_path"],
+            autoencoder_path=job.get("load_autoencoder_from")
+            if job["experiment_name"] == TLPredictorExperiment.__name__
+            else None,
+        )
+    return jobs
+
+
+def group_jobs(jobs):
+    """jobs that can share the decoded test batches"""
+    groups = defaultdict(list)
+    for job in jobs:
+        key = (
+            job["transform_family"],
+            job["testpaths"],
+            job["image_size"],
+            job["res"],
+        )
+        groups[key].append(job)
+    return groups
+
+
+def load_model_module(job, args) -> pl.LightningModule:
+    """build the experiment module of the job and restore its checkpoint"""
+    return load_experiment(
+        job["model_name"],
+        job["ckpt_path"],
+        job["image_size"],
+        label_format=args.label_format,
+        patch_size=job.get("patch_size"),
+        load_autoencoder_from=job.get("load_autoencoder_from"),
+        channels_last=args.channels_last,
+    )
+
+
+class MultiCheckpointExperiment(pl.LightningModule):
+    """experiment modules of a job group, every module predicts each batch"""
+
+    def __init__(self, model_modules) -> None:
+        super().__init__()
+        self.model_modules = nn.ModuleList(model_modules)
+
+    def setup(self, stage=None) -> None:
+        for model_module in self.model_modules:
+            model_module.setup(stage)
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):
+        # the modules of a group share the batch transfer options e.g. channels_last
+        return self.model_modules[0].on_after_batch_transfer(batch, dataloader_idx)
+
+    def predict_step(self, batch, batch_idx: int, dataloader_idx=None):
+        return [
+            model_module.predict_step(batch, batch_idx, dataloader_idx)
+            for model_module in self.model_modules
+        ]
+
+
+class MultiCheckpointWriter(BasePredictionWriter):
+    """hand the prediction of each module to the writers of its job"""
+
+    def __init__(self, callbacks) -> None:
+        super().__init__("batch")
+        self.callbacks = callbacks
+
+    def write_on_batch_end(
+        self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx
+    ) -> None:
+        for model_module, job_prediction, job_callbacks in zip(
+            pl_module.model_modules, prediction, self.callbacks
+        ):
+            for callback in job_callbacks:
+                callback.write_on_batch_end(
+                    trainer, model_module, job_prediction, batch_indices, batch, batch_idx, dataloader_idx
+                )
+
+    def on_predict_end(self, trainer, pl_module) -> None:
+        for model_module, job_callbacks in zip(pl_module.model_modules, self.callbacks):
+            for callback in job_callbacks:
+                callback.on_predict_end(trainer, model_module)
+
+
+def get_prediction_writer(job, args, save_gt=True):
+    """nifti or packed mask stores, as in `evaluate.py`"""
+    if args.prediction_format == "packed":
+        return PackedPredictionWriter(
+            output_dir=job["output_path"],
+            write_interval="batch",
+            save_gt=save_gt,
+            gt_store_dir=get_gt_store_dir(
+                args.gt_store_dir, job["testpaths"], job["image_size"], job["res"]
+            )
+            if args.gt_store_dir
+            else None,
+            image_size=job["image_size"],
+            resolution=job["res"],
+            source={"testpaths": job["testpaths"], "ckpt_path": job["ckpt_path"]},
+            num_workers=args.writer_workers,
+        )
+    return NiftiPredictionWriter(
+        output_dir=job["output_path"],
+        write_interval="batch",
+        image_size=job["image_size"],
+        resolution=job["res"],
+        num_workers=args.writer_workers,
+    )
+
+
+def get_callbacks(job, args, save_gt=True):
+    """same prediction writers as `evaluate.py`"""
+    return [
+        get_prediction_writer(job, args, save_gt),
+        MetricsLogger(
+            output_dir=job["output_path"],
+            voxel_spacing=job["res"],
+            nsd_tolerance=args.nsd_tolerance,
+            metrics_backend=args.metrics_backend,
+            num_workers=args.writer_workers,
+            checkpoint_hash=job["checkpoint_hash"],
+            resume=args.resume,
+            columnar_writer=get_parquet_metrics_writer(
+                args.parquet_dir,
+                job["ckpt_path"],
+                job["output_path"],
+                anatomy=get_anatomy_from_path(job["testpaths"]),
+                model=job["model_name"],
+                tag=args.results_tag,
+            )
+            if args.parquet_dir
+            else None,
+        ),
+    ]
+
+
+def evaluate_group(key, jobs, args):
+    """decode the test set once, run every checkpoint of the group on each batch"""
+    transform_family, testpaths, image_size, res = key
+    # noisy labels are sampled on every pass, they are not cached
+    cache_dir = None if transform_family == "denoising_autoencoder" else args.cache_dir
+    # subjects scored by every job of the group are skipped,
+    # each metric logger skips the subjects it has already scored
+    scored_subjects = (
+        set.intersection(
+            *[
+                get_scored_subjects(
+                    Path(job["output_path"]) / METRIC_LOG_FILENAME, job["checkpoint_hash"]
+                )
+                for job in jobs
+            ]
+        )
+        if args.resume
+        else set()
+    )
+    test_loader = DataLoader(
+        get_dataset(
+            testpaths,
+            transforms=get_transform_from_model_name(
+                jobs[0]["model_name"],
+                image_size=image_size,
+                resolution=res,
+                lazy_kasten=args.lazy_kasten,
+                label_format=args.label_format,
+            ),
+            cache_dir=cache_dir,
+            transform_params={
+                "size": image_size,
+                "resolution": res,
+                "family": transform_family,
+                "lazy_kasten": args.lazy_kasten,
+                "label_format": args.label_format,
+            },
+            label_format=args.label_format,
+            exclude_subjects=scored_subjects,
+        ),
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        shuffle=False,
+        drop_last=False,
+    )
+    if len(test_loader.dataset) == 0:
+        print(f"all subjects of {testpaths} are already scored")
+        return
+    model_module = MultiCheckpointExperiment([load_model_module(job, args) for job in jobs])
+    # with a shared groundtruth store, the first job of the group writes it
+    callbacks = [
+        get_callbacks(job, args, save_gt=index == 0 or args.gt_store_dir is None)
+        for index, job in enumerate(jobs)
+    ]
+    trainer = pl.Trainer(
+        callbacks=[MultiCheckpointWriter(callbacks)],
+        accelerator=args.accelerator,
+        devices=args.devices,
+        precision=get_trainer_precision(args.precision),
+        logger=False,
+        enable_progress_bar=False,
+    )
+
+    start = time.perf_counter()
+    trainer.predict(model=model_module, dataloaders=test_loader, return_predictions=False)
+    print(
+        f"{testpaths} ({transform_family}, size {image_size}, res {res}): "
+        f"{len(jobs)} checkpoints in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    args = parse_evaluation_arguments()
+    if args.resume and args.prediction_format == "packed":
+        raise ValueError("--resume keeps nifti predictions of scored subjects, use --prediction_format nifti")
+    args.devices = 1 if args.accelerator == "cpu" else [args.gpu]
+    job_groups = group_jobs(read_manifest(args.manifest, args.ckpt_type))
+    print(f"{sum(len(g) for g in job_groups.values())} jobs in {len(job_groups)} groups")
+    for group_key, group in job_groups.items():
+        evaluate_group(group_key, group, args)
+    peak_rss = get_peak_rss_megabytes()
+    print(
+        f"peak host memory {peak_rss['main']:.0f} MB main process, "
+        f"{peak_rss['workers']:.0f} MB dataloader workers"
+    )
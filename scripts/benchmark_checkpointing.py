@@ -0,0 +1,122 @@
+"""
+memory/speed trade-off of activation checkpointing in the 3D decoders.
+for every model, volume size, batch size and number of checkpoint segments,
+reports the peak cuda memory and the time of a training step (forward + backward)
+on random inputs. configurations that run out of memory are reported as such.
+    python scripts/benchmark_checkpointing.py --models TwoDPermuteConcat OneDConcat MultiScale2DPermuteConcat --sizes 128 160 --batch_sizes 2 4 8 --segments 0 2 4 --output_json checkpointing-benchmark.json
+"""
+import argparse
+import json
+import time
+from itertools import product
+
+import torch
+
+from XrayTo3DShape import get_model
+
+# models taking a pair of AP and LAT images, the others take a volume
+PARALLEL_HEAD_MODELS = (
+    "OneDConcat",
+    "OneDConcatModel",
+    "TwoDPermuteConcat",
+    "TwoDPermuteConcatModel",
+    "MultiScale2DPermuteConcat",
+)
+VOLUME_CHANNELS = {"SwinUNETR": 2, "CustomAutoEncoder": 1}
+
+
+def get_random_inputs(model_name, size, batch_size, device):
+    """model inputs of the given volume size"""
+    if model_name in PARALLEL_HEAD_MODELS:
+        return [torch.rand(batch_size, 1, size, size, device=device) for _ in range(2)]
+    return [torch.rand(batch_size, VOLUME_CHANNELS[model_name], size, size, size, device=device)]
+
+
+def time_training_step(model, inputs, num_steps):
+    """peak memory and mean seconds of forward + backward"""
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        output = model(*inputs)
+        if isinstance(output, tuple):  # autoencoder returns logits and latent vector
+            output = output[0]
+        output.float().mean().backward()
+        optimizer.step()
+
+    step()  # warm-up: cudnn autotuning, allocator
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        step()
+    torch.cuda.synchronize()
+    return {
+        "seconds_per_step": (time.perf_counter() - start) / num_steps,
+        "peak_memory_mb": torch.cuda.max_memory_allocated() / 2**20,
+    }
+
+
+def benchmark(model_name, size, batch_size, segments, num_steps, device):
+    result = {
+        "model_name": model_name,
+        "size": size,
+        "batch_size": batch_size,
+        "checkpoint_segments": segments,
+    }
+    try:
+        model = get_model(model_name, image_size=size, checkpoint_segments=segments)
+    except ValueError as error:  # e.g. image size not supported by the model config
+        result["error"] = str(error)
+        return result
+    model = model.to(device).train()
+    try:
+        inputs = get_random_inputs(model_name, size, batch_size, device)
+        result.update(time_training_step(model, inputs, num_steps))
+    except RuntimeError as error:
+        if "out of memory" not in str(error):
+            raise
+        result["error"] = "out of memory"
+    finally:
+        del model
+        torch.cuda.empty_cache()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--models",
+        nargs="*",
+        default=["OneDConcat", "TwoDPermuteConcat", "MultiScale2DPermuteConcat", "CustomAutoEncoder"],
+    )
+    parser.add_argument("--sizes", nargs="*", type=int, default=[128, 160])
+    parser.add_argument("--batch_sizes", nargs="*", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--segments", nargs="*", type=int, default=[0, 2, 4])
+    parser.add_argument("--num_steps", default=5, type=int)
+    parser.add_argument("--gpu", default=0, type=int)
+    parser.add_argument("--output_json", default=None)
+    args = parser.parse_args()
+
+    device = torch.device(f"cuda:{args.gpu}")
+    report = {
+        "torch": torch.__version__,
+        "device": torch.cuda.get_device_name(device),
+        "args": vars(args),
+        "results": [],
+    }
+    for model_name, size, batch_size, segments in product(
+        args.models, args.sizes, args.batch_sizes, args.segments
+    ):
+        result = benchmark(model_name, size, batch_size, segments, args.num_steps, device)
+        report["results"].append(result)
+        summary = (
+            result["error"]
+            if "error" in result
+            else f"{result['peak_memory_mb']:9.0f} MB {result['seconds_per_step'] * 1000:8.1f} ms/step"
+        )
+        print(f"{model_name:28s} size {size:3d} batch {batch_size:3d} segments {segments:2d} {summary}")
+
+    if args.output_json:
+        with open(args.output_json, "w") as fp:
+            json.dump(report, fp, indent=4)
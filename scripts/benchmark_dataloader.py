@@ -0,0 +1,270 @@
+"""
+measure dataloader throughput per transform family, image size, num_workers,
+batch size and segmentation label format. also reports per-stage transform
+timings (decode, Spacing, Orientation, Resize, ...), collate time, worker
+utilisation and peak RSS, and writes everything to json so that regressions
+can be tracked across versions. each loader configuration runs in its own
+process and the dataloader workers are sampled while they run, so peak RSS of the
+main process and of the largest worker is per configuration.
+    python scripts/benchmark_dataloader.py configs/paths/totalsegmentator_ribs/TotalSegmentor-ribs-DRR-full_test.csv --res 1.0 --families kasten nonkasten --sizes 64 128 --num_workers 0 4 8 --batch_sizes 8 --output_json dataloader-benchmark.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import time
+from collections import defaultdict
+from itertools import product
+
+import monai
+import numpy as np
+import pandas as pd
+import torch
+from monai.transforms.compose import Compose
+from monai.transforms.transform import apply_transform
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data._utils.collate import default_collate
+
+from XrayTo3DShape import (
+    LABEL_FORMATS,
+    BaseDataset,
+    get_dataset,
+    get_denoising_autoencoder_transforms,
+    get_kasten_transforms,
+    get_nonkasten_transforms,
+    get_peak_rss_megabytes,
+)
+
+TRANSFORM_FAMILIES = ("kasten", "nonkasten", "denoising_autoencoder")
+
+
+def get_transforms(family, size, resolution, label_format="float32"):
+    """ap,lat,seg transforms of the transform family"""
+    if family == "kasten":
+        return get_kasten_transforms(size, resolution, label_format=label_format)
+    if family == "nonkasten":
+        return get_nonkasten_transforms(size, resolution, label_format=label_format)
+    if family == "denoising_autoencoder":
+        return get_denoising_autoencoder_transforms(size, resolution)
+    raise ValueError(f"transform family should be one of {TRANSFORM_FAMILIES}, got {family}")
+
+
+class TimedDataset(Dataset):
+    """record the time spent inside `__getitem__` across dataloader workers"""
+
+    def __init__(self, dataset: Dataset) -> None:
+        super().__init__()
+        self.dataset = dataset
+        self.busy_seconds = multiprocessing.Value("d", 0.0)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        item = self.dataset[index]
+        with self.busy_seconds.get_lock():
+            self.busy_seconds.value += time.perf_counter() - start
+        return item
+
+
+def time_transform_stages(transforms, data, num_samples):
+    """mean seconds per sample spent in each transform of the ap, lat, seg pipelines"""
+    stage_seconds = defaultdict(float)
+    for data_i in data[:num_samples]:
+        for key, transform in transforms.items():
+            stages = transform.transforms if isinstance(transform, Compose) else [transform]
+            item = data_i
+            for stage in stages:
+                start = time.perf_counter()
+                item = apply_transform(stage, item)
+                stage_name = getattr(stage, "__name__", type(stage).__name__)
+                stage_seconds[f"{key}/{stage_name}"] += time.perf_counter() - start
+    num_samples = min(num_samples, len(data))
+    return {stage: seconds / num_samples for stage, seconds in stage_seconds.items()}
+
+
+def time_collate(dataset, batch_size, num_batches):
+    """mean seconds to collate a batch of transformed samples"""
+    samples = [dataset[i % len(dataset)] for i in range(batch_size)]
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        default_collate(samples)
+    return (time.perf_counter() - start) / num_batches
+
+
+def get_worker_peak_rss_megabytes(loader_iter) -> float:
+    """largest peak resident memory (VmHWM) of the live dataloader workers, nan where
+    /proc is not available. the `RUSAGE_CHILDREN` high-water mark is not used, it also
+    covers the processes forked while importing torch and monai"""
+    peak = 0.0
+    for worker in getattr(loader_iter, "_workers", []):
+        try:
+            with open(f"/proc/{worker.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]) / 2**10)
+        except OSError:
+            return float("nan")
+    return peak
+
+
+def benchmark_loader(loader: DataLoader, num_batches: int):
+    """iterate over the dataloader and record throughput, time the main process
+    waits for batches, bytes per label and worker utilisation"""
+    dataset = loader.dataset
+    samples, label_bytes, wait_seconds, worker_rss = 0, 0, 0.0, 0.0
+    loader_iter = iter(loader)
+    next(loader_iter)  # warm-up: exclude worker startup
+    if isinstance(dataset, TimedDataset):
+        dataset.busy_seconds.value = 0.0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        wait_start = time.perf_counter()
+        try:
+            _, _, seg = next(loader_iter)
+        except StopIteration:
+            break
+        wait_seconds += time.perf_counter() - wait_start
+        # the denoising autoencoder returns clean and noisy labels
+        labels = seg["seg"] if "seg" in seg else seg["orig"]
+        samples += len(labels)
+        label_bytes += labels.element_size() * labels.nelement()
+        # sampled while the workers are alive, they exit with the last batch
+        worker_rss = max(worker_rss, get_worker_peak_rss_megabytes(loader_iter))
+    elapsed = time.perf_counter() - start
+    result = {
+        "samples": samples,
+        "seconds": elapsed,
+        "samples_per_sec": samples / elapsed if elapsed > 0 else float("nan"),
+        "main_process_wait_fraction": wait_seconds / elapsed if elapsed > 0 else float("nan"),
+        "label_megabytes_per_sample": label_bytes / max(samples, 1) / 2**20,
+        "peak_rss_megabytes": {"main": get_peak_rss_megabytes()["main"], "workers": worker_rss},
+    }
+    if isinstance(dataset, TimedDataset):
+        # with num_workers=0 the main process is the only worker
+        num_workers = max(loader.num_workers, 1)
+        result["worker_utilisation"] = dataset.busy_seconds.value / (num_workers * elapsed)
+    return result
+
+
+def run_config(config, queue):
+    """benchmark one loader configuration in a fresh process so that the peak RSS
+    of the main process belongs to this configuration"""
+    # start the dataloader workers as in training, not with the spawn method of this process
+    multiprocessing.set_start_method(config["start_method"], force=True)
+    transforms = get_transforms(
+        config["family"], config["size"], config["resolution"], config["label_format"]
+    )
+    dataset = get_dataset(config["filepaths"], transforms, label_format=config["label_format"])
+    loader = DataLoader(
+        TimedDataset(dataset),
+        batch_size=config["batch_size"],
+        num_workers=config["num_workers"],
+        shuffle=False,
+        pin_memory=torch.cuda.is_available(),
+    )
+    result = benchmark_loader(loader, config["num_batches"])
+    paths = pd.read_csv(config["filepaths"], index_col=0).to_numpy()
+    data = [{"ap": ap, "lat": lat, "seg": seg} for ap, lat, seg in paths]
+    result["collate_seconds_per_batch"] = time_collate(
+        BaseDataset(data, transforms), config["batch_size"], num_batches=3
+    )
+    queue.put(result)
+
+
+def benchmark_config(config):
+    """run `run_config` in a spawned process and return its result"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    config = dict(config, start_method=multiprocessing.get_start_method())
+    process = context.Process(target=run_config, args=(config, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"benchmark of {config} failed with exit code {process.exitcode}")
+    return queue.get()
+
+
+def get_environment():
+    """versions recorded alongside the results"""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "torch": torch.__version__,
+        "monai": monai.__version__,
+        "numpy": np.__version__,
+        "git_commit": commit,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filepaths")
+    parser.add_argument("--res", type=float, required=True)
+    parser.add_argument("--families", nargs="*", default=list(TRANSFORM_FAMILIES))
+    parser.add_argument("--sizes", nargs="*", type=int, default=[64, 96, 128, 288, 320])
+    parser.add_argument("--num_workers", nargs="*", type=int, default=[0, 4, 8])
+    parser.add_argument("--batch_sizes", nargs="*", type=int, default=[8])
+    parser.add_argument("--label_formats", nargs="*", default=["float32"], choices=LABEL_FORMATS)
+    parser.add_argument("--num_batches", default=20, type=int)
+    parser.add_argument("--num_stage_samples", default=8, type=int)
+    parser.add_argument("--output_json", default=None)
+    args = parser.parse_args()
+
+    paths = pd.read_csv(args.filepaths, index_col=0).to_numpy()
+    data = [{"ap": ap, "lat": lat, "seg": seg} for ap, lat, seg in paths]
+
+    report = {"environment": get_environment(), "args": vars(args), "results": []}
+    for family, size in product(args.families, args.sizes):
+        # labels of the denoising autoencoder are always float
+        label_formats = ["float32"] if family == "denoising_autoencoder" else args.label_formats
+        for label_format in label_formats:
+            transforms = get_transforms(family, size, args.res, label_format)
+            stages = time_transform_stages(transforms, data, args.num_stage_samples)
+            print(f"{family} size {size} {label_format}")
+            for stage, seconds in stages.items():
+                print(f"    {stage:40s} {seconds * 1000:8.1f} ms/sample")
+            for num_workers, batch_size in product(args.num_workers, args.batch_sizes):
+                config = dict(
+                    filepaths=args.filepaths,
+                    family=family,
+                    size=size,
+                    resolution=args.res,
+                    label_format=label_format,
+                    num_workers=num_workers,
+                    batch_size=batch_size,
+                    num_batches=args.num_batches,
+                )
+                result = benchmark_config(config)
+                result.update(
+                    family=family,
+                    size=size,
+                    resolution=args.res,
+                    label_format=label_format,
+                    num_workers=num_workers,
+                    batch_size=batch_size,
+                    stage_seconds_per_sample=stages,
+                )
+                report["results"].append(result)
+                print(
+                    f"    workers {num_workers:2d} batch {batch_size:3d} "
+                    f"{result['samples_per_sec']:8.2f} samples/sec "
+                    f"utilisation {result['worker_utilisation']:5.2f} "
+                    f"collate {result['collate_seconds_per_batch'] * 1000:7.1f} ms "
+                    f"{result['label_megabytes_per_sample']:8.2f} MB label/sample "
+                    f"peak rss {result['peak_rss_megabytes']['main']:.0f}/"
+                    f"{result['peak_rss_megabytes']['workers']:.0f} MB"
+                )
+
+    if args.output_json:
+        with open(args.output_json, "w") as fp:
+            json.dump(report, fp, indent=4)
@@ -0,0 +1,46 @@
+"""
+compare step time of HausdorffDTLoss with torch and scipy distance fields
+    python scripts/benchmark_hausdorff_loss.py --sizes 64 96 128 --batch_size 4
+"""
+import argparse
+import time
+
+import torch
+
+from XrayTo3DShape import HausdorffDTLoss
+
+
+def time_loss_step(loss_function, pred_logits, target, num_steps):
+    """forward + backward of the loss, averaged over steps"""
+    timings = []
+    for step in range(num_steps + 1):
+        if pred_logits.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        loss = loss_function(torch.sigmoid(pred_logits), target)
+        loss.backward()
+        if pred_logits.is_cuda:
+            torch.cuda.synchronize()
+        if step > 0:  # warm-up
+            timings.append(time.perf_counter() - start)
+        pred_logits.grad = None
+    return sum(timings) / len(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="*", type=int, default=[64, 96, 128])
+    parser.add_argument("--batch_size", default=4, type=int)
+    parser.add_argument("--num_steps", default=5, type=int)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        pred_logits = torch.randn(
+            args.batch_size, 1, size, size, size, device=args.device, requires_grad=True
+        )
+        target = (torch.rand(args.batch_size, 1, size, size, size, device=args.device) > 0.9).float()
+        for backend in ("torch", "scipy"):
+            loss_function = HausdorffDTLoss(device=args.device, backend=backend)
+            seconds = time_loss_step(loss_function, pred_logits, target, args.num_steps)
+            print(f"size {size:4d} {backend:6s} {seconds * 1000:10.1f} ms/step")
@@ -0,0 +1,175 @@
+"""
+peak host memory of the prediction loop of evaluate.py (model, nifti writer and
+metrics logger on background threads) for the lean prediction record, uint8
+volumes and only the meta data the writers use, and for the previous record,
+float32 volumes and the full segmentation meta data deep-copied by the nifti writer.
+runs on the cpu with a synthetic rib-sized test set. peak memory is per process,
+so run each record in its own process:
+    for record in legacy lean; do python scripts/benchmark_prediction_memory.py --record $record --image_size 128 --res 2.5 --batch_size 8 --num_samples 64; done
+"""
+import argparse
+import copy
+import json
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+import pytorch_lightning as pl
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+
+from XrayTo3DShape import (
+    MetricsLogger,
+    NiftiPredictionWriter,
+    VolumeAsInputExperiment,
+    get_peak_rss_megabytes,
+    get_pir_affine,
+)
+
+RECORDS = ("lean", "legacy")
+
+
+class SyntheticRibDataset(Dataset):
+    """ap/lat images and a spherical shell label, with the numeric nifti
+    header fields in the meta data as loaded from disk"""
+
+    def __init__(self, num_samples: int, size: int, resolution: float) -> None:
+        super().__init__()
+        self.num_samples = num_samples
+        self.size = size
+        grid = np.linspace(-1, 1, size, dtype=np.float32)
+        radius = np.sqrt(sum(np.square(x) for x in np.meshgrid(grid, grid, grid, indexing="ij")))
+        self.label = ((radius > 0.6) & (radius < 0.7)).astype(np.float32)[None]
+        header = nib.Nifti1Header()
+        header.set_data_shape((size, size, size))
+        header.set_zooms((resolution,) * 3)
+        self.header = {
+            key: np.asarray(value)
+            for key, value in header.items()
+            if np.asarray(value).dtype.kind in "biuf"
+        }
+        self.affine = get_pir_affine(resolution).astype(np.float64)
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __getitem__(self, index):
+        rng = np.random.default_rng(index)
+        meta_dict = {
+            **self.header,
+            "filename_or_obj": f"rib{index:04d}_msk.nii.gz",
+            "affine": self.affine,
+            "original_affine": self.affine,
+            "spatial_shape": np.asarray([self.size] * 3),
+        }
+        return (
+            {"ap": rng.random((1, self.size, self.size), dtype=np.float32)},
+            {"lat": rng.random((1, self.size, self.size), dtype=np.float32)},
+            {"seg": self.label, "seg_meta_dict": meta_dict},
+        )
+
+
+class LegacyRecordExperiment(VolumeAsInputExperiment):
+    """float32 prediction record with the meta data of the whole batch"""
+
+    def predict_step(self, batch, batch_idx, dataloader_idx=None):
+        batch_input, output = self.get_input_output_from_batch(batch)
+        return {
+            "pred": self.predict_segmentation(batch_input),
+            "gt": output,
+            "seg_meta_dict": self.get_segmentation_meta_dict(batch),
+        }
+
+
+class LegacyNiftiPredictionWriter(NiftiPredictionWriter):
+    """deep-copies the meta data of every batch before rewriting the affine"""
+
+    def write_on_batch_end(
+        self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx
+    ):
+        original_meta_dict = prediction["seg_meta_dict"]
+        batch_size = len(original_meta_dict["filename_or_obj"])
+        metadict = copy.deepcopy(original_meta_dict)
+        metadict["spatial_shape"] = torch.tensor([[self.image_size] * 3] * batch_size)
+        metadict["space"] = ["PIL"] * batch_size
+        metadict["affine"] = torch.from_numpy(
+            np.stack([get_pir_affine(self.resolution)] * batch_size)
+        )
+        metadict["affine"][:, :, -1] = torch.as_tensor(original_meta_dict["affine"][:, :, -1])
+        self.worker_pool.submit(self.save_batch, prediction["pred"], prediction["gt"], metadict)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", choices=RECORDS, required=True)
+    parser.add_argument("--image_size", default=128, type=int)
+    parser.add_argument("--res", default=2.5, type=float)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--num_samples", default=64, type=int)
+    parser.add_argument("--num_workers", default=0, type=int)
+    parser.add_argument("--writer_workers", default=2, type=int)
+    parser.add_argument("--output_json", default=None)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    loader = DataLoader(
+        SyntheticRibDataset(args.num_samples, args.image_size, args.res),
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        shuffle=False,
+    )
+    experiment_class = (
+        LegacyRecordExperiment if args.record == "legacy" else VolumeAsInputExperiment
+    )
+    writer_class = (
+        LegacyNiftiPredictionWriter if args.record == "legacy" else NiftiPredictionWriter
+    )
+    model_module = experiment_class(model=nn.Conv3d(2, 1, kernel_size=1))
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        callbacks = [
+            writer_class(
+                output_dir=output_dir,
+                image_size=args.image_size,
+                resolution=args.res,
+                num_workers=args.writer_workers,
+            ),
+            MetricsLogger(
+                output_dir=output_dir,
+                voxel_spacing=args.res,
+                num_workers=args.writer_workers,
+            ),
+        ]
+        trainer = pl.Trainer(
+            callbacks=callbacks,
+            accelerator="cpu",
+            devices=1,
+            logger=False,
+            enable_progress_bar=False,
+            enable_model_summary=False,
+        )
+        # memory of the imports, model and dataset before the prediction loop
+        baseline_rss = get_peak_rss_megabytes()["main"]
+        start = time.perf_counter()
+        trainer.predict(model=model_module, dataloaders=loader, return_predictions=False)
+        elapsed = time.perf_counter() - start
+    peak_rss = get_peak_rss_megabytes()
+
+    result = {
+        "record": args.record,
+        "args": vars(args),
+        "seconds": elapsed,
+        "baseline_rss_megabytes": baseline_rss,
+        "peak_rss_megabytes": peak_rss,
+        "prediction_loop_megabytes": peak_rss["main"] - baseline_rss,
+    }
+    print(
+        f"{args.record:6s} record: peak host memory {peak_rss['main']:.0f} MB main process "
+        f"({result['prediction_loop_megabytes']:.0f} MB above the {baseline_rss:.0f} MB baseline), "
+        f"{peak_rss['workers']:.0f} MB dataloader workers, {elapsed:.1f} s"
+    )
+    if args.output_json:
+        with open(args.output_json, "w") as fp:
+            json.dump(result, fp, indent=4)
@@ -1,11 +1,14 @@
 import json
 import sys
-import numpy as np
+from pathlib import Path
 
-import pandas as pd
-
-import wandb
-from XrayTo3DShape import filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import (
+    filter_runs,
+    load_metric_logs,
+    load_results_index,
+    select_run_per_model,
+    summarize_metrics,
+)
 
 if __name__ == "__main__":
     import argparse
@@ -17,6 +20,21 @@ if __name__ == "__main__":
     parser.add_argument('--patch',default=False,action='store_true')
     parser.add_argument("--tags", nargs="*")
     parser.add_argument("--save_json", default=False, action="store_true")
+    parser.add_argument(
+        "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+    )
+    parser.add_argument("--wandb_dir", default="runs/wandb")
+    parser.add_argument(
+        "--wandb_project",
+        default=None,
+        help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+    )
+    parser.add_argument("--rebuild_index", default=False, action="store_true")
+    parser.add_argument(
+        "--parquet_dir",
+        default=None,
+        help="read full precision metrics written by evaluate.py --parquet_dir, csv logs otherwise",
+    )
     args = parser.parse_args()
 
     print(args)
@@ -26,13 +44,18 @@ if __name__ == "__main__":
         subdir = 'combined_patches'
     else:
         subdir = "evaluation"
-    EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/{subdir}/metric-log.csv"
+    EVAL_LOG_CSV_PATH_TEMPLATE = args.runs_dir + "/{run_id}/{subdir}/metric-log.csv"
 
-    # extract wandb runs
-    wandb.login()
-    runs = filter_wandb_run(anatomy=args.anatomy, tags=args.tags, verbose=True)
-    for r in runs:
-        print(r.id, r.config["MODEL_NAME"])
+    # runs from the local results index
+    index = load_results_index(
+        args.runs_dir,
+        args.wandb_dir,
+        wandb_project=args.wandb_project,
+        rebuild=args.rebuild_index,
+    )
+    runs = filter_runs(index, anatomy=args.anatomy, tags=args.tags)
+    for run_id, run in runs.items():
+        print(run_id, run["model_name"])
 
     if len(runs) == 0:
         print(f"found {len(runs)} wandb runs for anatomy {args.anatomy}. exiting ...")
@@ -63,36 +86,44 @@ if __name__ == "__main__":
     }
     latex_table_row_template = r" & {model_name} & {model_size} & {DSC:.2f}  & {HD95:.2f} & {ASD:.2f}  & {NSD:.2f} \\"  # make this a raw string so that two backslashes \\ are not escaped and printed as is
 
+    run_per_model = select_run_per_model(runs)
+    # we did something stupid so have to hard code here (deleted the run-id in wandb, never delete runs in wandb again)
+    if args.anatomy == "vertebra":
+        run_id = "e9y5hclj"
+        run_per_model["TwoDPermuteConcat"] = run_id
+        csv_filename = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run_id, subdir=subdir)
+        index.setdefault(
+            run_id,
+            {
+                "model_name": "TwoDPermuteConcat",
+                "anatomy": "vertebra",
+                "tags": [],
+                "created": "",
+                "metric_logs": {subdir: csv_filename} if Path(csv_filename).exists() else {},
+            },
+        )
+    # all metric logs in one table, every row of the latex table is a lookup
+    metrics = load_metric_logs(
+        index, subdir, run_ids=run_per_model.values(), parquet_dir=args.parquet_dir
+    )
+    model_means = summarize_metrics(metrics, by=["model"])
+
     latex_table = ""
     model_dsc_dict = {}
     for model in MODEL_NAMES:
         print(model)
-        try:
-            # we did something stupid so have to hard code here (deleted the run-id in wandb, never delete runs in wandb again)
-            if args.anatomy == 'vertebra' and model == 'TwoDPermuteConcat':
-                run_id = 'e9y5hclj'
-                csv_filename = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id = run_id, subdir=subdir)
-            else:
-                run = get_run_from_model_name(model, runs)
-                # read metric log csv
-                csv_filename = EVAL_LOG_CSV_PATH_TEMPLATE.format(
-                    run_id=run.id, subdir=subdir
-                )
-
-
-            print(f"reading {csv_filename}")
-            df = pd.read_csv(csv_filename)
-            df.replace([np.inf,-np.inf],np.nan,inplace=True) # replace inf with nan so that they can be dropped when aggregating later
+        if model in model_means.index:
+            means = model_means.loc[model]
             latex_table += latex_table_row_template.format(
                 model_name=model,
-                DSC=df.mean(numeric_only=True,skipna=True).DSC * 100,
-                HD95=df.mean(numeric_only=True,skipna=True).HD95,
-                ASD=df.mean(numeric_only=True,skipna=True).ASD,
-                NSD=df.mean(numeric_only=True,skipna=True).NSD,
+                DSC=means.DSC * 100,
+                HD95=means.HD95,
+                ASD=means.ASD,
+                NSD=means.NSD,
                 model_size=model_sizes[model],
             )
-            model_dsc_dict[model] = df.mean(numeric_only=True).DSC
-        except (ValueError, FileNotFoundError) as e:
+            model_dsc_dict[model] = means.DSC
+        else:
             latex_table += latex_table_row_template.format(
                 model_name=model,
                 DSC=float("nan"),
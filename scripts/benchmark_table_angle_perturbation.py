@@ -1,11 +1,12 @@
 import json
 import sys
+from pathlib import Path
+
 import numpy as np
 
 import pandas as pd
 
-import wandb
-from XrayTo3DShape import filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import filter_runs, load_results_index, select_run_per_model
 
 if __name__ == "__main__":
     import argparse
@@ -14,18 +15,33 @@ if __name__ == "__main__":
     parser.add_argument("--anatomy", required=True)
     parser.add_argument("--tags", nargs="*")
     parser.add_argument("--save_json", default=False, action="store_true")
+    parser.add_argument(
+        "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+    )
+    parser.add_argument("--wandb_dir", default="runs/wandb")
+    parser.add_argument(
+        "--wandb_project",
+        default=None,
+        help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+    )
+    parser.add_argument("--rebuild_index", default=False, action="store_true")
     args = parser.parse_args()
 
     print(args)
     subdir = "angle_perturbation"
-    EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/angle_perturbation/{angle_perturbation}/metric-log.csv"
-    EVAL_LOG_NORMAL_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/evaluation/metric-log.csv"
-    # extract wandb runs
-    wandb.login()
-
-    runs = filter_wandb_run(anatomy=args.anatomy, tags=args.tags, verbose=True)
-    for r in runs:
-        print(r.id, r.config["MODEL_NAME"])
+    EVAL_LOG_CSV_PATH_TEMPLATE = args.runs_dir + "/{run_id}/angle_perturbation/{angle_perturbation}/metric-log.csv"
+    EVAL_LOG_NORMAL_CSV_PATH_TEMPLATE = args.runs_dir + "/{run_id}/evaluation/metric-log.csv"
+    # runs from the local results index
+    index = load_results_index(
+        args.runs_dir,
+        args.wandb_dir,
+        wandb_project=args.wandb_project,
+        rebuild=args.rebuild_index,
+    )
+    runs = filter_runs(index, anatomy=args.anatomy, tags=args.tags)
+    for run_id, run in runs.items():
+        print(run_id, run["model_name"])
+    run_per_model = select_run_per_model(runs)
 
     if len(runs) == 0:
         print(f"found {len(runs)} wandb runs for anatomy {args.anatomy}. exiting ...")
@@ -61,9 +77,10 @@ if __name__ == "__main__":
             # we did something stupid so have to hard code here (deleted the run-id in wandb, never delete runs in wandb again)
             if args.anatomy == 'vertebra' and model == 'TwoDPermuteConcat':
                 run_id = 'e9y5hclj'
+            elif model in run_per_model:
+                run_id = run_per_model[model]
             else:
-                run = get_run_from_model_name(model, runs)
-                run_id = run.id
+                raise ValueError(f"no run of {model} found for anatomy {args.anatomy}")
             model_name=model
             # read non-perturbed metric log csv
             normal_csv_filename =EVAL_LOG_NORMAL_CSV_PATH_TEMPLATE.format(run_id=run_id)
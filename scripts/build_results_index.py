@@ -0,0 +1,42 @@
+"""
+build (or refresh) the local results index used by the benchmark table scripts
+and print the indexed runs
+    python scripts/build_results_index.py --runs_dir runs/2d-3d-benchmark
+    python scripts/build_results_index.py --wandb_project msrepo/2d-3d-benchmark --rebuild
+"""
+import argparse
+
+from XrayTo3DShape import filter_runs, load_results_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs_dir", default="runs/2d-3d-benchmark")
+    parser.add_argument("--wandb_dir", default="runs/wandb")
+    parser.add_argument("--cache_path", default="results/results-index.json")
+    parser.add_argument(
+        "--wandb_project",
+        default=None,
+        help="query the wandb API for runs without local metadata",
+    )
+    parser.add_argument("--rebuild", default=False, action="store_true")
+    parser.add_argument("--anatomy", default="")
+    parser.add_argument("--tags", nargs="*")
+    args = parser.parse_args()
+
+    index = load_results_index(
+        args.runs_dir,
+        args.wandb_dir,
+        cache_path=args.cache_path,
+        wandb_project=args.wandb_project,
+        rebuild=args.rebuild,
+    )
+    runs = filter_runs(index, anatomy=args.anatomy, tags=args.tags)
+    for run_id, run in sorted(runs.items(), key=lambda item: item[1]["created"]):
+        print(
+            run_id,
+            run["anatomy"],
+            run["model_name"],
+            ",".join(run["tags"]),
+            ",".join(run["metric_logs"]),
+        )
+    print(f"{len(runs)} of {len(index)} indexed runs, cached in {args.cache_path}")
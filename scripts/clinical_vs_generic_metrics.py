@@ -1,6 +1,5 @@
 import argparse
 from pathlib import Path
-import scipy as sp
 import scipy.stats as stats
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,14 +8,19 @@ import scienceplots
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score
 
-from XrayTo3DShape import MODEL_NAMES, filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import (
+    MODEL_NAMES,
+    bootstrap_indices,
+    filter_wandb_run,
+    get_run_from_model_name,
+)
 
 plt.style.use(["science", "no-latex"])
 # Increase the resolution of all the plots below
 plt.rcParams.update({"figure.dpi": 150})
 
 
-def plot_ci_bootstrap(xs, ys, resid, nboot=500, ax=None):
+def plot_ci_bootstrap(xs, ys, resid, nboot=500, ax=None, seed=None):
     """Return an axes of confidence bands using a bootstrap approach.
 
     Notes
@@ -40,14 +44,13 @@ def plot_ci_bootstrap(xs, ys, resid, nboot=500, ax=None):
     if ax is None:
         ax = plt.gca()
 
-    bootindex = sp.random.randint
-
-    for _ in range(nboot):
-        resamp_resid = resid[bootindex(0, len(resid) - 1, len(resid))]
-        # Make coeffs of for polys
-        pc = np.polyfit(xs, ys + resamp_resid, 1)
-        # Plot bootstrap cluster
-        ax.plot(xs, np.polyval(pc, xs), "b-", linewidth=2, alpha=3.0 / float(nboot))
+    rng = np.random.default_rng(seed)
+    # (len(resid), nboot): one column of resampled residuals per bootstrap
+    resamp_resid = resid[bootstrap_indices(len(resid), nboot, rng)].T
+    # Make coeffs of all polys in a single least-squares fit, (2, nboot)
+    pc = np.polyfit(xs, ys[:, None] + resamp_resid, 1)
+    # Plot bootstrap cluster
+    ax.plot(xs, np.outer(xs, pc[0]) + pc[1], "b-", linewidth=2, alpha=3.0 / float(nboot))
 
     return ax
 
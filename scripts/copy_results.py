@@ -3,26 +3,40 @@ import shutil
 import sys
 from pathlib import Path
 
-import pandas as pd
-
-import wandb
-from XrayTo3DShape import filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import (
+    METRIC_COLUMNS,
+    filter_runs,
+    load_metric_logs,
+    load_results_index,
+    select_run_per_model,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--anatomy", required=True)
 parser.add_argument("--tags", nargs="*")
+parser.add_argument(
+    "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+)
+parser.add_argument("--wandb_dir", default="runs/wandb")
+parser.add_argument(
+    "--wandb_project",
+    default=None,
+    help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+)
+parser.add_argument("--rebuild_index", default=False, action="store_true")
 args = parser.parse_args()
 
-wandb.login()
-runs = filter_wandb_run(anatomy=args.anatomy, tags=args.tags, verbose=False)
-[print(r.id, r.config["MODEL_NAME"]) for r in runs]
+index = load_results_index(
+    args.runs_dir, args.wandb_dir, wandb_project=args.wandb_project, rebuild=args.rebuild_index
+)
+runs = filter_runs(index, anatomy=args.anatomy, tags=args.tags)
+[print(run_id, run["model_name"]) for run_id, run in runs.items()]
 
 if len(runs) == 0:
     print(f"found {len(runs)} wandb runs for anatomy {args.anatomy}. exiting ...")
     sys.exit()
 
 SUBDIR = "evaluation"
-EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/{subdir}/metric-log.csv"
 OUT_LOG_CSV_PATH_TEMPLATE = (
     "results/benchmarking/{anatomy}/{tag}/{model_name}/metric-log.csv"
 )
@@ -37,32 +51,33 @@ MODEL_NAMES = [
     "TLPredictor",
 ]
 
-dataframes = []
-for model in MODEL_NAMES:
-    try:
-        run = get_run_from_model_name(model, runs)
-        eval_logfile = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id, subdir=SUBDIR)
-        if Path(eval_logfile).exists():
-            print(eval_logfile)
-            # copy to results directory
-            out_logfile = OUT_LOG_CSV_PATH_TEMPLATE.format(
-                anatomy=args.anatomy, tag=args.tags[0], model_name=model
-            )
-            print(Path(out_logfile))
-            Path(out_logfile).parent.mkdir(exist_ok=True, parents=True)
-            shutil.copy(eval_logfile, out_logfile)
-            # read csv
-            df = pd.read_csv(eval_logfile)
-            dataframes.append(df)
-            df["model"] = model
-    except ValueError as e:
-        pass
+run_per_model = {
+    model: run_id
+    for model, run_id in select_run_per_model(runs).items()
+    if model in MODEL_NAMES
+}
+for model, run_id in run_per_model.items():
+    eval_logfile = index[run_id]["metric_logs"].get(SUBDIR)
+    if eval_logfile is None:
+        continue
+    print(eval_logfile)
+    # copy to results directory
+    out_logfile = OUT_LOG_CSV_PATH_TEMPLATE.format(
+        anatomy=args.anatomy, tag=args.tags[0], model_name=model
+    )
+    print(Path(out_logfile))
+    Path(out_logfile).parent.mkdir(exist_ok=True, parents=True)
+    shutil.copy(eval_logfile, out_logfile)
 
-# save into a single csv
+# save into a single csv, read in parallel
+merged_df = load_metric_logs(
+    index, SUBDIR, run_ids=run_per_model.values(), inf_as_nan=False
+)
 MERGED_DF_FILENAME_TEMPLATE = "results/challengeR/{anatomy}/{tag}/metric-log.csv"
 merged_df_out_file = MERGED_DF_FILENAME_TEMPLATE.format(
     anatomy=args.anatomy, tag=args.tags[0]
 )
 Path(merged_df_out_file).parent.mkdir(parents=True, exist_ok=True)
-merged_df = pd.concat(dataframes, join="inner").sort_index()
-merged_df.to_csv(merged_df_out_file, header=True, index=False)
+merged_df[["subject-id", *METRIC_COLUMNS, "model"]].to_csv(
+    merged_df_out_file, header=True, index=False
+)
@@ -2,35 +2,31 @@
 import sys
 from pathlib import Path
 
-import pandas as pd
-
-import wandb
 from XrayTo3DShape import (
     MODEL_NAMES,
     VerseExcelSheet,
     VerseKeys,
-    filter_wandb_run,
-    get_run_from_model_name,
+    filter_runs,
+    load_metric_logs,
+    load_results_index,
+    select_run_per_model,
 )
 
 
-def get_shape(row):
-    """shape lambda"""
-    return verse_metadata.get_shape(verse_metadata.get_vertebra_keys(row["subject-id"]))
-
-
-def get_severity(row):
-    """severity lambda"""
-    return verse_metadata.get_severity(
-        verse_metadata.get_vertebra_keys(row["subject-id"])
-    )
-
-
-def get_vertebra_level(row):
-    """vertebra level"""
-    return verse_metadata.get_vertebra_level(
-        verse_metadata.get_vertebra_keys(row["subject-id"])
-    )
+def print_disaggregation(table, column, categories):
+    """one latex row per model: mean of each metric per category of `column`"""
+    means = table.groupby(["model", column], observed=True)[["DSC", "HD95", "NSD"]].mean()
+    for model in MODEL_NAMES:
+        if model not in means.index.get_level_values("model"):
+            continue
+        model_means = means.loc[model]
+        row = f"{model:20s}"
+        for metric_type in ["DSC", "HD95", "NSD"]:
+            for category in categories:
+                row += f"& {model_means[metric_type].get(category, float('nan')):5.2f}"
+        row += r"\\"  # latex new line
+        print(row)
+    print("\n")
 
 
 if __name__ == "__main__":
@@ -39,98 +35,71 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--anatomy", required=True)
     parser.add_argument("--tags", nargs="*")
+    parser.add_argument(
+        "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+    )
+    parser.add_argument("--wandb_dir", default="runs/wandb")
+    parser.add_argument(
+        "--wandb_project",
+        default=None,
+        help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+    )
+    parser.add_argument("--rebuild_index", default=False, action="store_true")
+    parser.add_argument(
+        "--parquet_dir",
+        default=None,
+        help="read full precision metrics written by evaluate.py --parquet_dir, csv logs otherwise",
+    )
+    parser.add_argument("--metadata", default="metadata/ryai190138_appendixe1.xlsx")
     args = parser.parse_args()
 
-    EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/evaluation/metric-log.csv"
-
-    verse_metadata = VerseExcelSheet()
-    # extract wandb runs
-    wandb.login()
-    runs = filter_wandb_run(anatomy=args.anatomy, tags=args.tags, verbose=False)
+    # parsed once, later runs read the cached metadata table
+    verse_metadata = VerseExcelSheet(args.metadata)
+    index = load_results_index(
+        args.runs_dir,
+        args.wandb_dir,
+        wandb_project=args.wandb_project,
+        rebuild=args.rebuild_index,
+    )
+    runs = filter_runs(index, anatomy=args.anatomy, tags=args.tags)
 
     print(f"found {len(runs)} wandb runs")
     if len(runs) == 0:
         print(f"found {len(runs)} wandb runs for anatomy {args.anatomy}. exiting ...")
         sys.exit()
-    # write additional metadata to table
-    for model in MODEL_NAMES:
-        try:
-            run = get_run_from_model_name(model, runs)
-            # read metric log csv
-            input_log = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id)
-            df = pd.read_csv(input_log)
-            df["shape"] = df.apply(get_shape, axis="columns")
-            df["severity"] = df.apply(get_severity, axis="columns")
-            df["level"] = df.apply(get_vertebra_level, axis="columns")
-            out_log = Path(input_log).with_name("metric_log_metadata.csv")
-            df.to_csv(out_log, index=False)
+    run_per_model = select_run_per_model(runs)
+
+    # metric logs of all models annotated in a single merge
+    table = load_metric_logs(
+        index,
+        "evaluation",
+        run_ids=run_per_model.values(),
+        inf_as_nan=False,
+        parquet_dir=args.parquet_dir,
+    )
+    table = verse_metadata.annotate(table)
 
-        except ValueError as e:
-            pass
+    # write additional metadata to table
+    metric_columns = ["subject-id", "DSC", "ASD", "HD95", "NSD", "shape", "severity", "level"]
+    for run_id, df in table.groupby("run_id", observed=True):
+        out_log = Path(index[run_id]["metric_logs"]["evaluation"]).with_name(
+            "metric_log_metadata.csv"
+        )
+        df[metric_columns].to_csv(out_log, index=False)
 
     # print vertebra level disaggregation
-    for model in MODEL_NAMES:
-        try:
-            run = get_run_from_model_name(model, runs)
-            input_log = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id)
-            out_log = Path(input_log).with_name("metric_log_metadata.csv")
-            df = pd.read_csv(out_log)
-            row = f"{model:20s}"
-            for metric_type in ["DSC", "HD95", "NSD"]:
-                for level_type in [
-                    VerseKeys.CERVICAL,
-                    VerseKeys.THORACIC,
-                    VerseKeys.LUMBAR,
-                ]:
-                    row += f'& {df.groupby(["level"])[metric_type].mean()[level_type]:5.2f}'
-            row += r"\\"  # latex new line
-            print(row)
-
-        except ValueError as e:
-            pass
-    print("\n")
-
+    print_disaggregation(
+        table, "level", [VerseKeys.CERVICAL, VerseKeys.THORACIC, VerseKeys.LUMBAR]
+    )
     # print vertebra shape disaggregation
-    for model in MODEL_NAMES:
-        try:
-            run = get_run_from_model_name(model, runs)
-            input_log = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id)
-            out_log = Path(input_log).with_name("metric_log_metadata.csv")
-            df = pd.read_csv(out_log)
-            row = f"{model:20s}"
-            for metric_type in ["DSC", "HD95", "NSD"]:
-                for level_type in [
-                    VerseKeys.NORMAL,
-                    VerseKeys.WEDGE,
-                    VerseKeys.BICONCAVE,
-                    VerseKeys.CRUSH,
-                ]:
-                    row += f'& {df.groupby(["shape"])[metric_type].mean()[level_type]:5.2f}'
-            row += r"\\"  # latex new line
-            print(row)
-
-        except ValueError as e:
-            pass
-    print("\n")
-
+    print_disaggregation(
+        table,
+        "shape",
+        [VerseKeys.NORMAL, VerseKeys.WEDGE, VerseKeys.BICONCAVE, VerseKeys.CRUSH],
+    )
     # print vertebra severity disaggregation
-    for model in MODEL_NAMES:
-        try:
-            run = get_run_from_model_name(model, runs)
-            input_log = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id)
-            out_log = Path(input_log).with_name("metric_log_metadata.csv")
-            df = pd.read_csv(out_log)
-            row = f"{model:20s}"
-            for metric_type in ["DSC", "HD95", "NSD"]:
-                for level_type in [
-                    VerseKeys.NORMAL,
-                    VerseKeys.MILD,
-                    VerseKeys.MODERATE,
-                    VerseKeys.SEVERE,
-                ]:
-                    row += f'& {df.groupby(["severity"])[metric_type].mean()[level_type]:5.2f}'
-            row += r"\\"  # latex new line
-            print(row)
-        except ValueError as e:
-            pass
-    print("\n")
+    print_disaggregation(
+        table,
+        "severity",
+        [VerseKeys.NORMAL, VerseKeys.MILD, VerseKeys.MODERATE, VerseKeys.SEVERE],
+    )
@@ -0,0 +1,78 @@
+"""
+export every architecture in `MODEL_NAMES` as TorchScript and/or ONNX and check
+the outputs of the exported models against eager pytorch.
+without --checkpoint the models are exported with random weights, which is enough
+to find architectures that do not trace or export.
+    python scripts/export_models.py --image_size 128 --formats torchscript onnx --output_dir exported
+    python scripts/export_models.py --models TwoDPermuteConcat --image_size 128 --checkpoint runs/2d-3d-benchmark/j9mkkkxc/checkpoints/last.ckpt
+"""
+import argparse
+import json
+import traceback
+from pathlib import Path
+
+import torch
+
+from XrayTo3DShape import (
+    EXPORT_FORMATS,
+    EXPORT_SUFFIX,
+    MODEL_NAMES,
+    export_model,
+    get_example_inputs,
+    get_model,
+)
+
+
+def load_model_weights(model, ckpt_path):
+    """lightning checkpoint: model.layer1.conv1 -> layer1.conv1, drop loss function buffers"""
+    state_dict = torch.load(ckpt_path, map_location="cpu")["state_dict"]
+    state_dict = {
+        key[len("model.") :]: value
+        for key, value in state_dict.items()
+        if key.startswith("model.")
+    }
+    model.load_state_dict(state_dict, strict=True)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="*", default=MODEL_NAMES)
+    parser.add_argument("--image_size", type=int, default=128)
+    parser.add_argument("--formats", nargs="*", default=["torchscript"], choices=EXPORT_FORMATS)
+    parser.add_argument("--checkpoint", default=None, help="lightning checkpoint, only with a single model")
+    parser.add_argument("--output_dir", default="exported")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    if args.checkpoint and len(args.models) != 1:
+        raise ValueError("--checkpoint can only be used when exporting a single model")
+
+    Path(args.output_dir).mkdir(exist_ok=True, parents=True)
+    results = []
+    for model_name in args.models:
+        model = get_model(model_name, image_size=args.image_size)
+        if args.checkpoint:
+            load_model_weights(model, args.checkpoint)
+        model = model.to(args.device).eval()
+        example_inputs = get_example_inputs(model_name, args.image_size, device=args.device)
+        for export_format in args.formats:
+            path = Path(args.output_dir) / f"{model_name}-{args.image_size}{EXPORT_SUFFIX[export_format]}"
+            try:
+                result = export_model(model, example_inputs, path, export_format, atol=args.atol)
+            except Exception as error:  # pylint: disable=broad-except
+                traceback.print_exc()
+                result = {"path": str(path), "error": repr(error)}
+            result.update(model_name=model_name, format=export_format, image_size=args.image_size)
+            results.append(result)
+            status = result.get("error") or (
+                f"max abs diff {result['max_abs_diff']} parity {result['parity']} "
+                + " ".join(
+                    f"(batch {record['batch_size']}: {record['max_abs_diff']:.2e})"
+                    for record in result["validation"]
+                )
+            )
+            print(f"{model_name:28s} {export_format:12s} {status}")
+
+    with open(Path(args.output_dir) / "export-report.json", "w") as fp:
+        json.dump(results, fp, indent=4)
@@ -0,0 +1,27 @@
+"""
+export a packed mask store written with `evaluate.py --prediction_format packed`
+as `<subject>_pred.nii.gz` / `<subject>_gt.nii.gz` files for the nifti based
+scripts e.g. the morphometry pipelines
+    python scripts/export_packed_masks.py runs/2d-3d-benchmark/j9mkkkxc/evaluation/pred_masks runs/2d-3d-benchmark/j9mkkkxc/evaluation
+    python scripts/export_packed_masks.py gt_masks/femur-30k_test_size-128_res-1.0 gt_nifti --subjects s0001_femur_left_msk
+"""
+import argparse
+
+import numpy as np
+
+from XrayTo3DShape import export_nifti
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument(
+        "--subjects", nargs="*", default=None, help="export only these subjects"
+    )
+    parser.add_argument("--dtype", choices=["int16", "uint8"], default="int16")
+    args = parser.parse_args()
+
+    num_exported = export_nifti(
+        args.store_dir, args.output_dir, args.subjects, dtype=getattr(np, args.dtype)
+    )
+    print(f"exported {num_exported} masks from {args.store_dir} to {args.output_dir}")
@@ -1,6 +1,8 @@
+import argparse
+from pathlib import Path
+
 import pandas as pd
-import wandb
-from XrayTo3DShape import filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import filter_runs, load_results_index, select_run_per_model
 
 MODEL_NAMES = [
     "SwinUNETR",
@@ -23,23 +25,44 @@ model_sizes = {
     "UNETR": "96.2M",
 }
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+)
+parser.add_argument("--wandb_dir", default="runs/wandb")
+parser.add_argument(
+    "--wandb_project",
+    default=None,
+    help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+)
+parser.add_argument("--rebuild_index", default=False, action="store_true")
+args = parser.parse_args()
+
 ANATOMY = "femur"
 tags = ["dropout", "model-compare"]
-wandb.login()
-runs = filter_wandb_run(anatomy=ANATOMY, tags=tags, verbose=False)
+# runs from the local results index
+index = load_results_index(
+    args.runs_dir,
+    args.wandb_dir,
+    wandb_project=args.wandb_project,
+    rebuild=args.rebuild_index,
+)
+run_per_model = select_run_per_model(filter_runs(index, anatomy=ANATOMY, tags=tags))
 latex_table_row_template = r" & {model_name} & {model_size} & {FHR:.2f}  & {FHC:.2f}  & {NSA:.2f} & {FNA_x:.2f}  & {FNA_y:.2f}  & {FNA_z:.2f}  & {FDA_x:.2f}  & {FDA_y:.2f} & {FDA_z:.2f}\\"  # make this a raw string so that two backslashes \\ are not escaped and printed as is
-EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/{subdir}/femur_morphometry_error.csv"
+CSV_FILENAME = "femur_morphometry_error.csv"
 subdir = "evaluation"
 
 latex_table = ""
 
 for model_name in MODEL_NAMES:
-    run = get_run_from_model_name(model_name, runs)
-    csv_filename = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id, subdir=subdir)
+    if model_name not in run_per_model:
+        print(f"no run of {model_name} found for anatomy {ANATOMY}")
+        continue
+    csv_filename = Path(args.runs_dir) / run_per_model[model_name] / subdir / CSV_FILENAME
     df = pd.read_csv(csv_filename)
     print(df)
     latex_table += latex_table_row_template.format(
-        model_name=run.config["MODEL_NAME"],
+        model_name=model_name,
         FHR=df.median(numeric_only=True).FHR,
         FHC=df.median(numeric_only=True).FHC,
         NSA=df.median(numeric_only=True).NSA,
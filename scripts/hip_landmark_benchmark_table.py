@@ -1,6 +1,8 @@
+import argparse
+from pathlib import Path
+
 import pandas as pd
-import wandb
-from XrayTo3DShape import filter_wandb_run, get_run_from_model_name
+from XrayTo3DShape import filter_runs, load_results_index, select_run_per_model
 
 MODEL_NAMES = [
     "SwinUNETR",
@@ -23,23 +25,44 @@ model_sizes = {
     "UNETR": "96.2M",
 }
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+)
+parser.add_argument("--wandb_dir", default="runs/wandb")
+parser.add_argument(
+    "--wandb_project",
+    default=None,
+    help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+)
+parser.add_argument("--rebuild_index", default=False, action="store_true")
+args = parser.parse_args()
+
 ANATOMY = "hip"
 tags = ["dropout", "model-compare"]
-wandb.login()
-runs = filter_wandb_run(anatomy=ANATOMY, tags=tags, verbose=False)
+# runs from the local results index
+index = load_results_index(
+    args.runs_dir,
+    args.wandb_dir,
+    wandb_project=args.wandb_project,
+    rebuild=args.rebuild_index,
+)
+run_per_model = select_run_per_model(filter_runs(index, anatomy=ANATOMY, tags=tags))
 latex_table_row_template = r" & {model_name} & {model_size} & {ASIS_L:.2f}  & {ASIS_R:.2f}  & {PT_L:.2f} & {PT_R:.2f}  & {IS_L:.2f}  & {IS_R:.2f}  & {PSIS_L:.2f}  & {PSIS_R:.2f}\\"  # make this a raw string so that two backslashes \\ are not escaped and printed as is
-EVAL_LOG_CSV_PATH_TEMPLATE = "/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark/{run_id}/{subdir}/hip_landmark_error.csv"
+CSV_FILENAME = "hip_landmark_error.csv"
 subdir = "evaluation"
 
 latex_table = ""
 
 for model_name in MODEL_NAMES:
-    run = get_run_from_model_name(model_name, runs)
-    csv_filename = EVAL_LOG_CSV_PATH_TEMPLATE.format(run_id=run.id, subdir=subdir)
+    if model_name not in run_per_model:
+        print(f"no run of {model_name} found for anatomy {ANATOMY}")
+        continue
+    csv_filename = Path(args.runs_dir) / run_per_model[model_name] / subdir / CSV_FILENAME
     df = pd.read_csv(csv_filename)
     print(df)
     latex_table += latex_table_row_template.format(
-        model_name=run.config["MODEL_NAME"],
+        model_name=model_name,
         ASIS_L=df.median(numeric_only=True).ASIS_L,
         ASIS_R=df.median(numeric_only=True).ASIS_R,
         PT_L=df.median(numeric_only=True).PT_L,
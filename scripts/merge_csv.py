@@ -1,23 +1,65 @@
+import argparse
 from pathlib import Path
 
 import pandas as pd
-from XrayTo3DShape import get_anatomy_from_path
+from XrayTo3DShape import (
+    get_anatomy_from_path,
+    load_metric_logs,
+    load_results_index,
+    select_benchmark_runs,
+)
 
-csv_dir = "results/challengeR/"
-csv_files = Path(csv_dir).glob("./**/*.csv")
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--parquet_dir",
+    default=None,
+    help="read the parquet metrics written by evaluate.py --parquet_dir instead of the copied csv logs",
+)
+parser.add_argument("--tags", nargs="*", default=None, help="training runs carrying these tags are merged")
+parser.add_argument(
+    "--runs_dir", default="/mnt/SSD0/mahesh-home/xrayto3D-benchmark/runs/2d-3d-benchmark"
+)
+parser.add_argument("--wandb_dir", default="runs/wandb")
+parser.add_argument(
+    "--wandb_project",
+    default=None,
+    help="query the wandb API for runs without local metadata e.g. msrepo/2d-3d-benchmark",
+)
+parser.add_argument("--rebuild_index", default=False, action="store_true")
+args = parser.parse_args()
 
-
-dataframes = []
-for f in csv_files:
-    if "merged" in str(f):
-        continue  # if the merged-metric-log.csv already exists, then ignore
-    anatomy = get_anatomy_from_path(str(f))
-    print(anatomy, f)
-    df = pd.read_csv(f)
-    df["anatomy"] = anatomy
-    dataframes.append(df)
-print(f"{len(dataframes)} dataframes read")
-merged_df = pd.concat(dataframes, join="inner").sort_index()
 MERGED_DF_FILENAME = Path("results/challengeR/merged-metric-log.csv")
+
+if args.parquet_dir:
+    # evaluation of the most recent run of each model, same runs as the copied csv logs
+    index = load_results_index(
+        args.runs_dir,
+        args.wandb_dir,
+        wandb_project=args.wandb_project,
+        rebuild=args.rebuild_index,
+    )
+    merged_df = load_metric_logs(
+        index,
+        "evaluation",
+        run_ids=select_benchmark_runs(index, args.tags),
+        inf_as_nan=False,
+        parquet_dir=args.parquet_dir,
+    )[["subject-id", "DSC", "ASD", "HD95", "NSD", "model", "anatomy"]]
+    print(f"{len(merged_df)} rows read")
+else:
+    csv_dir = "results/challengeR/"
+    csv_files = Path(csv_dir).glob("./**/*.csv")
+
+    dataframes = []
+    for f in csv_files:
+        if "merged" in str(f):
+            continue  # if the merged-metric-log.csv already exists, then ignore
+        anatomy = get_anatomy_from_path(str(f))
+        print(anatomy, f)
+        df = pd.read_csv(f)
+        df["anatomy"] = anatomy
+        dataframes.append(df)
+    print(f"{len(dataframes)} dataframes read")
+    merged_df = pd.concat(dataframes, join="inner").sort_index()
 MERGED_DF_FILENAME.parent.mkdir(parents=True, exist_ok=True)
 merged_df.to_csv(MERGED_DF_FILENAME, header=True, index=False)
@@ -0,0 +1,44 @@
+"""
+pack ap,lat,seg filepaths csv into a memory-mapped shard.
+the shard directory can be passed to train.py/evaluate.py in place of the filepaths csv.
+name the shard directory so that the anatomy can still be inferred from the path e.g.
+    python scripts/pack_dataset.py configs/paths/femur/30k/TotalSegmentor-femur-left-DRR-30k_test.csv shards/femur-30k_test --model_name UNet --size 128 --res 1.0
+"""
+import argparse
+
+from XrayTo3DShape import (
+    get_transform_family_from_model_name,
+    get_transform_from_model_name,
+    pack_dataset,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filepaths")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model_name", required=True)
+    parser.add_argument("--size", type=int, required=True)
+    parser.add_argument("--res", type=float, required=True)
+    parser.add_argument("--xray_dtype", choices=["float16", "uint8"], default="float16")
+    parser.add_argument("--num_workers", default=4, type=int)
+    args = parser.parse_args()
+
+    transform_family = get_transform_family_from_model_name(args.model_name)
+    if transform_family == "denoising_autoencoder":
+        raise ValueError("noisy labels are sampled on the fly and cannot be packed")
+    transforms = get_transform_from_model_name(
+        args.model_name, image_size=args.size, resolution=args.res
+    )
+    shard_dir = pack_dataset(
+        args.filepaths,
+        transforms,
+        args.output_dir,
+        xray_dtype=args.xray_dtype,
+        transform_params={
+            "size": args.size,
+            "resolution": args.res,
+            "family": transform_family,
+        },
+        num_workers=args.num_workers,
+    )
+    print(f"packed {args.filepaths} into {shard_dir}")
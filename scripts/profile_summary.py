@@ -0,0 +1,35 @@
+"""compare the stage profiles of train.py --profile_stages runs across architectures"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from XrayTo3DShape import PROFILE_SUMMARY_SUFFIX
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs_dir", default="runs/2d-3d-benchmark")
+parser.add_argument(
+    "--value",
+    default="wall_ms_mean",
+    choices=["wall_ms_mean", "wall_ms_median", "wall_ms_p95", "device_ms_mean", "peak_memory_mb", "step_share"],
+)
+parser.add_argument("--output", default="results/profile/stage-summary.csv")
+args = parser.parse_args()
+
+summaries = []
+for summary_path in sorted(Path(args.runs_dir).glob(f"*/profile/*{PROFILE_SUMMARY_SUFFIX}")):
+    summary = pd.read_csv(summary_path)
+    summary["model"] = summary_path.name[: -len(PROFILE_SUMMARY_SUFFIX)]
+    summary["run_id"] = summary_path.parent.parent.name
+    summaries.append(summary)
+print(f"{len(summaries)} stage profiles read")
+if not summaries:
+    raise SystemExit
+
+table = pd.concat(summaries, ignore_index=True)
+Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+table.to_csv(args.output, index=False)
+
+# one column per architecture (latest profile of the run directory order wins)
+stages = list(dict.fromkeys(table["stage"]))
+pivot = table.pivot_table(index="stage", columns="model", values=args.value, aggfunc="last")
+print(pivot.reindex(stages).round(2).to_string())
@@ -0,0 +1,77 @@
+"""bootstrap confidence intervals and ranking stability of the benchmark,
+replaces results/challengeR_script.r"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from XrayTo3DShape import benchmark_ranking, metric_confidence_intervals, read_metrics_table
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--metric_log", default="results/challengeR/merged-metric-log.csv")
+parser.add_argument(
+    "--parquet_dir",
+    default=None,
+    help="read the parquet metrics written by evaluate.py --parquet_dir instead of the merged csv log",
+)
+parser.add_argument("--tags", nargs="*", default=None, help="tag partitions to read")
+parser.add_argument("--metrics", nargs="*", default=["DSC", "HD95", "ASD", "NSD"])
+parser.add_argument("--rank_metric", default="DSC")
+parser.add_argument("--alpha", type=float, default=0.05)
+parser.add_argument("--num_boot", type=int, default=1000)
+parser.add_argument("--num_perm", type=int, default=10000)
+parser.add_argument(
+    "--na_value",
+    type=float,
+    default=None,
+    help="value of cases missing for a model when ranking, by default such cases are dropped",
+)
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--num_workers", type=int, default=4)
+parser.add_argument("--output_dir", default="results/ranking")
+args = parser.parse_args()
+
+if args.parquet_dir:
+    table = read_metrics_table(
+        args.parquet_dir,
+        columns=["subject-id", *args.metrics, "model", "anatomy"],
+        filters={"tag": args.tags} if args.tags else None,
+    )
+else:
+    table = pd.read_csv(args.metric_log)
+print(f"{len(table)} rows read")
+
+confidence_intervals = metric_confidence_intervals(
+    table,
+    args.metrics,
+    num_boot=args.num_boot,
+    alpha=args.alpha,
+    seed=args.seed,
+    num_workers=args.num_workers,
+)
+ranking, rank_frequency = benchmark_ranking(
+    table,
+    args.rank_metric,
+    alpha=args.alpha,
+    num_boot=args.num_boot,
+    num_perm=args.num_perm,
+    na_value=args.na_value,
+    seed=args.seed,
+    num_workers=args.num_workers,
+)
+
+output_dir = Path(args.output_dir)
+output_dir.mkdir(parents=True, exist_ok=True)
+confidence_intervals.to_csv(output_dir / "confidence-intervals.csv", index=False)
+ranking.to_csv(output_dir / f"ranking-{args.rank_metric}.csv", index=False)
+rank_frequency.to_csv(output_dir / f"rank-frequency-{args.rank_metric}.csv", index=False)
+
+for anatomy, anatomy_ranking in ranking.groupby("anatomy"):
+    print(f"{anatomy} ({anatomy_ranking['num_cases'].iloc[0]} cases, kendall tau {anatomy_ranking['kendall_tau'].iloc[0]:.2f})")
+    cis = confidence_intervals[confidence_intervals["anatomy"] == anatomy].set_index(["model", "metric"])
+    for _, row in anatomy_ranking.iterrows():
+        line = f"{row['rank']:2d} {row['model']:30s} [{row['rank_low']:.0f}-{row['rank_high']:.0f}]"
+        for metric in args.metrics:
+            ci = cis.loc[(row["model"], metric)]
+            line += f" & {ci['mean']:5.2f} ({ci['ci_low']:5.2f}-{ci['ci_high']:5.2f})"
+        print(line + r"\\")  # latex new line
+    print("\n")
@@ -0,0 +1,101 @@
+"""
+serve 3D reconstructions of AP/LAT x-ray pairs over HTTP.
+checkpoints are listed in a json manifest, each entry is served under its `name`
+(defaults to the model name)
+    [
+        {"name": "femur", "model_name": "TwoDPermuteConcat", "ckpt_path": "runs/2d-3d-benchmark/j9mkkkxc/checkpoints",
+         "image_size": 128, "res": 1.0},
+        ...
+    ]
+optional keys per entry: patch_size, load_autoencoder_from
+    python serve.py models.json --port 8000 --gpu 0 --max_batch_size 8
+    curl localhost:8000/health
+    curl localhost:8000/stats
+"""
+import argparse
+import json
+from pathlib import Path
+
+import torch
+
+from XrayTo3DShape import (
+    ReconstructionModel,
+    ReconstructionServer,
+    get_latest_checkpoint,
+    load_experiment,
+)
+
+
+def parse_serving_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--gpu", default=0, type=int)
+    parser.add_argument("--accelerator", default="gpu")
+    parser.add_argument(
+        "--max_batch_size",
+        default=8,
+        type=int,
+        help="concurrent requests of the same model are predicted in batches of up to this size",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        default=5.0,
+        type=float,
+        help="longest time a request waits for others to fill its batch",
+    )
+    parser.add_argument("--verbose", default=False, action="store_true")
+    return parser.parse_args()
+
+
+def load_models(manifest, device):
+    """load every checkpoint of the manifest once"""
+    with open(manifest) as f:
+        entries = json.load(f)
+    models = {}
+    for entry in entries:
+        ckpt_path = entry["ckpt_path"]
+        if Path(ckpt_path).is_dir():
+            ckpt_path = get_latest_checkpoint(ckpt_path, checkpoint_regex="last*.ckpt")
+        model_module = load_experiment(
+            entry["model_name"],
+            ckpt_path,
+            int(entry["image_size"]),
+            patch_size=entry.get("patch_size"),
+            load_autoencoder_from=entry.get("load_autoencoder_from"),
+            device=device,
+        )
+        name = entry.get("name", entry["model_name"])
+        models[name] = ReconstructionModel(
+            model_module,
+            entry["model_name"],
+            image_size=int(entry["image_size"]),
+            resolution=float(entry["res"]),
+            device=device,
+        )
+        print(f"{name}: {entry['model_name']} from {ckpt_path}")
+    return models
+
+
+if __name__ == "__main__":
+    args = parse_serving_arguments()
+    device = (
+        torch.device(f"cuda:{args.gpu}")
+        if args.accelerator == "gpu"
+        else torch.device("cpu")
+    )
+    server = ReconstructionServer(
+        (args.host, args.port),
+        load_models(args.manifest, device),
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000,
+        verbose=args.verbose,
+    )
+    print(f"serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
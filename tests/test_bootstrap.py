@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from XrayTo3DShape import (
+    benchmark_ranking,
+    bootstrap_ci,
+    bootstrap_means,
+    bootstrap_rank_stability,
+    get_case_matrix,
+    metric_confidence_intervals,
+    paired_permutation_test,
+)
+
+
+def get_metric_table(num_cases=40, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for anatomy in ["femur", "hip"]:
+        for model, offset in [("UNet", 0.0), ("SwinUNETR", 0.1), ("OneDConcat", -0.2)]:
+            dsc = 0.7 + offset + 0.01 * rng.standard_normal(num_cases)
+            for case, value in enumerate(dsc):
+                rows.append(
+                    {
+                        "subject-id": f"s{case}",
+                        "DSC": value,
+                        "HD95": 2.0 - offset,
+                        "model": model,
+                        "anatomy": anatomy,
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+class TestBootstrap(unittest.TestCase):
+    def test_ci(self):
+        values = np.array([[1.0, 1.0], [2.0, np.inf], [3.0, 3.0]])
+        mean, low, high = bootstrap_ci(values, num_boot=200, seed=0)
+        np.testing.assert_allclose(mean, [2.0, 2.0])
+        self.assertTrue(np.all(low <= mean) and np.all(mean <= high))
+        self.assertTrue(np.all(low >= 1.0) and np.all(high <= 3.0))
+
+    def test_blocked_resamples_match(self):
+        values = np.random.default_rng(0).random((50, 3))
+        values[3, 1] = np.nan
+        unblocked = bootstrap_means(values, 100, np.random.default_rng(1), block_size=100)
+        blocked = bootstrap_means(values, 100, np.random.default_rng(1), block_size=7)
+        np.testing.assert_allclose(blocked, unblocked)
+        # same as averaging the gathered resamples
+        indices = np.random.default_rng(1).integers(0, 50, size=(100, 50))
+        np.testing.assert_allclose(unblocked, np.nanmean(values[indices], axis=1))
+
+        matrix = get_case_matrix(get_metric_table(), "DSC").values
+        np.testing.assert_array_equal(
+            paired_permutation_test(matrix, False, num_perm=300, seed=0, block_size=300),
+            paired_permutation_test(matrix, False, num_perm=300, seed=0, block_size=11),
+        )
+
+    def test_permutation_test(self):
+        table = get_metric_table()
+        matrix = get_case_matrix(table[table.anatomy == "femur"], "DSC")
+        p_values = paired_permutation_test(matrix.values, small_better=False, num_perm=500, seed=0)
+        swin, unet = list(matrix.columns).index("SwinUNETR"), list(matrix.columns).index("UNet")
+        self.assertLess(p_values[swin, unet], 0.01)
+        self.assertGreater(p_values[unet, swin], 0.5)
+
+    def test_ranking(self):
+        table = get_metric_table()
+        ranking, frequency = benchmark_ranking(table, "DSC", num_boot=100, num_perm=500, seed=0)
+        femur = ranking[ranking.anatomy == "femur"]
+        self.assertEqual(femur["model"].tolist(), ["SwinUNETR", "UNet", "OneDConcat"])
+        self.assertEqual(femur["rank"].tolist(), [1, 2, 3])
+        self.assertAlmostEqual(femur["kendall_tau"].iloc[0], 1.0)
+        np.testing.assert_allclose(frequency[[1, 2, 3]].sum(axis=1), 1.0)
+        # smaller is better
+        summary, _ = bootstrap_rank_stability(
+            get_case_matrix(table[table.anatomy == "hip"], "HD95"), small_better=True, num_boot=10
+        )
+        self.assertEqual(summary.index[0], "SwinUNETR")
+
+    def test_parallel_results_match(self):
+        table = get_metric_table()
+        serial = metric_confidence_intervals(table, ["DSC", "HD95"], num_boot=100, seed=1)
+        parallel = metric_confidence_intervals(table, ["DSC", "HD95"], num_boot=100, seed=1, num_workers=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+        self.assertEqual(len(serial), 2 * 3 * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
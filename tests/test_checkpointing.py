@@ -0,0 +1,58 @@
+import unittest
+
+import torch
+
+from XrayTo3DShape import (
+    CustomAutoEncoder,
+    TwoDPermuteConcat,
+    get_model,
+    get_model_config,
+)
+
+
+def get_gradients(model, *inputs):
+    torch.manual_seed(0)
+    output = model(*inputs)
+    if isinstance(output, tuple):
+        output = output[0]
+    output.mean().backward()
+    grads = {name: p.grad.clone() for name, p in model.named_parameters()}
+    model.zero_grad()
+    return output.detach(), grads
+
+
+class TestActivationCheckpointing(unittest.TestCase):
+    def assert_same_gradients(self, model_name, image_size, inputs):
+        plain = get_model(model_name, image_size)
+        checkpointed = get_model(model_name, image_size, checkpoint_segments=2)
+        checkpointed.load_state_dict(plain.state_dict())
+        plain_out, plain_grads = get_gradients(plain.train(), *inputs)
+        ckpt_out, ckpt_grads = get_gradients(checkpointed.train(), *inputs)
+        self.assertTrue(torch.allclose(plain_out, ckpt_out, atol=1e-5))
+        for name, grad in plain_grads.items():
+            self.assertTrue(torch.allclose(grad, ckpt_grads[name], atol=1e-5), name)
+
+    def test_twodpermuteconcat(self):
+        images = (torch.rand(2, 1, 64, 64), torch.rand(2, 1, 64, 64))
+        self.assert_same_gradients(TwoDPermuteConcat.__name__, 64, images)
+
+    def test_autoencoder(self):
+        self.assert_same_gradients(
+            CustomAutoEncoder.__name__, 32, (torch.rand(2, 1, 32, 32, 32),)
+        )
+
+    def test_eval_runs_without_checkpointing(self):
+        model = get_model(TwoDPermuteConcat.__name__, 64, checkpoint_segments=3).eval()
+        with torch.no_grad():
+            output = model(torch.rand(1, 1, 64, 64), torch.rand(1, 1, 64, 64))
+        self.assertEqual(output.shape, (1, 1, 64, 64, 64))
+
+    def test_config(self):
+        config = get_model_config("SwinUNETR", 64, checkpoint_segments=1)
+        self.assertTrue(config["use_checkpoint"])
+        with self.assertRaises(ValueError):
+            get_model_config("Unet", 64, checkpoint_segments=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
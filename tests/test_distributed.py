@@ -0,0 +1,51 @@
+import unittest
+
+import pytorch_lightning as pl
+import torch
+from torch import nn
+from torch.optim import Adam
+from torch.utils.data import DataLoader, Dataset
+
+from XrayTo3DShape import VolumeAsInputExperiment
+
+SIZE = 8
+
+
+class RandomKastenDataset(Dataset):
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        torch.manual_seed(index)
+        return (
+            {"ap": torch.rand(1, SIZE, SIZE)},
+            {"lat": torch.rand(1, SIZE, SIZE)},
+            {
+                "seg": (torch.rand(1, SIZE, SIZE, SIZE) > 0.5).float(),
+                "seg_meta_dict": {"filename_or_obj": f"{index}.nii.gz"},
+            },
+        )
+
+
+class TestDistributedTraining(unittest.TestCase):
+    def test_ddp_gloo_cpu(self):
+        model = nn.Conv3d(2, 1, kernel_size=3, padding=1)
+        experiment = VolumeAsInputExperiment(
+            model, Adam(model.parameters(), 1e-3), nn.BCEWithLogitsLoss(), batch_size=2
+        )
+        trainer = pl.Trainer(
+            accelerator="cpu",
+            devices=2,
+            strategy="ddp_spawn",
+            max_steps=2,
+            limit_val_batches=0,
+            logger=False,
+            enable_checkpointing=False,
+            enable_progress_bar=False,
+        )
+        trainer.fit(experiment, DataLoader(RandomKastenDataset(), batch_size=2))
+        self.assertEqual(trainer.world_size, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import torch
+
+from evaluate_multi import evaluate_group, group_jobs, read_manifest
+from XrayTo3DShape import METRIC_LOG_FILENAME, ParallelHeadsExperiment, get_model
+
+TEST_DIR = Path(__file__).parent
+IMAGE_SIZE = 64
+RESOLUTION = 1.5
+MODEL_NAME = "TwoDPermuteConcat"
+
+
+def get_args(**kwargs):
+    """defaults of `parse_evaluation_arguments` on the cpu"""
+    args = dict(
+        ckpt_type="latest",
+        nsd_tolerance=1.5,
+        metrics_backend="torch",
+        batch_size=2,
+        num_workers=0,
+        writer_workers=0,
+        accelerator="cpu",
+        devices=1,
+        precision="32",
+        channels_last=False,
+        prediction_format="nifti",
+        gt_store_dir=None,
+        parquet_dir=None,
+        results_tag=None,
+        resume=False,
+        lazy_kasten=False,
+        label_format="float32",
+        cache_dir=None,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class TestEvaluateMulti(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        rows = []
+        for index in range(3):
+            seg_path = root / f"s{index}_msk.nii.gz"
+            seg = np.zeros((IMAGE_SIZE,) * 3, dtype=np.uint8)
+            seg[16 : 32 + index, 16:40, 20:40] = 1
+            nib.save(nib.Nifti1Image(seg, np.diag([RESOLUTION] * 3 + [1.0])), seg_path)
+            rows.append(
+                [
+                    str(TEST_DIR / "sub-verse004_vert-16_ap.png"),
+                    str(TEST_DIR / "sub-verse004_vert-16_lat.png"),
+                    str(seg_path),
+                ]
+            )
+        testpaths = root / "vertebra_test.csv"
+        pd.DataFrame(rows, columns=["ap", "lat", "seg"]).to_csv(testpaths)
+
+        self.jobs = []
+        for seed in range(2):
+            torch.manual_seed(seed)
+            module = ParallelHeadsExperiment(model=get_model(MODEL_NAME, IMAGE_SIZE))
+            ckpt_dir = root / f"run{seed}" / "checkpoints"
+            ckpt_dir.mkdir(parents=True)
+            torch.save({"state_dict": module.state_dict()}, ckpt_dir / "last.ckpt")
+            self.jobs.append(
+                {
+                    "model_name": MODEL_NAME,
+                    "ckpt_path": str(ckpt_dir),
+                    "testpaths": str(testpaths),
+                    "res": RESOLUTION,
+                    "image_size": IMAGE_SIZE,
+                }
+            )
+        self.manifest = root / "manifest.json"
+        with open(self.manifest, "w") as f:
+            json.dump(self.jobs, f)
+        self.root = root
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_two_checkpoints(self):
+        job_groups = group_jobs(read_manifest(self.manifest, "latest"))
+        self.assertEqual(len(job_groups), 1)
+        for group_key, group in job_groups.items():
+            evaluate_group(group_key, group, get_args())
+        metric_logs = []
+        for seed in range(2):
+            output_dir = self.root / f"run{seed}" / "evaluation"
+            self.assertEqual(len(list(output_dir.glob("*_pred.nii.gz"))), 3)
+            self.assertEqual(len(list(output_dir.glob("*_gt.nii.gz"))), 3)
+            metric_log = pd.read_csv(output_dir / METRIC_LOG_FILENAME)
+            self.assertEqual(sorted(metric_log["subject-id"]), ["s0_msk", "s1_msk", "s2_msk"])
+            metric_logs.append(metric_log)
+        # each job is scored with its own checkpoint
+        self.assertNotEqual(metric_logs[0]["checkpoint"][0], metric_logs[1]["checkpoint"][0])
+
+    def test_precision_and_channels_last(self):
+        for group_key, group in group_jobs(read_manifest(self.manifest, "latest")).items():
+            evaluate_group(group_key, group, get_args(precision="bf16-mixed", channels_last=True))
+        for seed in range(2):
+            metric_log = pd.read_csv(self.root / f"run{seed}" / "evaluation" / METRIC_LOG_FILENAME)
+            self.assertEqual(len(metric_log), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from XrayTo3DShape import export_model, get_example_inputs, get_model
+
+
+class BatchDependent(nn.Module):
+    """the trace records the batch size of the example input as a constant"""
+
+    def forward(self, x):
+        return x.reshape(int(x.shape[0]), -1).sum(1)
+
+
+class TestExport(unittest.TestCase):
+    def test_example_inputs(self):
+        ap, lat = get_example_inputs("TwoDPermuteConcat", 64, batch_size=2)
+        self.assertEqual(ap.shape, (2, 1, 64, 64))
+        (volume,) = get_example_inputs("AttentionUnet", 32)
+        self.assertEqual(volume.shape, (1, 2, 32, 32, 32))
+
+    def test_torchscript_parity(self):
+        model = get_model("TwoDPermuteConcat", 64)
+        example_inputs = get_example_inputs("TwoDPermuteConcat", 64)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "TwoDPermuteConcat-64.pt"
+            result = export_model(model, example_inputs, path, "torchscript")
+            self.assertTrue(path.exists())
+            self.assertTrue(result["parity"])
+            self.assertEqual([r["batch_size"] for r in result["validation"]], [1, 2])
+            scripted = torch.jit.load(str(path))
+            self.assertEqual(scripted(*example_inputs).shape, (1, 1, 64, 64, 64))
+
+    def test_batch_dependent_trace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = export_model(
+                BatchDependent(), [torch.rand(1, 4)], Path(tmp_dir) / "model.pt", "torchscript"
+            )
+        self.assertFalse(result["parity"])
+        self.assertEqual(result["validation"][0]["max_abs_diff"], 0.0)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            export_model(get_model("AttentionUnet", 32), [], "model.trt", "tensorrt")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+import torch
+from scipy.ndimage import convolve
+
+from XrayTo3DShape import HausdorffDTLoss, HausdorffERLoss, get_loss
+
+
+def erosion_loss_reference(pred, target, alpha=2.0, erosions=10):
+    """per-item scipy erosion with a 3D cross kernel"""
+    cross = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+    bound = np.array([[0, 0, 0], [0, 1, 0], [0, 0, 0]])
+    kernel = np.array([bound, cross, bound]) / 7
+    bound = (pred - target) ** 2
+    eroded = np.zeros_like(bound)
+    for index, item in enumerate(bound):
+        item = item[0]
+        for k in range(erosions):
+            erosion = np.maximum(convolve(item, kernel, mode="constant", cval=0.0) - 0.5, 0)
+            if np.ptp(erosion) != 0:
+                erosion = (erosion - erosion.min()) / np.ptp(erosion)
+            item = erosion
+            eroded[index, 0] += erosion * (k + 1) ** alpha
+    return eroded.mean()
+
+
+class TestHausdorffDTLoss(unittest.TestCase):
+    def test_torch_matches_scipy(self):
+        pred = torch.rand(3, 1, 16, 16, 16, requires_grad=True)
+        target = (torch.rand(3, 1, 16, 16, 16) > 0.7).float()
+        target[2] = 0  # no foreground
+        torch_loss = HausdorffDTLoss(device="cpu", backend="torch")(pred, target)
+        scipy_loss = HausdorffDTLoss(device="cpu", backend="scipy")(pred, target)
+        self.assertAlmostEqual(torch_loss.item(), scipy_loss.item(), places=3)
+
+        torch_loss.backward()
+        self.assertIsNotNone(pred.grad)
+
+    def test_empty_and_full_items(self):
+        target = (torch.rand(4, 1, 8, 10, 12) > 0.5).float()
+        target[0] = 0  # all background
+        target[1] = 1  # all foreground
+        torch_field = HausdorffDTLoss(device="cpu", backend="torch").distance_field(target)
+        scipy_field = HausdorffDTLoss(device="cpu", backend="scipy").distance_field(target)
+        self.assertTrue(torch.allclose(torch_field, scipy_field, atol=1e-4))
+        self.assertTrue(torch.equal(torch_field[0], torch.zeros_like(torch_field[0])))
+        self.assertTrue((torch_field[1] > 0).all())
+
+        pred = torch.rand(4, 1, 8, 10, 12)
+        torch_loss = HausdorffDTLoss(device="cpu", backend="torch")(pred, target)
+        scipy_loss = HausdorffDTLoss(device="cpu", backend="scipy")(pred, target)
+        self.assertAlmostEqual(torch_loss.item(), scipy_loss.item(), places=2)
+
+
+class TestHausdorffERLoss(unittest.TestCase):
+    def test_matches_reference(self):
+        pred = torch.rand(2, 1, 12, 12, 12, dtype=torch.float64, requires_grad=True)
+        target = (torch.rand(2, 1, 12, 12, 12, dtype=torch.float64) > 0.5).double()
+        loss = HausdorffERLoss(device="cpu")(pred, target)
+        expected = erosion_loss_reference(pred.detach().numpy(), target.numpy())
+        self.assertAlmostEqual(loss.item(), expected, places=6)
+
+        loss.backward()
+        self.assertTrue(torch.isfinite(pred.grad).all())
+
+    def test_2d(self):
+        pred = torch.rand(2, 1, 16, 16)
+        target = (torch.rand(2, 1, 16, 16) > 0.5).float()
+        loss = HausdorffERLoss(device="cpu", sigmoid=True)(pred, target)
+        self.assertEqual(loss.ndim, 0)
+
+
+class TestHausdorffLossGradients(unittest.TestCase):
+    """the experiments pass logits, both losses apply the sigmoid"""
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.logits = torch.randn(2, 1, 6, 6, 6, dtype=torch.float64, requires_grad=True)
+        self.target = (torch.rand(2, 1, 6, 6, 6, dtype=torch.float64) > 0.5).double()
+
+    def test_get_loss_applies_sigmoid(self):
+        probabilities = torch.sigmoid(self.logits)
+        for loss_class in (HausdorffDTLoss, HausdorffERLoss):
+            loss = get_loss(loss_class.__name__, device="cpu")(self.logits, self.target)
+            expected = loss_class(device="cpu")(probabilities, self.target)
+            self.assertAlmostEqual(loss.item(), expected.item(), places=6)
+
+    def test_dt_gradients(self):
+        loss_function = HausdorffDTLoss(device="cpu", sigmoid=True)
+        self.assertTrue(
+            torch.autograd.gradcheck(lambda x: loss_function(x, self.target), (self.logits,))
+        )
+
+    def test_er_gradients(self):
+        loss_function = HausdorffERLoss(device="cpu", sigmoid=True)
+        self.assertTrue(
+            torch.autograd.gradcheck(lambda x: loss_function(x, self.target), (self.logits,))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import base64
+import gzip
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+from XrayTo3DShape import (
+    ParallelHeadsExperiment,
+    ReconstructionModel,
+    ReconstructionServer,
+    decode_packbits_response,
+    get_model,
+    get_pir_affine,
+)
+
+TEST_DIR = Path(__file__).parent
+IMAGE_SIZE = 64
+RESOLUTION = 1.5
+
+
+def read_base64(filename):
+    return base64.b64encode((TEST_DIR / filename).read_bytes()).decode()
+
+
+class TestInferenceServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model_name = "TwoDPermuteConcat"
+        module = ParallelHeadsExperiment(model=get_model(model_name, IMAGE_SIZE))
+        model = ReconstructionModel(module, model_name, IMAGE_SIZE, RESOLUTION)
+        cls.server = ReconstructionServer(("127.0.0.1", 0), {"vertebra": model})
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.request = {
+            "ap": read_base64("sub-verse004_vert-16_ap.png"),
+            "lat": read_base64("sub-verse004_vert-16_lat.png"),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def post(self, payload):
+        request = urllib.request.Request(
+            f"{self.url}/predict",
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    def test_health(self):
+        with urllib.request.urlopen(f"{self.url}/health") as response:
+            models = json.loads(response.read())["models"]
+        self.assertEqual(models["vertebra"]["image_size"], IMAGE_SIZE)
+
+    def test_nifti(self):
+        body = self.post({**self.request, "model": "vertebra", "format": "nifti"})
+        image = nib.Nifti1Image.from_bytes(gzip.decompress(body))
+        self.assertEqual(image.shape, (IMAGE_SIZE,) * 3)
+        np.testing.assert_allclose(image.affine, get_pir_affine(RESOLUTION))
+
+    def test_concurrent_packbits(self):
+        with ThreadPoolExecutor(4) as executor:
+            bodies = list(
+                executor.map(
+                    lambda _: self.post({**self.request, "format": "packbits"}), range(4)
+                )
+            )
+        for body in bodies:
+            volume, affine = decode_packbits_response(json.loads(body))
+            self.assertEqual(volume.shape, (IMAGE_SIZE,) * 3)
+            np.testing.assert_allclose(affine, get_pir_affine(RESOLUTION))
+        with urllib.request.urlopen(f"{self.url}/stats") as response:
+            stats = json.loads(response.read())
+        self.assertGreaterEqual(stats["keys"]["vertebra"]["latency"]["count"], 4)
+
+    def test_bad_request(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post({**self.request, "model": "femur"})
+        self.assertEqual(context.exception.code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import torch
+
+from XrayTo3DShape import decode_label, pack_label_bits
+
+
+class TestLabelFormat(unittest.TestCase):
+    def test_packbits_roundtrip(self):
+        seg = (torch.rand(1, 8, 8, 16) > 0.5).float()
+        packed = torch.from_numpy(pack_label_bits(seg))
+        self.assertEqual(packed.shape, (1, 8, 8, 2))
+        self.assertEqual(packed.dtype, torch.uint8)
+        # collated batch
+        decoded = decode_label(packed.unsqueeze(0), "packbits")
+        self.assertEqual(decoded.dtype, torch.float32)
+        self.assertTrue(torch.equal(decoded[0], seg))
+
+    def test_uint8(self):
+        seg = (torch.rand(2, 1, 4, 4, 4) > 0.5).to(torch.uint8)
+        self.assertTrue(torch.equal(decode_label(seg, "uint8"), seg.float()))
+
+    def test_invalid_shape(self):
+        with self.assertRaises(ValueError):
+            pack_label_bits(torch.zeros(1, 4, 4, 12))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+import einops
+import torch
+
+from XrayTo3DShape import expand_kasten_views
+
+
+class TestLazyKastenExpansion(unittest.TestCase):
+    def test_same_as_repeat(self):
+        size = 8
+        ap = torch.rand(2, 1, size, size)
+        lat = torch.rand(2, 1, size, size)
+        ap_volume, lat_volume = expand_kasten_views(ap, lat)
+
+        expected_ap = torch.stack(
+            [einops.repeat(a, "1 m n -> 1 k m n", k=size) for a in ap]
+        )
+        expected_lat = torch.stack(
+            [einops.repeat(l, "1 m n -> 1 m n k", k=size) for l in lat]
+        )
+        self.assertTrue(torch.equal(ap_volume, expected_ap))
+        self.assertTrue(torch.equal(lat_volume, expected_lat))
+
+    def test_volume_passthrough(self):
+        volume = torch.rand(2, 1, 4, 4, 4)
+        ap_volume, lat_volume = expand_kasten_views(volume, volume)
+        self.assertIs(ap_volume, volume)
+        self.assertIs(lat_volume, volume)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import torch
+
+from XrayTo3DShape import (
+    NiftiPredictionWriter,
+    PackedMaskStore,
+    PackedPredictionWriter,
+    export_nifti,
+    is_complete_mask_store,
+)
+
+IMAGE_SIZE = 12
+
+
+def get_prediction(batch_index):
+    names = [f"s{batch_index}{i}_msk.nii.gz" for i in range(2)]
+    affine = torch.eye(4, dtype=torch.float64).repeat(2, 1, 1)
+    affine[:, :3, 3] = torch.tensor([batch_index, 2.0, 3.0])
+    return {
+        "pred": (torch.rand(2, 1, IMAGE_SIZE, IMAGE_SIZE, IMAGE_SIZE) > 0.5).to(torch.uint8),
+        "gt": (torch.rand(2, 1, IMAGE_SIZE, IMAGE_SIZE, IMAGE_SIZE) > 0.5).to(torch.uint8),
+        "seg_meta_dict": {
+            "filename_or_obj": names,
+            "affine": affine,
+            "original_affine": affine.clone(),
+        },
+    }
+
+
+def write_predictions(writer, predictions):
+    for batch_idx, prediction in enumerate(predictions):
+        writer.write_on_batch_end(None, None, prediction, None, None, batch_idx, 0)
+    writer.on_predict_end(None, None)
+
+
+class TestMaskStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.predictions = [get_prediction(i) for i in range(3)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_roundtrip(self):
+        writer = PackedPredictionWriter(
+            self.root / "run", image_size=IMAGE_SIZE, resolution=1.0, chunk_size=4, num_workers=2
+        )
+        write_predictions(writer, self.predictions)
+        store = PackedMaskStore(self.root / "run" / "pred_masks")
+        self.assertEqual(len(store), 6)
+        self.assertEqual(len(store.store_info["chunks"]), 2)
+
+        record = store.read("s11_msk")
+        np.testing.assert_array_equal(record["mask"], self.predictions[1]["pred"][1, 0].numpy())
+        np.testing.assert_allclose(record["affine"][:3, 3], [1.0, 2.0, 3.0])
+        self.assertEqual([r["filename_or_obj"] for r in store][0], "s00_msk.nii.gz")
+
+    def test_gt_written_once(self):
+        gt_store_dir = self.root / "gt"
+        first = PackedPredictionWriter(self.root / "a", gt_store_dir=gt_store_dir, image_size=IMAGE_SIZE)
+        write_predictions(first, self.predictions)
+        self.assertTrue(is_complete_mask_store(gt_store_dir))
+        second = PackedPredictionWriter(self.root / "b", gt_store_dir=gt_store_dir, image_size=IMAGE_SIZE)
+        self.assertIsNone(second.gt_store)
+
+    def test_concurrent_gt_writers(self):
+        gt_store_dir = self.root / "gt"
+        first = PackedPredictionWriter(self.root / "a", gt_store_dir=gt_store_dir, image_size=IMAGE_SIZE)
+        second = PackedPredictionWriter(self.root / "b", gt_store_dir=gt_store_dir, image_size=IMAGE_SIZE)
+        write_predictions(first, self.predictions)
+        store = PackedMaskStore(gt_store_dir)
+        # the store read by the first evaluation is kept when the second one finishes
+        write_predictions(second, self.predictions)
+        self.assertEqual(len(list(store)), 6)
+        self.assertEqual(sorted(p.name for p in self.root.iterdir()), ["a", "b", "gt"])
+
+    def test_rerun_replaces_predictions(self):
+        write_predictions(PackedPredictionWriter(self.root / "run", image_size=IMAGE_SIZE), self.predictions)
+        write_predictions(PackedPredictionWriter(self.root / "run", image_size=IMAGE_SIZE), self.predictions[:1])
+        self.assertEqual(len(PackedMaskStore(self.root / "run" / "pred_masks")), 2)
+        self.assertEqual(sorted(p.name for p in (self.root / "run").iterdir()), ["gt_masks", "pred_masks"])
+
+    def test_export_matches_nifti_writer(self):
+        nifti_dir, packed_dir = self.root / "nifti", self.root / "packed"
+        write_predictions(
+            NiftiPredictionWriter(nifti_dir, image_size=IMAGE_SIZE, resolution=1.0),
+            self.predictions,
+        )
+        write_predictions(
+            PackedPredictionWriter(packed_dir, image_size=IMAGE_SIZE, resolution=1.0),
+            self.predictions,
+        )
+        export_dir = self.root / "exported"
+        self.assertEqual(export_nifti(packed_dir / "pred_masks", export_dir), 6)
+        for path in sorted(nifti_dir.glob("*_pred.nii.gz")):
+            expected, exported = nib.load(path), nib.load(export_dir / path.name)
+            np.testing.assert_array_equal(expected.get_fdata(), exported.get_fdata())
+            np.testing.assert_allclose(expected.affine, exported.affine)
+
+
+if __name__ == "__main__":
+    unittest.main()
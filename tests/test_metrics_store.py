@@ -0,0 +1,131 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from XrayTo3DShape import (
+    ParquetMetricsWriter,
+    has_pyarrow,
+    load_metric_logs,
+    read_metrics_table,
+    select_benchmark_runs,
+)
+
+
+def write_metrics(root_dir, model, tag, dsc_values, resume_rows=None, run_id=None, subdir="evaluation"):
+    run_id = run_id if run_id else f"{model}-run"
+    writer = ParquetMetricsWriter(root_dir, "femur", model, tag, run_id=run_id, subdir=subdir, rows_per_part=2)
+    writer.open("ckpt", resume_rows)
+    for index, dsc in enumerate(dsc_values):
+        writer.add_row(f"s{index}_msk", [dsc, 1.0, 2.0, 0.5])
+    writer.flush()
+    return writer
+
+
+@unittest.skipUnless(has_pyarrow, "requires pyarrow")
+class TestMetricsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partitions(self):
+        write_metrics(self.root, "UNet", "model-compare", [0.123456789, 0.5, 0.75])
+        write_metrics(self.root, "SwinUNETR", "model-compare", [0.9])
+        write_metrics(self.root, "UNet", "other", [0.1])
+        table = read_metrics_table(
+            self.root, columns=["model", "DSC"], filters={"tag": "model-compare", "model": "UNet"}
+        )
+        self.assertEqual(list(table.columns), ["model", "DSC"])
+        self.assertEqual(len(table), 3)
+        # full precision
+        self.assertIn(0.123456789, table["DSC"].tolist())
+        self.assertEqual(len(read_metrics_table(self.root, filters={"tag": ["model-compare", "other"]})), 5)
+
+    def test_fresh_log_replaces_parts(self):
+        write_metrics(self.root, "UNet", "model-compare", [0.1, 0.2, 0.3])
+        write_metrics(self.root, "UNet", "model-compare", [0.4])
+        self.assertEqual(read_metrics_table(self.root)["DSC"].tolist(), [0.4])
+
+    def test_resume_backfills_missing_rows(self):
+        write_metrics(self.root, "UNet", "model-compare", [0.1, 0.2])
+        # s2 reached the csv log but not a part before the crash
+        resume_rows = [
+            ["s0_msk", "0.10", "1.00", "2.00", "0.50", "ckpt"],
+            ["s1_msk", "0.20", "1.00", "2.00", "0.50", "ckpt"],
+            ["s2_msk", "0.30", "1.00", "2.00", "0.50", "ckpt"],
+        ]
+        writer = ParquetMetricsWriter(self.root, "femur", "UNet", "model-compare", run_id="UNet-run")
+        writer.open("ckpt", resume_rows)
+        writer.flush()
+        table = read_metrics_table(self.root, columns=["subject-id"])
+        self.assertEqual(sorted(table["subject-id"]), ["s0_msk", "s1_msk", "s2_msk"])
+
+    def test_compaction(self):
+        writer = write_metrics(self.root, "UNet", "model-compare", [0.1, 0.2, 0.3])
+        self.assertEqual(len(writer._parts()), 2)
+        writer.compact()
+        self.assertEqual(len(writer._parts()), 1)
+        self.assertEqual(sorted(read_metrics_table(self.root)["DSC"]), [0.1, 0.2, 0.3])
+
+    def test_resume_after_interrupted_compaction(self):
+        writer = write_metrics(self.root, "UNet", "model-compare", [0.1, 0.2, 0.3])
+        parts = writer._parts()
+        # the compacted part was written, the merged parts not yet removed
+        pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True).to_parquet(writer._part_path(writer.num_parts))
+        resume_rows = [[f"s{i}_msk", "0.10", "1.00", "2.00", "0.50", "ckpt"] for i in range(3)]
+        writer = ParquetMetricsWriter(self.root, "femur", "UNet", "model-compare", run_id="UNet-run")
+        writer.open("ckpt", resume_rows)
+        table = read_metrics_table(self.root)
+        self.assertEqual(sorted(table["DSC"]), [0.1, 0.2, 0.3])
+
+    def test_load_metric_logs(self):
+        write_metrics(self.root / "store", "UNet", "model-compare", [0.123456789, 0.5])
+        csv_path = self.root / "UNet-run" / "evaluation" / "metric-log.csv"
+        csv_path.parent.mkdir(parents=True)
+        pd.DataFrame(
+            {"subject-id": ["s0_msk", "s1_msk"], "DSC": [0.12, 0.5], "ASD": 1.0, "HD95": 2.0, "NSD": 0.5}
+        ).to_csv(csv_path, index=False)
+        index = {
+            run_id: {"model_name": model, "anatomy": "femur", "tags": [], "created": "", "metric_logs": {"evaluation": str(csv_path)}}
+            for run_id, model in [("UNet-run", "UNet"), ("csv-run", "SwinUNETR")]
+        }
+        table = load_metric_logs(index, "evaluation", parquet_dir=self.root / "store")
+        self.assertEqual(len(table), 4)
+        # full precision from the store, runs missing there from the csv logs
+        self.assertIn(0.123456789, table[table.run_id == "UNet-run"]["DSC"].tolist())
+        self.assertIn(0.12, table[table.run_id == "csv-run"]["DSC"].tolist())
+
+    def test_benchmark_runs(self):
+        # an older run, a domain shift evaluation and another model under the same tag
+        write_metrics(self.root, "UNet", "model-compare", [0.1, 0.2], run_id="old-run")
+        write_metrics(self.root, "UNet", "model-compare", [0.3, 0.4], run_id="new-run")
+        write_metrics(self.root, "UNet", "model-compare", [0.5, 0.6], run_id="new-run", subdir="domain_shift_lidc")
+        write_metrics(self.root, "SwinUNETR", "model-compare", [0.7, 0.8])
+        index = {
+            run_id: {
+                "model_name": model,
+                "anatomy": "femur",
+                "tags": ["model-compare"],
+                "created": created,
+                "metric_logs": {"evaluation": str(self.root / run_id / "metric-log.csv")},
+            }
+            for run_id, model, created in [
+                ("old-run", "UNet", "2023-01-01T00:00:00"),
+                ("new-run", "UNet", "2023-02-01T00:00:00"),
+                ("SwinUNETR-run", "SwinUNETR", "2023-01-15T00:00:00"),
+            ]
+        }
+        run_ids = select_benchmark_runs(index, ["model-compare"])
+        self.assertEqual(sorted(run_ids), ["SwinUNETR-run", "new-run"])
+        table = load_metric_logs(index, "evaluation", run_ids=run_ids, parquet_dir=self.root)
+        self.assertEqual(len(table), 4)
+        self.assertFalse(table.duplicated(["model", "subject-id"]).any())
+        self.assertEqual(sorted(table[table.model == "UNet"]["DSC"]), [0.3, 0.4])
+
+
+if __name__ == "__main__":
+    unittest.main()
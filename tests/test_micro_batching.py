@@ -0,0 +1,62 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from XrayTo3DShape import LatencyHistogram, MicroBatchScheduler
+
+
+class TestMicroBatchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def predict_fn(self, key, samples):
+        with self.lock:
+            self.batches.append((key, list(samples)))
+        time.sleep(0.01)
+        return [2 * sample for sample in samples]
+
+    def test_coalesce_and_order(self):
+        scheduler = MicroBatchScheduler(self.predict_fn, max_batch_size=4, max_wait=0.05)
+        with ThreadPoolExecutor(8) as executor:
+            results = list(
+                executor.map(lambda x: scheduler.submit(x).result(), range(8))
+            )
+        scheduler.close()
+        self.assertEqual(results, [2 * x for x in range(8)])
+        self.assertLess(len(self.batches), 8)
+        self.assertTrue(all(len(samples) <= 4 for _, samples in self.batches))
+
+    def test_batches_per_key(self):
+        scheduler = MicroBatchScheduler(self.predict_fn, max_batch_size=8, max_wait=0.05)
+        futures = [scheduler.submit(x, key=x % 2) for x in range(6)]
+        self.assertEqual([f.result() for f in futures], [2 * x for x in range(6)])
+        scheduler.close()
+        for key, samples in self.batches:
+            self.assertTrue(all(sample % 2 == key for sample in samples))
+        stats = scheduler.stats()
+        self.assertEqual(stats["keys"]["0"]["latency"]["count"], 3)
+
+    def test_lone_request_and_errors(self):
+        def failing(key, samples):
+            raise RuntimeError("cuda out of memory")
+
+        scheduler = MicroBatchScheduler(failing, max_wait=0.01)
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(1).result(timeout=5)
+        scheduler.close()
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(2)
+
+    def test_histogram(self):
+        histogram = LatencyHistogram(buckets_ms=(1, 10))
+        for seconds in (0.0005, 0.005, 0.005, 0.05):
+            histogram.record(seconds)
+        summary = histogram.summary()
+        self.assertEqual(summary["buckets"], {"<=1ms": 1, "<=10ms": 2, ">10ms": 1})
+        self.assertAlmostEqual(summary["p50_ms"], 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from XrayTo3DShape import (PackedDataset, VolumeAsInputExperiment, decode_xray,
+                           get_dataset, pack_dataset)
+
+IMAGE_SIZE = 16
+
+
+def get_fake_transforms(kasten=False):
+    """deterministic stand-in for the monai transforms"""
+
+    def xray_transform(key):
+        def transform(data):
+            torch.manual_seed(len(data[key]))
+            image = torch.rand(1, IMAGE_SIZE, IMAGE_SIZE)
+            if kasten and key == "ap":
+                image = image.unsqueeze(1).repeat(1, IMAGE_SIZE, 1, 1)
+            elif kasten:
+                image = image.unsqueeze(-1).repeat(1, 1, 1, IMAGE_SIZE)
+            return {key: image}
+
+        return transform
+
+    def seg_transform(data):
+        torch.manual_seed(len(data["seg"]))
+        seg = (torch.rand(1, IMAGE_SIZE, IMAGE_SIZE, IMAGE_SIZE) > 0.5).float()
+        meta = {
+            "filename_or_obj": data["seg"],
+            "affine": torch.eye(4),
+            "original_affine": torch.eye(4),
+        }
+        return {"seg": seg, "seg_meta_dict": meta}
+
+    return {
+        "ap": xray_transform("ap"),
+        "lat": xray_transform("lat"),
+        "seg": seg_transform,
+    }
+
+
+class TestPackedDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        rows = [
+            [f"{'a' * i}_ap.png", f"{'a' * i}_lat.png", f"{'a' * i}_msk.nii.gz"]
+            for i in range(1, 4)
+        ]
+        self.csv_path = root / "femur_test.csv"
+        pd.DataFrame(rows, columns=["ap", "lat", "seg"]).to_csv(self.csv_path)
+        self.shard_dir = root / "femur_shard"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_roundtrip(self):
+        transforms = get_fake_transforms()
+        pack_dataset(self.csv_path, transforms, self.shard_dir, xray_dtype="float16")
+        ds = get_dataset(str(self.shard_dir), transforms=None)
+        self.assertIsInstance(ds, PackedDataset)
+        self.assertEqual(len(ds), 3)
+
+        ap, lat, seg = ds[1]
+        expected_ap = transforms["ap"]({"ap": "aa_ap.png"})["ap"]
+        expected_seg = transforms["seg"]({"seg": "aa_msk.nii.gz"})["seg"]
+        # a view of the memory-map in the shard dtype
+        self.assertEqual(ap["ap"].dtype, torch.float16)
+        self.assertEqual(ap["ap"].data_ptr(), ds.ap[1].ctypes.data)
+        self.assertTrue(torch.allclose(decode_xray(ap["ap"]), expected_ap, atol=1e-3))
+        self.assertTrue(torch.equal(seg["seg"], expected_seg))
+        self.assertEqual(seg["seg_meta_dict"]["filename_or_obj"], "aa_msk.nii.gz")
+
+    def test_kasten(self):
+        transforms = get_fake_transforms(kasten=True)
+        pack_dataset(self.csv_path, transforms, self.shard_dir, xray_dtype="uint8")
+        ap, lat, _ = PackedDataset(self.shard_dir)[0]
+        expected_lat = transforms["lat"]({"lat": "a_lat.png"})["lat"]
+        # served as 2D images, expanded by the experiment
+        self.assertEqual(ap["ap"].shape, (1, IMAGE_SIZE, IMAGE_SIZE))
+        self.assertEqual(lat["lat"].dtype, torch.uint8)
+        self.assertTrue(torch.allclose(decode_xray(lat["lat"]), expected_lat[..., 0], atol=1 / 255))
+
+    def test_decode_after_batch_transfer(self):
+        transforms = get_fake_transforms()
+        pack_dataset(self.csv_path, transforms, self.shard_dir, xray_dtype="uint8")
+        batch = next(iter(DataLoader(PackedDataset(self.shard_dir), batch_size=3)))
+        experiment = VolumeAsInputExperiment(model=nn.Identity())
+        ap, lat, seg = experiment.on_after_batch_transfer(batch, 0)
+        self.assertEqual(ap["ap"].dtype, torch.float32)
+        self.assertTrue(torch.allclose(ap["ap"], batch[0]["ap"].float() / 255.0))
+        self.assertLessEqual(lat["lat"].max().item(), 1.0)
+        self.assertTrue(torch.equal(seg["seg"], batch[2]["seg"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import tempfile
+import time
+import unittest
+import warnings
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import torch
+
+from XrayTo3DShape import PersistentBaseDataset, get_nonkasten_transforms
+
+TEST_DIR = Path(__file__).parent
+
+
+class Payload:
+    """not a tensor, must not be unpickled from a cache file"""
+
+    def __reduce__(self):
+        return (print, ("unpickled",))
+
+
+class CountingTransform:
+    """fake transform that records how often it was called"""
+
+    def __init__(self, key, scale=1.0):
+        self.key = key
+        self.scale = scale
+        self.calls = 0
+
+    def __call__(self, data):
+        self.calls += 1
+        return {self.key: torch.full((1, 4, 4), self.scale * len(data[self.key]))}
+
+
+class TestPersistentBaseDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        self.data = []
+        for i in range(2):
+            sample = {}
+            for key in ("ap", "lat", "seg"):
+                path = root / f"{i}_{key}.png"
+                path.write_text(key)
+                sample[key] = str(path)
+            self.data.append(sample)
+        self.transforms = {k: CountingTransform(k) for k in ("ap", "lat", "seg")}
+        self.cache_dir = root / "cache"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_hit(self):
+        ds = PersistentBaseDataset(
+            self.data, self.transforms, self.cache_dir, {"size": 64}
+        )
+        ap, lat, seg = ds[0]
+        ap_cached, _, _ = ds[0]
+        self.assertEqual(self.transforms["ap"].calls, 1)
+        self.assertTrue(torch.equal(ap["ap"], ap_cached["ap"]))
+
+    def test_cache_invalidation(self):
+        ds = PersistentBaseDataset(
+            self.data, self.transforms, self.cache_dir, {"size": 64}
+        )
+        key = ds.get_cache_key(0)
+        other_params = PersistentBaseDataset(
+            self.data, self.transforms, self.cache_dir, {"size": 128}
+        )
+        self.assertNotEqual(key, other_params.get_cache_key(0))
+
+        time.sleep(0.01)
+        Path(self.data[0]["seg"]).write_text("modified")
+        self.assertNotEqual(key, ds.get_cache_key(0))
+
+    def test_transforms_in_cache_key(self):
+        ds = PersistentBaseDataset(self.data, self.transforms, self.cache_dir)
+        other_transforms = dict(self.transforms, seg=CountingTransform("seg", scale=2.0))
+        other_ds = PersistentBaseDataset(self.data, other_transforms, self.cache_dir)
+        self.assertNotEqual(ds.get_cache_key(0), other_ds.get_cache_key(0))
+
+    def test_unsafe_cache_file(self):
+        ds = PersistentBaseDataset(self.data, self.transforms, self.cache_dir)
+        cache_file = self.cache_dir / f"{ds.get_cache_key(0)}.pt"
+        torch.save(Payload(), cache_file)
+        with self.assertWarns(UserWarning):
+            ap, _, _ = ds[0]
+        self.assertEqual(self.transforms["ap"].calls, 1)
+        self.assertIsInstance(ap["ap"], torch.Tensor)
+
+    def test_monai_transforms(self):
+        seg_path = Path(self.tmp_dir.name) / "s_msk.nii.gz"
+        seg = np.zeros((32, 32, 32), dtype=np.uint8)
+        seg[8:24, 8:24, 8:24] = 1
+        nib.save(nib.Nifti1Image(seg, np.diag([1.5] * 3 + [1.0])), seg_path)
+        data = [
+            {
+                "ap": str(TEST_DIR / "sub-verse004_vert-16_ap.png"),
+                "lat": str(TEST_DIR / "sub-verse004_vert-16_lat.png"),
+                "seg": str(seg_path),
+            }
+        ]
+        transforms = get_nonkasten_transforms(size=32, resolution=1.5)
+        ds = PersistentBaseDataset(data, transforms, self.cache_dir)
+        _, _, seg_item = ds[0]
+        # meta tensors and their meta data load back with weights_only
+        with warnings.catch_warnings():
+            warnings.filterwarnings("error", message="could not load cache")
+            _, _, cached_seg_item = ds[0]
+        self.assertTrue(torch.equal(seg_item["seg"], cached_seg_item["seg"]))
+        self.assertEqual(
+            str(cached_seg_item["seg_meta_dict"]["filename_or_obj"]), str(seg_path)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import torch
+from torch import nn
+
+from XrayTo3DShape import get_trainer_precision, to_channels_last_3d
+
+
+class TestPrecision(unittest.TestCase):
+    def test_trainer_precision(self):
+        self.assertEqual(get_trainer_precision("32"), 32)
+        self.assertEqual(get_trainer_precision("bf16-mixed"), "bf16")
+        self.assertEqual(get_trainer_precision("16-mixed"), 16)
+        with self.assertRaises(ValueError):
+            get_trainer_precision("8")
+
+    def test_channels_last_3d(self):
+        model = nn.ModuleDict({"ap": nn.Conv2d(1, 4, 3), "decoder": nn.Conv3d(4, 1, 3)})
+        to_channels_last_3d(model)
+        self.assertTrue(
+            model["decoder"].weight.is_contiguous(memory_format=torch.channels_last_3d)
+        )
+        self.assertTrue(model["ap"].weight.is_contiguous())
+        output = model["decoder"](torch.rand(1, 4, 8, 8, 8))
+        self.assertEqual(output.shape, (1, 1, 6, 6, 6))
+
+
+if __name__ == "__main__":
+    unittest.main()
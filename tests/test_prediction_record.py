@@ -0,0 +1,58 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from XrayTo3DShape import NiftiPredictionWriter, VolumeAsInputExperiment
+
+
+def get_batch(size):
+    ap = {"ap": torch.rand(2, 1, size, size)}
+    lat = {"lat": torch.rand(2, 1, size, size)}
+    affine = torch.eye(4).repeat(2, 1, 1)
+    affine[:, :3, 3] = torch.tensor([10.0, 20.0, 30.0])
+    seg = {
+        "seg": (torch.rand(2, 1, size, size, size) > 0.5).float(),
+        "seg_meta_dict": {
+            "filename_or_obj": ["a_msk.nii.gz", "b_msk.nii.gz"],
+            "affine": affine,
+            "original_affine": affine.clone(),
+            "spatial_shape": torch.tensor([[size] * 3] * 2),
+            "original_channel_dim": torch.tensor([-1, -1]),
+        },
+    }
+    return ap, lat, seg
+
+
+class TestPredictionRecord(unittest.TestCase):
+    def setUp(self):
+        self.batch = get_batch(size=8)
+        experiment = VolumeAsInputExperiment(model=nn.Conv3d(2, 1, kernel_size=1))
+        with torch.no_grad():
+            self.prediction = experiment.predict_step(self.batch, 0)
+
+    def test_lean_record(self):
+        self.assertEqual(self.prediction["pred"].dtype, torch.uint8)
+        self.assertEqual(self.prediction["gt"].dtype, torch.uint8)
+        self.assertEqual(
+            set(self.prediction["seg_meta_dict"]),
+            {"filename_or_obj", "affine", "original_affine"},
+        )
+
+    def test_writer_keeps_batch_meta(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = NiftiPredictionWriter(tmp_dir, image_size=8, resolution=1.0)
+            writer.write_on_batch_end(None, None, self.prediction, None, self.batch, 0, 0)
+            writer.on_predict_end(None, None)
+            self.assertTrue((Path(tmp_dir) / "a_msk_pred.nii.gz").exists())
+            self.assertTrue((Path(tmp_dir) / "b_msk_gt.nii.gz").exists())
+        # the writer builds its own meta data instead of modifying the batch
+        self.assertTrue(
+            torch.equal(self.batch[2]["seg_meta_dict"]["affine"][0, :3, :3], torch.eye(3))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
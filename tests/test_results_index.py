@@ -0,0 +1,102 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from XrayTo3DShape import (
+    filter_runs,
+    load_metric_logs,
+    load_results_index,
+    select_run_per_model,
+    summarize_metrics,
+    write_run_info,
+)
+
+
+def write_metric_log(path, dsc):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(
+        {
+            "subject-id": ["s1_msk", "s2_msk"],
+            "DSC": dsc,
+            "ASD": [1.0, 2.0],
+            "HD95": [3.0, np.inf],
+            "NSD": [0.5, 0.7],
+        }
+    ).to_csv(path, index=False)
+
+
+class TestResultsIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        self.runs_dir, self.wandb_dir = root / "2d-3d-benchmark", root / "wandb"
+        self.cache_path = root / "results-index.json"
+
+        write_run_info(
+            self.runs_dir / "aaaa1111",
+            "aaaa1111",
+            "UNet",
+            "femur",
+            ["UNet", "femur", "DiceLoss", "model-compare"],
+            created="2023-01-01T00:00:00",
+        )
+        write_metric_log(self.runs_dir / "aaaa1111" / "evaluation" / "metric-log.csv", [0.8, 0.9])
+        # older run: metadata only in the local wandb files
+        files_dir = self.wandb_dir / "run-20230102_000000-bbbb2222" / "files"
+        files_dir.mkdir(parents=True)
+        (files_dir / "config.yaml").write_text(
+            "MODEL_NAME:\n  value: UNet\nANATOMY:\n  value: femur\nLOSS:\n  value: DiceLoss\n"
+        )
+        with open(files_dir / "wandb-metadata.json", "w") as f:
+            json.dump({"args": ["--tags", "model-compare", "--gpu", "0"]}, f)
+        write_metric_log(self.runs_dir / "bbbb2222" / "evaluation" / "metric-log.csv", [0.6, 0.7])
+        # run without any metadata is not indexed
+        write_metric_log(self.runs_dir / "cccc3333" / "evaluation" / "metric-log.csv", [0.1, 0.1])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load_index(self):
+        return load_results_index(self.runs_dir, self.wandb_dir, cache_path=self.cache_path)
+
+    def test_index(self):
+        index = self.load_index()
+        self.assertEqual(sorted(index), ["aaaa1111", "bbbb2222"])
+        self.assertIn("model-compare", index["bbbb2222"]["tags"])
+        runs = filter_runs(index, "femur", ["model-compare"])
+        self.assertEqual(select_run_per_model(runs), {"UNet": "bbbb2222"})
+        self.assertEqual(filter_runs(index, "femur", ["other-tag"]), {})
+
+    def test_cache(self):
+        index = self.load_index()
+        cache = json.loads(self.cache_path.read_text())
+        self.assertEqual(cache["runs"], index)
+        # a new metric log invalidates the cache
+        write_metric_log(self.runs_dir / "aaaa1111" / "domain_shift_x" / "metric-log.csv", [0.5, 0.5])
+        self.assertIn("domain_shift_x", self.load_index()["aaaa1111"]["metric_logs"])
+        # another wandb source is not served from the cache
+        write_metric_log(self.runs_dir / "aaaa1111" / "evaluation" / "nested" / "metric-log.csv", [0.5, 0.5])
+        index = load_results_index(self.runs_dir, None, cache_path=self.cache_path)
+        self.assertNotIn("bbbb2222", index)
+        self.assertNotIn("evaluation/nested", index["aaaa1111"]["metric_logs"])
+
+    def test_nested_metric_logs(self):
+        write_metric_log(self.runs_dir / "aaaa1111" / "angle_perturbation" / "5" / "metric-log.csv", [0.5, 0.5])
+        self.assertIn("angle_perturbation/5", self.load_index()["aaaa1111"]["metric_logs"])
+
+    def test_aggregation(self):
+        index = self.load_index()
+        table = load_metric_logs(index, "evaluation", num_workers=2)
+        self.assertEqual(len(table), 4)
+        means = summarize_metrics(table, by=["run_id"])
+        self.assertAlmostEqual(means.loc["aaaa1111"].DSC, 0.85)
+        # inf distances are ignored
+        self.assertAlmostEqual(means.loc["aaaa1111"].HD95, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
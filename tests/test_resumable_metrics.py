@@ -0,0 +1,95 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+import torch
+
+from XrayTo3DShape import MetricsLogger, get_checkpoint_hash, get_dataset, read_metric_log
+
+IMAGE_SIZE = 12
+
+
+def get_prediction(names):
+    seg = torch.zeros(len(names), 1, IMAGE_SIZE, IMAGE_SIZE, IMAGE_SIZE, dtype=torch.uint8)
+    seg[..., 3:9, 3:9, 3:9] = 1
+    return {"pred": seg, "gt": seg.clone(), "seg_meta_dict": {"filename_or_obj": names}}
+
+
+def run_logger(output_dir, batches, checkpoint_hash, resume):
+    logger = MetricsLogger(
+        output_dir, voxel_spacing=1.0, checkpoint_hash=checkpoint_hash, resume=resume
+    )
+    for batch_idx, names in enumerate(batches):
+        logger.write_on_batch_end(None, None, get_prediction(names), None, None, batch_idx, 0)
+    logger.on_predict_end(None, None)
+    return logger
+
+
+class TestResumableMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.log_path = self.output_dir / "metric-log.csv"
+        self.batches = [["a_msk.nii.gz", "b_msk.nii.gz"], ["c_msk.nii.gz", "d_msk.nii.gz"]]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume_after_crash(self):
+        run_logger(self.output_dir, self.batches[:1], "ckpt1", resume=False)
+        with open(self.log_path, "a") as f:
+            f.write("c_msk,0.9")  # partial row of a crashed run
+        logger = run_logger(self.output_dir, self.batches, "ckpt1", resume=True)
+        self.assertEqual(logger.scored_subjects, {"a_msk", "b_msk", "c_msk", "d_msk"})
+        rows = read_metric_log(self.log_path, "ckpt1")
+        self.assertEqual([row[0] for row in rows], ["a_msk", "b_msk", "c_msk", "d_msk"])
+        self.assertEqual(len(pd.read_csv(self.log_path)), 4)
+
+    def test_other_checkpoint_is_not_resumed(self):
+        run_logger(self.output_dir, self.batches, "ckpt1", resume=False)
+        logger = MetricsLogger(self.output_dir, voxel_spacing=1.0, checkpoint_hash="ckpt2", resume=True)
+        self.assertEqual(logger.scored_subjects, set())
+        self.assertEqual(read_metric_log(self.log_path, checkpoint_hash=None), [])
+
+    def test_log_without_checkpoint_column(self):
+        with open(self.log_path, "w") as f:
+            f.write("subject-id,DSC,ASD,HD95,NSD\na_msk,0.90,1.00,2.00,0.80\nb_msk,0.80,1.00,2.00,0.70\n")
+        # rows of an unknown checkpoint
+        rows = read_metric_log(self.log_path, checkpoint_hash=None)
+        self.assertEqual([row[0] for row in rows], ["a_msk", "b_msk"])
+        self.assertEqual({row[-1] for row in rows}, {""})
+        self.assertEqual(len(read_metric_log(self.log_path, "ckpt1")), 0)
+        with self.assertWarns(UserWarning):
+            logger = MetricsLogger(self.output_dir, voxel_spacing=1.0, checkpoint_hash="ckpt1", resume=True)
+        self.assertEqual(logger.scored_subjects, set())
+        logger.filestream.close()
+
+    def test_resume_log_without_checkpoint_column(self):
+        with open(self.log_path, "w") as f:
+            f.write("subject-id,DSC,ASD,HD95,NSD\na_msk,0.90,1.00,2.00,0.80\n")
+        logger = run_logger(self.output_dir, self.batches, None, resume=True)
+        self.assertEqual(logger.scored_subjects, {"a_msk", "b_msk", "c_msk", "d_msk"})
+        self.assertEqual(read_metric_log(self.log_path)[0], ["a_msk", "0.90", "1.00", "2.00", "0.80", ""])
+
+    def test_autoencoder_in_checkpoint_hash(self):
+        ckpt_path, ae_path = self.output_dir / "last.ckpt", self.output_dir / "ae.ckpt"
+        ckpt_path.write_bytes(b"predictor")
+        ae_path.write_bytes(b"autoencoder")
+        ckpt_hash = get_checkpoint_hash(ckpt_path)
+        self.assertEqual(get_checkpoint_hash(ckpt_path, autoencoder_path=None), ckpt_hash)
+        tl_hash = get_checkpoint_hash(ckpt_path, autoencoder_path=ae_path)
+        self.assertNotEqual(tl_hash, ckpt_hash)
+        ae_path.write_bytes(b"retrained autoencoder")
+        self.assertNotEqual(get_checkpoint_hash(ckpt_path, autoencoder_path=ae_path), tl_hash)
+
+    def test_exclude_subjects(self):
+        csv_path = self.output_dir / "femur_test.csv"
+        rows = [[f"{s}_ap.png", f"{s}_lat.png", f"{s}_msk.nii.gz"] for s in "abcd"]
+        pd.DataFrame(rows, columns=["ap", "lat", "seg"]).to_csv(csv_path)
+        dataset = get_dataset(str(csv_path), transforms={}, exclude_subjects={"a_msk", "c_msk"})
+        self.assertEqual([d["seg"] for d in dataset.data], ["b_msk.nii.gz", "d_msk.nii.gz"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import torch
+from torch import nn
+
+from XrayTo3DShape import ParallelHeadsExperiment, VolumeAsInputExperiment, expand_kasten_views
+
+
+class PointwiseHeads(nn.Module):
+    """voxel (d,h,w) depends only on ap[h,w] and lat[d,h]"""
+
+    def forward(self, ap, lat):
+        ap_volume, lat_volume = expand_kasten_views(ap, lat)
+        return ap_volume - lat_volume
+
+
+def get_batch(size):
+    ap = {"ap": torch.rand(2, 1, size, size)}
+    lat = {"lat": torch.rand(2, 1, size, size)}
+    seg = {
+        "seg": (torch.rand(2, 1, size, size, size) > 0.5).float(),
+        "seg_meta_dict": {"filename_or_obj": ["a.nii.gz", "b.nii.gz"]},
+    }
+    return ap, lat, seg
+
+
+class TestSlidingWindowPrediction(unittest.TestCase):
+    def check_same_as_full_volume(self, model, experiment_class):
+        batch = get_batch(size=24)
+        full = experiment_class(model=model).predict_step(batch, 0)
+        windowed = experiment_class(model=model, patch_size=16, sw_overlap=0.5)
+        windowed = windowed.predict_step(batch, 0)
+        self.assertEqual(windowed["pred"].shape, full["pred"].shape)
+        self.assertTrue(torch.equal(windowed["pred"], full["pred"]))
+
+    def test_volume_as_input(self):
+        model = nn.Conv3d(2, 1, kernel_size=1)
+        with torch.no_grad():
+            self.check_same_as_full_volume(model, VolumeAsInputExperiment)
+
+    def test_parallel_heads(self):
+        # windows of the radiographs are not valid inputs of the parallel heads
+        with self.assertRaises(ValueError):
+            ParallelHeadsExperiment(model=PointwiseHeads(), patch_size=16)
+        ParallelHeadsExperiment(model=PointwiseHeads())
+
+
+if __name__ == "__main__":
+    unittest.main()
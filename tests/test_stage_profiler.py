@@ -0,0 +1,55 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from XrayTo3DShape import StageProfiler
+
+
+def run_steps(profiler, num_steps):
+    model = torch.nn.Linear(8, 1)
+    for step in range(num_steps):
+        profiler.start_step(torch.device("cpu"), measure_data_wait=step > 0)
+        with profiler.stage("forward"):
+            loss = model(torch.rand(4, 8)).mean()
+        with profiler.stage("backward"):
+            loss.backward()
+        profiler.end_step()
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_warmup_and_summary(self):
+        profiler = StageProfiler(skip_first=2, num_steps=3)
+        run_steps(profiler, 6)
+        records = profiler.get_records()
+        self.assertEqual(sorted(records["step"].unique()), [2, 3, 4])
+        summary = profiler.summary()
+        self.assertEqual(list(summary.index), ["data_wait", "forward", "backward", "step"])
+        self.assertEqual(summary.loc["forward", "count"], 3)
+        self.assertAlmostEqual(summary.loc["step", "step_share"], 1.0)
+        # no cuda timing on the cpu
+        self.assertTrue(summary["device_ms_mean"].isna().all())
+
+    def test_disabled_stages_are_not_recorded(self):
+        profiler = StageProfiler(skip_first=10)
+        run_steps(profiler, 3)
+        self.assertTrue(profiler.get_records().empty)
+        self.assertTrue(profiler.summary().empty)
+
+    def test_export(self):
+        profiler = StageProfiler(skip_first=0)
+        run_steps(profiler, 2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = profiler.export(tmp_dir, "UNet")
+            with open(paths["trace"]) as f:
+                trace = json.load(f)
+            names = [event["name"] for event in trace["traceEvents"]]
+            self.assertEqual(names.count("forward"), 2)
+            self.assertTrue(all(event["ph"] == "X" for event in trace["traceEvents"]))
+            self.assertTrue(Path(paths["summary"]).name.startswith("UNet"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+import torch
+from monai.metrics.hausdorff_distance import HausdorffDistanceMetric
+from monai.metrics.meandice import DiceMetric
+from monai.metrics.surface_distance import SurfaceDistanceMetric
+from scipy.ndimage import distance_transform_edt as scipy_edt
+from surface_distance.metrics import (
+    compute_surface_distances,
+    compute_surface_overlap_at_tolerance,
+)
+
+from XrayTo3DShape import compute_surface_metrics, distance_transform_edt
+
+
+def get_random_blobs(batch_size, size=24, seed=0):
+    """smooth random binary blobs (B,1,D,H,W)"""
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.rand(batch_size, 1, size // 4, size // 4, size // 4, generator=generator)
+    noise = torch.nn.functional.interpolate(noise, size=size, mode="trilinear")
+    return (noise > 0.55).float()
+
+
+class TestDistanceTransform(unittest.TestCase):
+    def test_matches_scipy(self):
+        mask = torch.rand(2, 9, 11, 7) > 0.2
+        for spacing in [None, (1.5, 1.0, 0.5)]:
+            expected = np.stack(
+                [scipy_edt(m.numpy(), sampling=spacing) for m in mask]
+            )
+            actual = distance_transform_edt(mask, spacing=spacing, chunk_size=64)
+            np.testing.assert_allclose(actual.numpy(), expected, rtol=1e-5)
+
+
+class TestSurfaceMetrics(unittest.TestCase):
+    def test_matches_reference(self):
+        pred, gt = get_random_blobs(3, seed=0), get_random_blobs(3, seed=1)
+        voxel_spacing, tolerance = 1.5, 1.5
+        metrics = compute_surface_metrics(
+            pred, gt, voxel_spacing=voxel_spacing, nsd_tolerance=tolerance
+        )
+
+        dsc = DiceMetric()(pred, gt).flatten().numpy()
+        asd = SurfaceDistanceMetric()(pred, gt).flatten().numpy()
+        hd95 = HausdorffDistanceMetric(percentile=95)(pred, gt).flatten().numpy()
+        nsd = [
+            compute_surface_overlap_at_tolerance(
+                compute_surface_distances(
+                    g.numpy().astype(bool).squeeze(),
+                    p.numpy().astype(bool).squeeze(),
+                    (voxel_spacing,) * 3,
+                ),
+                tolerance,
+            )[0]
+            for p, g in zip(pred, gt)
+        ]
+        np.testing.assert_allclose(metrics["DSC"].numpy(), dsc, rtol=1e-5)
+        np.testing.assert_allclose(metrics["ASD"].numpy(), asd, rtol=1e-4)
+        np.testing.assert_allclose(metrics["HD95"].numpy(), hd95, rtol=1e-4)
+        np.testing.assert_allclose(metrics["NSD"].numpy(), nsd, rtol=1e-6)
+
+    def test_empty_masks(self):
+        gt = get_random_blobs(2)
+        pred = torch.zeros_like(gt)
+        metrics = compute_surface_metrics(pred, gt)
+        self.assertTrue(torch.isinf(metrics["ASD"]).all())
+        self.assertTrue(torch.isinf(metrics["HD95"]).all())
+        self.assertTrue((metrics["NSD"] == 0).all())
+
+        metrics = compute_surface_metrics(pred, pred)
+        self.assertTrue(torch.isnan(metrics["HD95"]).all())
+        self.assertTrue(torch.isnan(metrics["DSC"]).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
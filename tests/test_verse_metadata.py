@@ -0,0 +1,84 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from XrayTo3DShape import VerseExcelSheet, VerseKeys
+
+
+def write_sheet(path, subjects=(4, 61)):
+    columns = {"verse_ID": list(subjects), "CT_device": ["Siemens", "Philips"], "Res": [1.0, 0.8], "BMD": [110.0, 90.0]}
+    for vertebra_number in range(8, 26):
+        vertebra_name = VerseExcelSheet.get_vertebra_name(vertebra_number)
+        columns[f"{vertebra_name}_fx-s"] = [np.nan, 0.0]
+        columns[f"{vertebra_name}_fx-g"] = [np.nan, 0.0]
+    columns["T9_fx-s"], columns["T9_fx-g"] = [1.0, "x"], [2.0, "x"]
+    pd.DataFrame(columns).to_excel(path, index=False)
+
+
+@unittest.skipUnless(importlib.util.find_spec("openpyxl"), "requires openpyxl")
+class TestVerseMetadata(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sheet_path = Path(self.tmp_dir.name) / "annotations.xlsx"
+        write_sheet(self.sheet_path)
+        cache_home = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": str(Path(self.tmp_dir.name) / "cache")})
+        cache_home.start()
+        self.addCleanup(cache_home.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_annotate_matches_row_lookups(self):
+        metadata = VerseExcelSheet(str(self.sheet_path))
+        metric_log = pd.DataFrame(
+            {
+                "subject-id": [
+                    "sub-verse004_16_seg-vert_msk",
+                    "sub-verse061_16_seg-vert_msk",
+                    "sub-verse410_split-verse061_vert-3_seg-vert_msk",
+                    "sub-verse004_22_seg-vert_msk",
+                ],
+                "DSC": [0.9, 0.8, 0.7, 0.6],
+            }
+        )
+        annotated = metadata.annotate(metric_log)
+        self.assertEqual(list(annotated.columns), ["subject-id", "DSC", "shape", "severity", "level"])
+        for _, row in annotated.iterrows():
+            keys = metadata.get_vertebra_keys(row["subject-id"])
+            self.assertEqual(row["shape"], metadata.get_shape(keys))
+            self.assertEqual(row["severity"], metadata.get_severity(keys))
+            self.assertEqual(row["level"], metadata.get_vertebra_level(keys))
+        self.assertEqual(annotated["shape"].tolist()[:2], [VerseKeys.WEDGE, VerseKeys.FOREIGN_MATERIAL])
+        self.assertEqual(metadata.get_ct_device({VerseKeys.SUBJECT: 61}), "Philips")
+
+    def test_sheet_is_parsed_once(self):
+        VerseExcelSheet(str(self.sheet_path))
+        with mock.patch("pandas.read_excel", side_effect=AssertionError("sheet parsed again")):
+            metadata = VerseExcelSheet(str(self.sheet_path))
+        self.assertEqual(len(metadata.metadata_table), 2 * 25)
+        # cached in the user cache directory, not next to the sheet
+        self.assertTrue(str(metadata.cache_path).startswith(str(Path(self.tmp_dir.name) / "cache")))
+        self.assertEqual(sorted(p.name for p in self.sheet_path.parent.glob("*.pkl")), [])
+
+    def test_corrupt_cache_warns(self):
+        metadata = VerseExcelSheet(str(self.sheet_path))
+        metadata.cache_path.write_bytes(b"not a pickle")
+        with self.assertWarns(RuntimeWarning):
+            VerseExcelSheet(str(self.sheet_path))
+
+    def test_repeated_subject(self):
+        write_sheet(self.sheet_path, subjects=(4, 4))
+        with self.assertWarns(RuntimeWarning):
+            metadata = VerseExcelSheet(str(self.sheet_path))
+        self.assertEqual(metadata.get_ct_device({VerseKeys.SUBJECT: 4}), "Siemens")
+        self.assertEqual(len(metadata._get_excel_row({VerseKeys.SUBJECT: 4})), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import random
+import time
+import unittest
+
+from XrayTo3DShape import OrderedWorkerPool
+
+
+def slow_square(x):
+    time.sleep(random.uniform(0, 0.01))
+    return x * x
+
+
+class TestOrderedWorkerPool(unittest.TestCase):
+    def test_results_in_submission_order(self):
+        for num_workers in [0, 1, 4]:
+            results = []
+            pool = OrderedWorkerPool(num_workers=num_workers, max_pending=3)
+            for i in range(20):
+                pool.submit(slow_square, i, callback=results.append)
+                self.assertLessEqual(len(pool.pending), 3)
+            pool.flush()
+            self.assertEqual(results, [i * i for i in range(20)])
+
+    def test_job_exception_is_raised(self):
+        pool = OrderedWorkerPool(num_workers=2)
+        # raised by `submit` if the job already finished, by `flush` otherwise
+        with self.assertRaises(ZeroDivisionError):
+            pool.submit(lambda: 1 / 0)
+            pool.flush()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ script to train various architectures on given dataset
 import argparse
 import os
 import sys
+from datetime import datetime
 from pathlib import Path
 
 import monai.data.meta_obj as monai_meta_obj
@@ -21,19 +22,26 @@ from torch.utils.data.dataloader import DataLoader
 import wandb
 import XrayTo3DShape
 from XrayTo3DShape import (
+    LABEL_FORMATS,
+    PRECISION_MODES,
     AutoencoderExperiment,
     BaseExperiment,
     CustomAutoEncoder,
     TLPredictorExperiment,
     anatomy_resolution_dict,
+    compile_model,
     get_anatomy_from_path,
     get_dataset,
     get_loss,
     get_model,
     get_model_config,
+    get_trainer_precision,
+    get_transform_family_from_model_name,
     get_transform_from_model_name,
     model_experiment_dict,
+    StageProfiler,
     printarr,
+    write_run_info,
 )
 
 np.set_printoptions(precision=2, suppress=True)
@@ -71,19 +79,105 @@ def parse_training_arguments():
 
     parser.add_argument("--gpu", type=int, default=0)
     parser.add_argument("--accelerator", default="gpu")
+    parser.add_argument(
+        "--devices",
+        type=int,
+        default=None,
+        help="number of devices per node, overrides --gpu. with --accelerator cpu and --strategy ddp, processes use the gloo backend",
+    )
+    parser.add_argument("--num_nodes", type=int, default=1)
+    parser.add_argument(
+        "--strategy",
+        default=None,
+        help="lightning strategy e.g. ddp, ddp_find_unused_parameters_false, fsdp",
+    )
+    parser.add_argument(
+        "--global_batch_size",
+        type=int,
+        default=None,
+        help="split this batch size over all processes instead of using --batch_size per process",
+    )
+    parser.add_argument(
+        "--scale_lr",
+        default=False,
+        action="store_true",
+        help="scale --lr linearly with the number of processes",
+    )
     parser.add_argument("--num_workers", default=4, type=int)
+    parser.add_argument(
+        "--lazy_kasten",
+        default=False,
+        action="store_true",
+        help="expand AP/LAT images into volumes on the device instead of the dataloader",
+    )
+    parser.add_argument(
+        "--label_format",
+        choices=LABEL_FORMATS,
+        default="float32",
+        help="carry segmentation labels through the dataloader as float32, uint8 or packed bits",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        type=str,
+        help="cache preprocessed samples on disk in this directory",
+    )
 
     parser.add_argument("--dropout", default=False, action="store_true")
+    parser.add_argument(
+        "--checkpoint_segments",
+        default=0,
+        type=int,
+        help="recompute 3D decoder activations in backward in this many segments, 0 disables it",
+    )
     parser.add_argument("--load_autoencoder_from", default="", type=str)
     parser.add_argument('--load_model_from', default=None,type=str)
     parser.add_argument("--top_k_checkpoints", default=3, type=int)
 
-    parser.add_argument("--precision", default=32, type=int)
+    parser.add_argument(
+        "--precision",
+        default="32",
+        choices=PRECISION_MODES,
+        help="fp32, bfloat16 autocast or float16 autocast with loss scaling",
+    )
+    parser.add_argument(
+        "--channels_last",
+        default=False,
+        action="store_true",
+        help="store 3D convolution weights and volumes in channels_last_3d memory format",
+    )
+    parser.add_argument(
+        "--compile",
+        default=False,
+        action="store_true",
+        help="torch.compile the model forward, graph breaks are reported before training",
+    )
+    parser.add_argument(
+        "--compile_mode",
+        default="default",
+        choices=["default", "reduce-overhead", "max-autotune"],
+    )
+    parser.add_argument(
+        "--profile_stages",
+        default=False,
+        action="store_true",
+        help="record wall time, device time and peak memory of each stage of the training step, "
+        "exported as a chrome trace and summary table to runs/<project>/<run-id>/profile",
+    )
+    parser.add_argument(
+        "--profile_skip_steps", default=5, type=int, help="warm-up steps that are not profiled"
+    )
+    parser.add_argument(
+        "--profile_steps", default=None, type=int, help="number of steps to profile, all if not set"
+    )
+    parser.add_argument(
+        "--profile_synchronize",
+        default=False,
+        action="store_true",
+        help="synchronize the device around each stage so that wall times include the device work",
+    )
 
     args = parser.parse_args()
-
-    if args.precision == 16:
-        args.precision = "bf16"
     return args
 
 
@@ -108,7 +202,22 @@ def update_args(args):
     # ), f"({args.size},{args.res}) does not match ({orig_size},{orig_res})"
     args.experiment_name = model_experiment_dict[args.model_name]
 
-    args.precision = 16 if args.gpu == 0 else 32  # use bfloat16 on RTX 3090
+    args.transform_family = get_transform_family_from_model_name(args.model_name)
+    if args.cache_dir and args.transform_family == "denoising_autoencoder":
+        print("noisy labels are sampled on every epoch, disabling on-disk cache")
+        args.cache_dir = None
+
+    # distributed training: batch size and lr are per process
+    args.world_size = (args.devices if args.devices else 1) * args.num_nodes
+    if args.global_batch_size:
+        if args.global_batch_size % args.world_size != 0:
+            raise ValueError(
+                f"global batch size {args.global_batch_size} is not divisible by {args.world_size} processes"
+            )
+        args.batch_size = args.global_batch_size // args.world_size
+    args.global_batch_size = args.batch_size * args.world_size
+    if args.scale_lr:
+        args.lr = args.lr * args.world_size
 
 
 if __name__ == "__main__":
@@ -137,18 +246,41 @@ if __name__ == "__main__":
     seed_everything(seed=SEED)
 
     train_transforms = get_transform_from_model_name(
-        model_name, image_size=IMG_SIZE, resolution=IMG_RESOLUTION
+        model_name,
+        image_size=IMG_SIZE,
+        resolution=IMG_RESOLUTION,
+        lazy_kasten=args.lazy_kasten,
+        label_format=args.label_format,
     )
 
+    transform_params = {
+        "size": IMG_SIZE,
+        "resolution": IMG_RESOLUTION,
+        "family": args.transform_family,
+        "lazy_kasten": args.lazy_kasten,
+        "label_format": args.label_format,
+    }
     train_loader = DataLoader(
-        get_dataset(args.trainpaths, transforms=train_transforms),
+        get_dataset(
+            args.trainpaths,
+            transforms=train_transforms,
+            cache_dir=args.cache_dir,
+            transform_params=transform_params,
+            label_format=args.label_format,
+        ),
         batch_size=BATCH_SIZE,
         num_workers=args.num_workers,
         shuffle=True,
         drop_last=True,
     )
     val_loader = DataLoader(
-        get_dataset(args.valpaths, transforms=train_transforms),
+        get_dataset(
+            args.valpaths,
+            transforms=train_transforms,
+            cache_dir=args.cache_dir,
+            transform_params=transform_params,
+            label_format=args.label_format,
+        ),
         batch_size=BATCH_SIZE,
         num_workers=args.num_workers,
         shuffle=False,
@@ -156,7 +288,10 @@ if __name__ == "__main__":
     )
 
     model = get_model(
-        model_name=args.model_name, image_size=IMG_SIZE, dropout=args.dropout
+        model_name=args.model_name,
+        image_size=IMG_SIZE,
+        dropout=args.dropout,
+        checkpoint_segments=args.checkpoint_segments,
     )
     loss_function = get_loss(
         loss_name=LOSS_NAME,
@@ -168,9 +303,25 @@ if __name__ == "__main__":
     )
     optimizer = Adam(model.parameters(), lr)
 
+    stage_profiler = (
+        StageProfiler(
+            name=model_name,
+            skip_first=args.profile_skip_steps,
+            num_steps=args.profile_steps,
+            synchronize=args.profile_synchronize,
+        )
+        if args.profile_stages
+        else None
+    )
     # load pytorch lightning module
     experiment: BaseExperiment = getattr(XrayTo3DShape.experiments, experiment_name)(
-        model, optimizer, loss_function, BATCH_SIZE
+        model,
+        optimizer,
+        loss_function,
+        BATCH_SIZE,
+        label_format=args.label_format,
+        channels_last=args.channels_last,
+        stage_profiler=stage_profiler,
     )
     if experiment_name == CustomAutoEncoder.__name__:
         experiment.make_sparse = args.make_sparse
@@ -214,6 +365,8 @@ if __name__ == "__main__":
     loss = experiment.loss_function(pred_logits, batch_output).item()  # type: ignore
     input_zero = batch_input[0]
     printarr(pred_logits, batch_output, input_zero, loss)
+    if args.compile:
+        compile_model(model, example_inputs=batch_input, mode=args.compile_mode)
     print(
         f"training samples {len(train_loader.dataset)} validation samples {len(val_loader.dataset)}"
     )
@@ -228,12 +381,19 @@ if __name__ == "__main__":
         tags=WANDB_TAGS,
     )
     wandb_logger.watch(model, log_graph=False)
-    MODEL_CONFIG = get_model_config(model_name, IMG_SIZE)
+    MODEL_CONFIG = get_model_config(
+        model_name, IMG_SIZE, checkpoint_segments=args.checkpoint_segments
+    )
     # save hyperparameters
     HYPERPARAMS = {
         "IMG_SIZE": IMG_SIZE,
         "RESOLUTION": IMG_RESOLUTION,
         "BATCH_SIZE": BATCH_SIZE,
+        "GLOBAL_BATCH_SIZE": args.global_batch_size,
+        "WORLD_SIZE": args.world_size,
+        "PRECISION": args.precision,
+        "CHANNELS_LAST": args.channels_last,
+        "COMPILE": args.compile_mode if args.compile else None,
         "LR": lr,
         "SEED": SEED,
         "ANATOMY": ANATOMY,
@@ -257,11 +417,17 @@ if __name__ == "__main__":
         filename=CHECKPOINT_FILENAME,
         auto_insert_metric_name=False,
     )
+    # under ddp, lightning replaces the samplers of the train/val loaders
+    # with a DistributedSampler that shards the dataset across processes
     trainer = pl.Trainer(
         accelerator=args.accelerator,
-        precision=args.precision,
+        precision=get_trainer_precision(args.precision),
         max_epochs=NUM_EPOCHS,
-        devices=[args.gpu],
+        devices=args.devices if args.devices else [args.gpu],
+        num_nodes=args.num_nodes,
+        strategy=args.strategy,
+        sync_batchnorm=args.world_size > 1,
+        replace_sampler_ddp=True,
         deterministic=False,
         log_every_n_steps=1,
         auto_select_gpus=True,
@@ -272,6 +438,18 @@ if __name__ == "__main__":
         max_steps=args.steps,
     )
 
+    if trainer.is_global_zero:
+        # local run metadata for the results index of the benchmark table scripts
+        write_run_info(
+            Path("runs") / WANDB_PROJECT / str(wandb_logger.version),
+            run_id=str(wandb_logger.version),
+            model_name=model_name,
+            anatomy=ANATOMY,
+            tags=WANDB_TAGS,
+            created=datetime.now().isoformat(timespec="seconds"),
+            config=HYPERPARAMS,
+        )
+
     trainer.fit(experiment, train_loader, val_loader)
 
     wandb.finish()